@@ -0,0 +1,146 @@
+"""
+Benchmark of the query string parser: the single pass parse_query against
+the previous two pass parse_filters + parse_sort implementation, both over
+the request.args MultiDict as in get_url_query_ctx.
+
+  python -m benchmarks.bench_qs_parser
+"""
+import timeit
+
+from werkzeug.datastructures import MultiDict
+
+from flask_sqlalchemy_qs.qs_parser.main import parse_query
+
+def legacy_parse_filters(items):
+  filters = {}
+
+  for key, value in items:
+    if key.startswith("filters"):
+      parts = key.split("[")
+      target_dict = filters
+      parts.pop(0)
+
+      for i, part in enumerate(parts):
+        part = part[:-1]
+
+        if i == len(parts) -1:
+          if value == 'true':
+            target_dict[part] = True
+          elif value == 'false':
+            target_dict[part] = False
+          elif value == 'null':
+            target_dict[part] = None
+          else:
+            if part.isdigit():
+              target_dict[int(part)] = value
+            else:
+              target_dict[part] = value
+
+        elif part in ["in", "nin"]:
+          if part not in target_dict:
+            target_dict[part] = []
+
+          idx = int(parts[i + 1][:-1])
+
+          if idx >= len(target_dict[part]):
+            target_dict[part].extend([None] * (idx + 1 - len(target_dict[part])))
+
+          target_dict = target_dict[part]
+
+        elif part in ['and', 'or', 'not']:
+          if part not in target_dict:
+            target_dict[part] = []
+
+          idx = int(parts[i + 1][:-1])
+
+          if idx >= len(target_dict[part]):
+            target_dict[part].extend([{}] * (idx + 1 - len(target_dict[part])))
+
+          target_dict = target_dict[part][idx]
+
+        elif not part.isdigit():
+          if part not in target_dict:
+            target_dict[part] = {}
+          target_dict = target_dict[part]
+
+  return filters
+
+def legacy_parse_sort(items):
+  sorts = []
+
+  for key, value in items:
+    if key.startswith("sorts"):
+      parts = key.split("[")
+      target_dict = {}
+      parts.pop(0)
+
+      for i, part in enumerate(parts):
+        part = part[:-1]
+
+        if part.isdigit():
+          idx = int(part)
+          len_sort = len(sorts)
+
+          if(idx >= len_sort):
+            sorts.extend([{}] * (idx + 1 - len_sort))
+
+          target_dict = sorts[idx]
+        elif i == len(parts) -1:
+          target_dict[part] = value
+        elif i < len(parts) - 1:
+          field = part
+
+          if field not in target_dict:
+            target_dict[field] = {}
+
+          target_dict = target_dict[field]
+
+  return sorts
+
+def legacy_parse(args):
+  return {
+    "filters": legacy_parse_filters(args.items(multi=True)),
+    "offset": args.get("offset", default=0, type=int),
+    "limit": args.get("limit", default=10, type=int),
+    "sorts": legacy_parse_sort(args.items(multi=True))
+  }
+
+def make_items(size: int):
+  """
+  Query string items with in lists, boolean trees, relationships and sorts.
+  """
+  items = []
+
+  for i in range(size):
+    kind = i % 4
+
+    if kind == 0:
+      items.append((f"filters[person][age][in][{i // 4}]", str(i)))
+    elif kind == 1:
+      items.append((f"filters[or][{i // 4}][and][0][person][name][contains]", f"name_{i}"))
+    elif kind == 2:
+      items.append((f"filters[field_{i}][eq]", "true"))
+    else:
+      items.append((f"sorts[{i // 4}][person][field_{i}]", "DESC"))
+
+  items.append(("limit", "50"))
+  items.append(("offset", "100"))
+
+  return items
+
+def run(sizes=(10, 100, 500), number=200):
+  results = []
+
+  for size in sizes:
+    args = MultiDict(make_items(size))
+    legacy = min(timeit.repeat(lambda: legacy_parse(args), number=number, repeat=5)) / number
+    current = min(timeit.repeat(lambda: parse_query(args.items(multi=True)), number=number, repeat=5)) / number
+    results.append((size, legacy, current))
+
+  return results
+
+if __name__ == "__main__":
+  print(f"{'params':>8} {'legacy (us)':>12} {'parse_query (us)':>17} {'speedup':>8}")
+
+  for size, legacy, current in run():
+    print(f"{size:>8} {legacy * 1e6:>12.1f} {current * 1e6:>17.1f} {legacy / current:>7.2f}x")
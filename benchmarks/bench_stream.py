@@ -0,0 +1,83 @@
+"""
+Benchmark of the memory used to iterate over a large filtered table with
+BaseQuery.stream_by_ctx (yield_per) against Query.all().
+
+  python -m benchmarks.bench_stream --rows 1000000
+"""
+import argparse
+import os
+import tempfile
+import time
+import tracemalloc
+
+from sqlalchemy import Column, Integer, String, create_engine, insert
+from sqlalchemy.orm import declarative_base, sessionmaker
+
+from flask_sqlalchemy_qs import BaseQuery
+
+Base = declarative_base()
+
+class Item(Base):
+  __tablename__ = "items"
+
+  id    = Column(Integer, primary_key=True)
+  name  = Column(String(50))
+  value = Column(Integer)
+
+def create_table(url: str, rows: int, batch: int = 50000):
+  engine = create_engine(url)
+  Base.metadata.create_all(engine)
+
+  with engine.begin() as conn:
+    for start in range(0, rows, batch):
+      conn.execute(insert(Item), [
+        {"name": f"item_{i}", "value": i % 100} for i in range(start, min(start + batch, rows))
+      ])
+
+  return engine
+
+def measure(session, mode: str, filters, batch_size: int):
+  """
+  Iterate over the results and return (rows, seconds, peak MiB).
+  """
+  session.expunge_all()
+  tracemalloc.start()
+  start = time.perf_counter()
+  count = 0
+
+  if mode == "stream":
+    items = session.query(Item).stream_by_ctx(filters=filters, sorts=[{"id": "ASC"}], batch_size=batch_size)
+  else:
+    items = session.query(Item).filter_by_ctx(filters).sort_by_ctx([{"id": "ASC"}]).all()
+
+  for _ in items:
+    count += 1
+
+  del items
+  elapsed = time.perf_counter() - start
+  _, peak = tracemalloc.get_traced_memory()
+  tracemalloc.stop()
+
+  return count, elapsed, peak / 2 ** 20
+
+def run(rows: int, batch_size: int):
+  with tempfile.TemporaryDirectory() as directory:
+    engine = create_table("sqlite:///" + os.path.join(directory, "bench.db"), rows)
+    session = sessionmaker(bind=engine, query_cls=BaseQuery)()
+    filters = {"value": {"gte": "0"}}
+    results = [(mode,) + measure(session, mode, filters, batch_size) for mode in ("stream", "all")]
+    session.close()
+    engine.dispose()
+
+  return results
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser()
+  parser.add_argument("--rows", type=int, default=1000000)
+  parser.add_argument("--batch-size", type=int, default=1000)
+  args = parser.parse_args()
+
+  print(f"{'mode':>8} {'rows':>9} {'seconds':>8} {'peak MiB':>9}")
+
+  for mode, count, elapsed, peak in run(args.rows, args.batch_size):
+    print(f"{mode:>8} {count:>9} {elapsed:>8.2f} {peak:>9.1f}")
@@ -0,0 +1,308 @@
+"""
+Benchmark suite of the query string parser, the filter compiler and the
+end-to-end latency of typical endpoints over a synthetic SQLite dataset of
+users, persons and emails.
+
+The medians are compared with a baseline file and the benchmarks slower
+than the threshold are reported as regressions (exit code 1):
+
+  python -m benchmarks.bench_suite --rows 200000
+  python -m benchmarks.bench_suite --rows 200000 --save-baseline
+  python -m benchmarks.bench_suite --quick
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import time
+from typing import Callable, Dict, List
+
+import sqlalchemy
+from flask import Flask, jsonify
+from sqlalchemy import JSON, Column, ForeignKey, Integer, String, create_engine, insert
+from sqlalchemy.orm import declarative_base, relationship, scoped_session, sessionmaker
+from werkzeug.datastructures import MultiDict
+
+from flask_sqlalchemy_qs import BaseQuery, CtxBuilder, get_url_query_ctx, parse_filters, parse_query, parse_sort
+
+BASELINE = os.path.join(os.path.dirname(__file__), "baseline.json")
+THRESHOLD = 0.25
+
+Base = declarative_base()
+
+class User(Base):
+  __tablename__ = "users"
+
+  id        = Column(Integer, primary_key=True)
+  username  = Column(String(50), unique=True)
+  json_data = Column(JSON, nullable=True)
+  person    = relationship("Person", uselist=False, back_populates="user")
+  emails    = relationship("Email", back_populates="user")
+
+class Person(Base):
+  __tablename__ = "persons"
+
+  id      = Column(Integer, primary_key=True)
+  name    = Column(String(120))
+  age     = Column(Integer)
+  user_id = Column(Integer, ForeignKey("users.id"), index=True)
+  user    = relationship("User", back_populates="person")
+
+class Email(Base):
+  __tablename__ = "emails"
+
+  id      = Column(Integer, primary_key=True)
+  address = Column(String(50), unique=True)
+  user_id = Column(Integer, ForeignKey("users.id"), index=True)
+  user    = relationship("User", back_populates="emails")
+
+#A model with many columns, for the compile benchmarks
+Wide = type("Wide", (Base,), {
+  "__tablename__": "wide",
+  "id": Column(Integer, primary_key=True),
+  **{f"c{i}": Column(Integer) for i in range(200)}
+})
+
+DOMAINS = ("example.com", "example.org", "example.net")
+
+def create_dataset(url: str, rows: int, seed: int = 42, batch: int = 20000):
+  """
+  Create the tables with rows users, one person each and 1 to 3 emails.
+  """
+  engine = create_engine(url)
+  Base.metadata.create_all(engine)
+  rng = random.Random(seed)
+  email_id = 0
+
+  with engine.begin() as conn:
+    for start in range(0, rows, batch):
+      users, persons, emails = [], [], []
+
+      for i in range(start, min(start + batch, rows)):
+        users.append({"id": i + 1, "username": f"user_{i}", "json_data": {"num": rng.randint(0, 100), "a": {"b": i % 10}}})
+        persons.append({"id": i + 1, "name": f"Name {rng.randint(0, 1000)}", "age": rng.randint(18, 90), "user_id": i + 1})
+
+        for _ in range(rng.randint(1, 3)):
+          email_id += 1
+          emails.append({"id": email_id, "address": f"mail_{email_id}@{rng.choice(DOMAINS)}", "user_id": i + 1})
+
+      conn.execute(insert(User), users)
+      conn.execute(insert(Person), persons)
+      conn.execute(insert(Email), emails)
+
+  return engine
+
+def measure(func: Callable, number: int, repeat: int = 5) -> float:
+  """
+  Median seconds per call of func over repeat rounds of number calls.
+  """
+  rounds = []
+
+  for _ in range(repeat):
+    start = time.perf_counter()
+
+    for _ in range(number):
+      func()
+
+    rounds.append((time.perf_counter() - start) / number)
+
+  return statistics.median(rounds)
+
+def query_string(size: int) -> List[tuple]:
+  """
+  Query string items with in lists, boolean trees, relationships and sorts.
+  """
+  items = []
+
+  for i in range(size):
+    kind = i % 4
+
+    if kind == 0:
+      items.append((f"filters[person][age][in][{i // 4}]", str(i)))
+    elif kind == 1:
+      items.append((f"filters[or][{i // 4}][and][0][person][name][contains]", f"name_{i}"))
+    elif kind == 2:
+      items.append((f"filters[and][{i // 4}][username][ne]", f"user_{i}"))
+    else:
+      items.append((f"sorts[{i // 4}][person][age]", "DESC"))
+
+  return items + [("limit", "50"), ("offset", "100")]
+
+def deep_filters(depth: int) -> dict:
+  """
+  A boolean tree alternating or/and of depth levels.
+  """
+  filters = {"username": {"eq": "user_1"}}
+
+  for level in range(depth):
+    operator = "or" if level % 2 else "and"
+    filters = {operator: [filters, {"person": {"age": {"gt": str(level)}}}, {"id": {"in": [level, level + 1]}}]}
+
+  return filters
+
+def wide_filters(width: int) -> dict:
+  return {f"c{i}": {"gte": str(i), "lt": str(i + 100)} for i in range(width)}
+
+def bench_parser(number: int) -> Dict[str, float]:
+  results = {}
+
+  for size in (100, 1000):
+    args = MultiDict(query_string(size))
+    results[f"parse_query[{size}]"] = measure(lambda: parse_query(args.items(multi=True)), number)
+    results[f"parse_filters+parse_sort[{size}]"] = measure(
+      lambda: (parse_filters(args.items(multi=True)), parse_sort(args.items(multi=True))), number
+    )
+
+  return results
+
+def bench_compile(number: int) -> Dict[str, float]:
+  results = {}
+  uncached = CtxBuilder(plan_cache=None)
+  cached = CtxBuilder()
+  cases = {
+    "deep[4]": (User, deep_filters(4)),
+    "deep[12]": (User, deep_filters(12)),
+    "wide[50]": (Wide, wide_filters(50)),
+    "wide[200]": (Wide, wide_filters(200)),
+  }
+
+  for name, (entity, filters) in cases.items():
+    mapper = entity.__mapper__
+    results[f"compile {name}"] = measure(lambda: uncached.get_filter_plan(mapper, filters), number)
+    results[f"compile cached {name}"] = measure(lambda: cached.get_filter_plan(mapper, filters), number)
+
+  return results
+
+ENDPOINTS = {
+  "age range sorted": "/users?filters[person][age][gte]=30&filters[person][age][lt]=40&sorts[0][username]=asc&limit=20",
+  "username prefix": "/users?filters[username][startswith]=user_12&limit=50",
+  "email domain exists": "/users?filters[emails][address][endswith]=example.org&limit=20",
+  "or tree sorted": "/users?filters[or][0][person][name][eq]=Name 5&filters[or][1][id][in][0]=1&filters[or][1][id][in][1]=2"
+                    "&sorts[0][person][age]=desc&limit=20",
+  "deep offset": "/users?sorts[0][id]=asc&offset=100000&limit=20",
+}
+
+def create_app(engine) -> Flask:
+  app = Flask(__name__)
+  session = scoped_session(sessionmaker(bind=engine, query_cls=BaseQuery))
+
+  @app.route("/users")
+  def get_users():
+    ctx = get_url_query_ctx()
+    users = session.query(User).filter_by_ctx(ctx["filters"]) \
+                   .sort_by_ctx(ctx["sorts"]) \
+                   .offset(ctx["offset"]) \
+                   .limit(ctx["limit"]) \
+                   .all()
+
+    return jsonify([{"id": user.id, "username": user.username} for user in users])
+
+  @app.teardown_appcontext
+  def remove_session(exception=None):
+    session.remove()
+
+  return app
+
+def bench_endpoints(engine, number: int) -> Dict[str, float]:
+  client = create_app(engine).test_client()
+  results = {}
+
+  for name, url in ENDPOINTS.items():
+    assert client.get(url).status_code == 200
+    latencies = []
+
+    for _ in range(number):
+      start = time.perf_counter()
+      client.get(url)
+      latencies.append(time.perf_counter() - start)
+
+    latencies.sort()
+    results[f"request {name}"] = statistics.median(latencies)
+    results[f"request {name} p95"] = latencies[int(len(latencies) * 0.95) - 1]
+
+  return results
+
+def run(rows: int, number: int) -> Dict[str, float]:
+  results = {}
+  results.update(bench_parser(number))
+  results.update(bench_compile(number))
+
+  with tempfile.TemporaryDirectory() as directory:
+    engine = create_dataset("sqlite:///" + os.path.join(directory, "bench.db"), rows)
+    results.update(bench_endpoints(engine, max(number // 4, 20)))
+    engine.dispose()
+
+  return results
+
+def environment(rows: int) -> dict:
+  return {
+    "rows": rows,
+    "python": platform.python_version(),
+    "sqlalchemy": sqlalchemy.__version__,
+    "machine": platform.machine(),
+  }
+
+def compare(results: Dict[str, float], baseline: Dict[str, float], threshold: float) -> List[str]:
+  """
+  Names of the benchmarks slower than the baseline by more than threshold.
+  """
+  return [
+    name for name, seconds in results.items()
+    if baseline.get(name) and seconds > baseline[name] * (1 + threshold)
+  ]
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser()
+  parser.add_argument("--rows", type=int, default=200000)
+  parser.add_argument("--number", type=int, default=100, help="Calls per round of each benchmark.")
+  parser.add_argument("--quick", action="store_true", help="A small dataset and few calls, to check the suite runs.")
+  parser.add_argument("--baseline", default=BASELINE)
+  parser.add_argument("--save-baseline", action="store_true")
+  parser.add_argument("--threshold", type=float, default=THRESHOLD, help="Allowed slowdown against the baseline, 0.25 = 25%%.")
+  args = parser.parse_args()
+
+  if args.quick:
+    args.rows, args.number = 2000, 10
+
+  results = run(args.rows, args.number)
+  baseline = {}
+
+  if os.path.exists(args.baseline) and not args.save_baseline:
+    with open(args.baseline) as file:
+      data = json.load(file)
+
+    if data["environment"]["rows"] != args.rows:
+      print(f"warning: the baseline has {data['environment']['rows']} rows, not {args.rows}")
+
+    baseline = data["results"]
+
+  print(f"{'benchmark':<44} {'us':>12} {'baseline':>12} {'change':>8}")
+
+  for name, seconds in results.items():
+    line = f"{name:<44} {seconds * 1e6:>12.1f}"
+
+    if baseline.get(name):
+      line += f" {baseline[name] * 1e6:>12.1f} {seconds / baseline[name] - 1:>+8.1%}"
+
+    print(line)
+
+  if args.save_baseline:
+    with open(args.baseline, "w") as file:
+      json.dump({"environment": environment(args.rows), "results": results}, file, indent=2)
+
+    print(f"baseline saved to {args.baseline}")
+
+  elif baseline:
+    regressions = compare(results, baseline, args.threshold)
+
+    if regressions:
+      print(f"\n{len(regressions)} regression(s) over {args.threshold:.0%}:")
+
+      for name in regressions:
+        print(f"  {name}")
+
+      sys.exit(1)
@@ -1,7 +1,27 @@
 from .qs_parser.main import (
   get_url_query_ctx,
+  parse_query,
   parse_filters,
-  parse_sort
+  parse_sort,
+  parse_query_string,
+  freeze,
+  FrozenDict,
+  QueryStringError,
+  explain_allowed
 )
+from .qs_parser.nodes import to_ast, Comparison, JsonPath, Relationship, Boolean
+from .qs_parser.cost import QueryBudget, QueryCostError, estimate_cost
 
-from .query.model import BaseQuery
\ No newline at end of file
+from .query.model import BaseQuery
+from .query.builder import CtxBuilder, select_by_ctx
+from .query.plan import PlanCache
+from .query.registry import MapperRegistry
+from .query.result_cache import ResultCache, MemoryBackend, FileBackend
+from .query.batch import BatchResult, BatchTimeout, run_batch
+from .query.routing import ReplicaRouter, for_purposes, min_cost
+from .query.timeouts import QueryTimeout, StatementTimeout, apply_timeouts, remove_timeouts
+from .query.explain import SlowQueryLog, explain
+from .query.usage import UsageRecorder, advise, create_index_sql, index_advisor_command
+from .response import ndjson_response, iter_ndjson, batch_response
+from .signals import stage_timed, ctx_error, instrument, uninstrument
+from .metrics import MetricsCollector
@@ -0,0 +1,118 @@
+"""
+In-process collector of the stage timings and errors of ctx queries, in the
+Prometheus text format
+"""
+import threading
+from bisect import bisect_left
+from typing import Any, Dict, Sequence, Tuple
+
+from flask import Response
+
+from .signals import ctx_error, stage_timed
+
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+def _model(mapper: Any) -> str:
+  if mapper is None:
+    return ""
+  return getattr(mapper.local_table, "name", mapper.class_.__name__)
+
+def _labels(labels: Tuple[Tuple[str, str], ...]) -> str:
+  return ",".join(f'{name}="{value}"' for name, value in labels)
+
+class MetricsCollector:
+  """
+  Counters and latency histograms by stage and model, fed by the
+  stage_timed and ctx_error signals once connected.
+  """
+
+  def __init__(self, buckets: Sequence[float] = BUCKETS, prefix: str = "qs"):
+    self.buckets = tuple(sorted(buckets))
+    self.prefix = prefix
+    #(stage, model) -> [bucket counts..., +Inf count, sum]
+    self._histograms: Dict[Tuple[str, str], list] = {}
+    #(stage, model, error type) -> count
+    self._errors: Dict[Tuple[str, str, str], int] = {}
+    self._lock = threading.Lock()
+
+  def connect(self) -> None:
+    """
+    Receive the signals, the stages are timed only while a receiver is connected.
+    """
+    stage_timed.connect(self.observe)
+    ctx_error.connect(self.error)
+
+  def disconnect(self) -> None:
+    stage_timed.disconnect(self.observe)
+    ctx_error.disconnect(self.error)
+
+  def observe(self, stage: str, elapsed: float, mapper: Any = None, **kwargs: Any) -> None:
+    """
+    Receiver of stage_timed.
+    """
+    key = (stage, _model(mapper))
+    index = bisect_left(self.buckets, elapsed)
+
+    with self._lock:
+      histogram = self._histograms.get(key)
+
+      if histogram is None:
+        histogram = self._histograms[key] = [0] * (len(self.buckets) + 1) + [0.0]
+
+      histogram[index] += 1
+      histogram[-1] += elapsed
+
+  def error(self, stage: str, error: Exception, mapper: Any = None, **kwargs: Any) -> None:
+    """
+    Receiver of ctx_error.
+    """
+    key = (stage, _model(mapper), type(error).__name__)
+
+    with self._lock:
+      self._errors[key] = self._errors.get(key, 0) + 1
+
+  def clear(self) -> None:
+    with self._lock:
+      self._histograms.clear()
+      self._errors.clear()
+
+  def prometheus(self) -> str:
+    """
+    The metrics in the Prometheus text exposition format.
+    """
+    name = f"{self.prefix}_stage_duration_seconds"
+    errors = f"{self.prefix}_errors_total"
+    lines = [
+      f"# HELP {name} Time spent in each stage (parse, compile, execute, materialize) of ctx queries.",
+      f"# TYPE {name} histogram"
+    ]
+
+    with self._lock:
+      histograms = sorted((key, list(value)) for key, value in self._histograms.items())
+      error_counts = sorted(self._errors.items())
+
+    for (stage, model), histogram in histograms:
+      labels = (("stage", stage), ("model", model))
+      cumulative = 0
+
+      for bound, count in zip(self.buckets + (float("inf"),), histogram):
+        cumulative += count
+        le = "+Inf" if bound == float("inf") else repr(bound)
+        lines.append(f"{name}_bucket{{{_labels(labels + (('le', le),))}}} {cumulative}")
+
+      lines.append(f"{name}_sum{{{_labels(labels)}}} {histogram[-1]!r}")
+      lines.append(f"{name}_count{{{_labels(labels)}}} {cumulative}")
+
+    lines.append(f"# HELP {errors} Errors of the filters, sorts and queries of ctx queries.")
+    lines.append(f"# TYPE {errors} counter")
+
+    for (stage, model, error), count in error_counts:
+      lines.append(f"{errors}{{{_labels((('stage', stage), ('model', model), ('error', error)))}}} {count}")
+
+    return "\n".join(lines) + "\n"
+
+  def response(self) -> Response:
+    """
+    Flask response of prometheus(), for a /metrics endpoint.
+    """
+    return Response(self.prometheus(), mimetype="text/plain; version=0.0.4")
@@ -0,0 +1,224 @@
+from typing import Any, Dict, Optional
+from .main import CtxType, QueryStringError
+from .nodes import Node
+
+BOOLEAN_OPERATORS = {"and", "or", "not"}
+
+#Operators that can not use a plain b-tree index
+NON_SARGABLE = {
+  "contains", "ncontains", "icontains", "nicontains",
+  "endswith", "iendswith", "istartswith",
+  "ilike", "not_ilike"
+}
+#Operators that are non sargable with a leading wildcard
+PATTERNS = {"like", "not_like"}
+
+WEIGHTS = {
+  "predicate": 1,
+  "join": 5,
+  "non_sargable": 10,
+  "in_item": 0.01,
+  "sort": 1,
+  "facet": 2
+}
+
+class QueryCostError(QueryStringError):
+  """
+  Raised when a ctx exceeds its QueryBudget. Flask answers it with a 400 response.
+  """
+
+class QueryCost:
+  """
+  Complexity of a parsed ctx, see estimate_cost.
+
+  Attributes:
+    depth: Max nesting of boolean expressions and relationships of the filters.
+    predicates: Amount of conditions (eq, in, contains, ...).
+    joins: Amount of relationships traversed by the filters and sorts.
+    in_size: Size of the largest in/nin list.
+    non_sargable: Amount of conditions that can not use an index (icontains, endswith, ...).
+    sorts: Amount of sorted properties.
+    facets: Amount of facets.
+    limit: The limit of the ctx.
+    offset: The offset of the ctx.
+    cost: Weighted score of all of them.
+  """
+
+  __slots__ = ("depth", "predicates", "joins", "in_size", "in_items", "non_sargable", "sorts", "facets", "limit", "offset", "cost")
+
+  def __init__(self):
+    self.depth = 0
+    self.predicates = 0
+    self.joins = 0
+    self.in_size = 0
+    self.in_items = 0
+    self.non_sargable = 0
+    self.sorts = 0
+    self.facets = 0
+    self.limit = 0
+    self.offset = 0
+    self.cost = 0.0
+
+  def as_dict(self) -> Dict[str, Any]:
+    return {name: getattr(self, name) for name in self.__slots__}
+
+  def __repr__(self) -> str:
+    return f"<QueryCost cost={self.cost!r}, depth={self.depth!r}, predicates={self.predicates!r}, joins={self.joins!r}>"
+
+def _is_condition(value: Any) -> bool:
+  #Conditions map operators to values, relationships map names to dicts
+  #or to boolean expressions (and, or, not)
+  return not isinstance(value, dict) or not any(
+    isinstance(item, dict) or key in BOOLEAN_OPERATORS for key, item in value.items()
+  )
+
+def _visit_filters(filters: Any, cost: QueryCost, depth: int) -> None:
+  if isinstance(filters, (list, tuple)):
+    for item in filters:
+      _visit_filters(item, cost, depth)
+    return
+
+  if not isinstance(filters, dict):
+    return
+
+  cost.depth = max(cost.depth, depth)
+
+  for key, value in filters.items():
+    if key in BOOLEAN_OPERATORS:
+      _visit_filters(value, cost, depth + 1)
+
+    elif isinstance(value, dict) and _is_condition(value):
+      for condition, filter_value in value.items():
+        cost.predicates += 1
+
+        if isinstance(filter_value, (list, tuple)):
+          cost.in_size = max(cost.in_size, len(filter_value))
+          cost.in_items += len(filter_value)
+
+        if condition in NON_SARGABLE or (
+          condition in PATTERNS and isinstance(filter_value, str) and filter_value[:1] in ("%", "_")
+        ):
+          cost.non_sargable += 1
+
+    elif isinstance(value, dict):
+      #Relationship
+      cost.joins += 1
+      _visit_filters(value, cost, depth + 1)
+
+def _visit_sort(sort: Any, cost: QueryCost) -> None:
+  for value in sort.values():
+    if isinstance(value, dict):
+      cost.joins += 1
+      _visit_sort(value, cost)
+    else:
+      cost.sorts += 1
+
+def estimate_cost(ctx: CtxType, weights: Optional[Dict[str, float]] = None) -> QueryCost:
+  """
+  Estimate the complexity of a parsed ctx without compiling any SQL.
+
+  Args:
+    ctx: The parsed ctx.
+    weights: Weights of the cost score, WEIGHTS by default.
+
+  Returns:
+    The QueryCost of the ctx.
+  """
+  weights = weights or WEIGHTS
+  cost = QueryCost()
+
+  filters = ctx.get("filters") or {}
+
+  if isinstance(filters, Node):
+    filters = filters.to_dict()
+
+  _visit_filters(filters, cost, 1 if filters else 0)
+
+  for sort in ctx.get("sorts") or []:
+    _visit_sort(sort, cost)
+
+  for path in ctx.get("facets") or {}:
+    cost.facets += 1
+    cost.joins += path.count(".")
+
+  cost.limit = ctx.get("limit") or 0
+  cost.offset = ctx.get("offset") or 0
+  cost.cost = (
+    cost.predicates * weights.get("predicate", 0) +
+    cost.joins * weights.get("join", 0) +
+    cost.non_sargable * weights.get("non_sargable", 0) +
+    cost.in_items * weights.get("in_item", 0) +
+    cost.sorts * weights.get("sort", 0) +
+    cost.facets * weights.get("facet", 0)
+  )
+
+  return cost
+
+class QueryBudget:
+  """
+  Limits of the complexity of a ctx, checked before any SQL is compiled.
+  Each endpoint can have its own budget. None disables a limit.
+
+  A limit over max_limit is lowered to max_limit when clamp_limit is True,
+  every other exceeded limit raises a QueryCostError.
+  """
+
+  def __init__(
+    self,
+    max_cost: Optional[float] = 100,
+    max_depth: Optional[int] = 8,
+    max_predicates: Optional[int] = 50,
+    max_joins: Optional[int] = 4,
+    max_in_size: Optional[int] = 1000,
+    max_non_sargable: Optional[int] = 3,
+    max_facets: Optional[int] = 8,
+    max_limit: Optional[int] = 100,
+    max_offset: Optional[int] = None,
+    clamp_limit: bool = True,
+    weights: Optional[Dict[str, float]] = None
+  ):
+    self.max_cost = max_cost
+    self.max_depth = max_depth
+    self.max_predicates = max_predicates
+    self.max_joins = max_joins
+    self.max_in_size = max_in_size
+    self.max_non_sargable = max_non_sargable
+    self.max_facets = max_facets
+    self.max_limit = max_limit
+    self.max_offset = max_offset
+    self.clamp_limit = clamp_limit
+    self.weights = weights or WEIGHTS
+
+  def enforce(self, ctx: CtxType) -> CtxType:
+    """
+    Check the ctx against the budget.
+
+    Args:
+      ctx: The parsed ctx.
+
+    Returns:
+      The ctx, a copy with a lower limit if it was clamped.
+    """
+    cost = estimate_cost(ctx, self.weights)
+    checks = (
+      ("depth", cost.depth, self.max_depth),
+      ("predicates", cost.predicates, self.max_predicates),
+      ("joins", cost.joins, self.max_joins),
+      ("in list size", cost.in_size, self.max_in_size),
+      ("non sargable conditions", cost.non_sargable, self.max_non_sargable),
+      ("facets", cost.facets, self.max_facets),
+      ("offset", cost.offset, self.max_offset),
+      ("cost", cost.cost, self.max_cost),
+    )
+
+    for name, value, limit in checks:
+      if limit is not None and value > limit:
+        raise QueryCostError(f"The query {name} ({value:g}) exceeds the max of {limit:g}.")
+
+    if self.max_limit is not None and cost.limit > self.max_limit:
+      if not self.clamp_limit:
+        raise QueryCostError(f"The query limit ({cost.limit}) exceeds the max of {self.max_limit}.")
+
+      ctx = dict(ctx, limit=self.max_limit)
+
+    return ctx
@@ -0,0 +1,7 @@
+from werkzeug.exceptions import BadRequest
+
+class QueryStringError(BadRequest, ValueError):
+  """
+  Raised when a query string key is malformed or exceeds the parser limits.
+  Flask answers it with a 400 response.
+  """
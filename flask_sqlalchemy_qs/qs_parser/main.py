@@ -1,127 +1,460 @@
-from typing import Dict, List, Tuple, Union
-from flask import request
+import time
+from functools import lru_cache
+from typing import TYPE_CHECKING, Any, Callable, Dict, Iterable, List, Optional, Tuple, Union
+from urllib.parse import parse_qsl
+from flask import request, current_app
+from .errors import QueryStringError
+from .nodes import to_ast
+from ..query.plan import normalize_filters, normalize_sorts
+from ..signals import send_timing, timing
+
+if TYPE_CHECKING:
+  from .cost import QueryBudget
 
 #Types
 FilterType = Dict[str, Union[bool, str, Dict]]
 SortType = Dict[str, Union[str, Dict]]
+FieldsType = Dict[str, List[str]]
+CtxType = Dict[str, Union[FilterType, int, List[SortType]]]
+
+#Hard limits of the query string keys, can be overridden in the app config
+MAX_KEY_LENGTH = 512  # QS_MAX_KEY_LENGTH
+MAX_DEPTH = 16        # QS_MAX_DEPTH
+MAX_INDEX = 1000      # QS_MAX_INDEX
+
+DEFAULT_OFFSET = 0
+DEFAULT_LIMIT = 10
+
+#Parsed query strings kept by parse_query_string
+MEMO_SIZE = 1024
+
+VALUES = {"true": True, "false": False, "null": None}
+LISTS = {"in", "nin", "and", "or", "not"}
+
+class FrozenDict(dict):
+  """
+  Immutable and hashable dict of a frozen ctx, see freeze. It is still a
+  dict for the filter and sort helpers, and copy() gives a mutable one.
+  """
+
+  __slots__ = ("_hash",)
+
+  def __init__(self, *args: Any, **kwargs: Any):
+    super().__init__(*args, **kwargs)
+    self._hash = None
+
+  def _immutable(self, *args: Any, **kwargs: Any):
+    raise TypeError("A frozen ctx can not be modified, use copy().")
+
+  __setitem__ = __delitem__ = __ior__ = _immutable
+  clear = pop = popitem = setdefault = update = _immutable
+
+  def __hash__(self) -> int:
+    if self._hash is None:
+      self._hash = hash(frozenset(self.items()))
+    return self._hash
+
+  def __reduce__(self):
+    return (FrozenDict, (dict(self),))
+
+def freeze(value: Any) -> Any:
+  """
+  Frozen copy of a ctx (or part of it): dicts as FrozenDict, lists as tuples.
+  """
+  if isinstance(value, FrozenDict):
+    return value
+  if isinstance(value, dict):
+    return FrozenDict((key, freeze(item)) for key, item in value.items())
+  if isinstance(value, (list, tuple)):
+    return tuple(freeze(item) for item in value)
+  return value
+
+@lru_cache(maxsize=4096)
+def tokenize(
+  key: str,
+  max_key_length: int = MAX_KEY_LENGTH,
+  max_depth: int = MAX_DEPTH,
+  max_index: int = MAX_INDEX
+) -> Tuple[str, Tuple[Union[str, int], ...]]:
+  """
+  Split a bracket key in its root and parts, with the indexes as ints:
+  filters[or][0][id][eq] -> filters, (or, 0, id, eq)
+
+  Keys are compiled once and cached, since the same keys come again and
+  again with different values.
+
+  Args:
+    key: The query string key.
+    max_key_length: Max length of the key.
+    max_depth: Max amount of bracket parts.
+    max_index: Max value of an index.
+
+  Returns:
+    A (root, parts) tuple.
+  """
+  if len(key) > max_key_length:
+    raise QueryStringError(f"'{key[:32]}...' exceeds the max key length of {max_key_length}.")
+
+  root, bracket, rest = key.partition("[")
+
+  if not bracket:
+    return root, ()
+
+  inner = rest[:-1]
+  parts = inner.split("][")
+
+  #Every [ and ] has to be a separator of the parts
+  if rest[-1:] != "]" or inner.count("[") != len(parts) - 1 or inner.count("]") != len(parts) - 1:
+    raise QueryStringError(f"'{key}' is not a valid key.")
+
+  if len(parts) > max_depth:
+    raise QueryStringError(f"'{key}' exceeds the max depth of {max_depth}.")
+
+  for i, part in enumerate(parts):
+    if part.isdigit():
+      idx = int(part)
+
+      if idx > max_index:
+        raise QueryStringError(f"'{key}' exceeds the max index of {max_index}.")
+
+      parts[i] = idx
+
+  return root, tuple(parts)
+
+def _index(key: str, parts: Tuple, i: int) -> int:
+  #Get the index of the clause: ex. or[idx] ... and[idx]
+  if i >= len(parts) or type(parts[i]) is not int:
+    raise QueryStringError(f"'{key}' needs an index after '{parts[i - 1]}'.")
+
+  return parts[i]
+
+def _parse_filter(ctx: CtxType, key: str, parts: Tuple, value: str) -> None:
+  target = ctx["filters"]
+  last = len(parts) - 1
+
+  for i, part in enumerate(parts):
+    #compact in list: in=1,2,3
+    if i == last and part in ("in", "nin"):
+      items = target.setdefault(part, [])
+      items.extend(VALUES.get(item, item) for item in value.split(",") if item)
+
+    #is final condition (eq, contains, ...)   index in
+    elif i == last:
+      target[part] = VALUES.get(value, value)
+
+    #index of in, nin, and, or, not already set as target
+    elif type(part) is int:
+      continue
+
+    elif part in LISTS:
+      if part not in target:
+        target[part] = []
+
+      items = target[part]
+
+      #appended in list item: in[]=1
+      if part in ("in", "nin") and i + 1 == last and parts[last] == "":
+        items.append(VALUES.get(value, value))
+        return
+
+      idx = _index(key, parts, i + 1)
+
+      #got index out of limit, so create empty items
+      # (can happen due to the order of getting filters)
+      if idx >= len(items):
+        if part in ("in", "nin"):
+          items.extend([None] * (idx + 1 - len(items)))
+        else:
+          items.extend([{} for _ in range(idx + 1 - len(items))])
+
+      if part in ("in", "nin"):
+        target = items
+      else:
+        #set the (nested) dict as the one to be modified
+        target = items[idx]
+
+    #is a prop or relationship
+    else:
+      if part not in target:
+        target[part] = {}
+      #set the (nested) dict as the one to be modified
+      target = target[part]
+
+def _parse_sort(ctx: CtxType, key: str, parts: Tuple, value: str) -> None:
+  sorts = ctx["sorts"]
+  target = {}
+  last = len(parts) - 1
+
+  for i, part in enumerate(parts):
+    if type(part) is int:
+      if part >= len(sorts):
+        sorts.extend([{} for _ in range(part + 1 - len(sorts))])
+
+      target = sorts[part]
+
+    #is final property
+    elif i == last:
+      target[part] = value
+
+    #is relationship name
+    else:
+      if part not in target:
+        target[part] = {}
+
+      #set the (nested) dict as the one to be modified
+      target = target[part]
+
+def _parse_int(name: str) -> Callable:
+  def parse(ctx: CtxType, key: str, parts: Tuple, value: str) -> None:
+    # The first valid value is kept, as in request.args.get
+    if parts or name in ctx:
+      return
+
+    try:
+      ctx[name] = int(value)
+    except ValueError:
+      pass
+
+  return parse
+
+def _parse_str(name: str) -> Callable:
+  def parse(ctx: CtxType, key: str, parts: Tuple, value: str) -> None:
+    # The first value is kept, as in request.args.get
+    if not parts and name not in ctx:
+      ctx[name] = value
+
+  return parse
+
+def _parse_flag(name: str) -> Callable:
+  def parse(ctx: CtxType, key: str, parts: Tuple, value: str) -> None:
+    # name=1 or name=true, the first value is kept
+    if not parts and name not in ctx:
+      ctx[name] = value.lower() in ("1", "true")
+
+  return parse
+
+def _split(value: str, values: List[str]) -> None:
+  for item in value.split(","):
+    item = item.strip()
+
+    if item and item not in values:
+      values.append(item)
+
+def _parse_list(name: str) -> Callable:
+  def parse(ctx: CtxType, key: str, parts: Tuple, value: str) -> None:
+    # name[]=a&name[]=b or name=a,b
+    if len(parts) > 1 or (parts and parts[0] != ""):
+      raise QueryStringError(f"'{key}' is not a valid key, use {name}[] or {name}.")
+
+    _split(value, ctx.setdefault(name, []))
+
+  return parse
+
+def _parse_fields(ctx: CtxType, key: str, parts: Tuple, value: str) -> None:
+  # fields[model]=a,b,c
+  if len(parts) != 1 or type(parts[0]) is not str or not parts[0]:
+    raise QueryStringError(f"'{key}' is not a valid key, use fields[model].")
+
+  _split(value, ctx.setdefault("fields", {}).setdefault(parts[0], []))
+
+def _parse_facet(ctx: CtxType, key: str, parts: Tuple, value: str) -> None:
+  # facets[status]=, facets[person][age]=10 for buckets of 10
+  if not parts or any(type(part) is not str or not part for part in parts):
+    raise QueryStringError(f"'{key}' is not a valid key, use facets[field] or facets[relationship][field].")
+
+  bucket = None
+
+  if value:
+    try:
+      bucket = int(value)
+    except ValueError:
+      try:
+        bucket = float(value)
+      except ValueError:
+        bucket = None
+
+    if bucket is None or not 0 < bucket < float("inf"):
+      raise QueryStringError(f"The bucket size of '{key}' must be a positive number.")
+
+  ctx.setdefault("facets", {})[".".join(parts)] = bucket
+
+#Handlers of the query string params by root key
+PARAMS: Dict[str, Callable] = {
+  "filters": _parse_filter,
+  "sorts": _parse_sort,
+  "offset": _parse_int("offset"),
+  "limit": _parse_int("limit"),
+  "cursor": _parse_str("cursor"),
+  "include": _parse_list("include"),
+  "fields": _parse_fields,
+  "facets": _parse_facet,
+  "explain": _parse_flag("explain"),
+}
+
+def parse_query(
+  items: Iterable[Tuple[str, str]],
+  roots: Iterable[str] = None,
+  max_key_length: int = MAX_KEY_LENGTH,
+  max_depth: int = MAX_DEPTH,
+  max_index: int = MAX_INDEX,
+  ast: bool = False
+) -> CtxType:
+  """
+  Parse the query string items in a single pass, dispatching each key to
+  the handler of its root in PARAMS.
+
+  Args:
+    items: The (key, value) pairs of the query string.
+    roots: Only parse these roots, all of PARAMS by default.
+    max_key_length: Max length of a key.
+    max_depth: Max amount of bracket parts of a key.
+    max_index: Max index of in, nin, and, or, not and sorts.
+    ast: Return the filters as a validated AST (see to_ast) instead of a dict.
+
+  Returns:
+    The ctx with filters, offset, limit and sorts. Optional params, like
+    cursor, include, fields, facets or explain, are only present when they are in the query string.
+  """
+  ctx = {
+    "filters": {},
+    "sorts": []
+  }
+  handlers = PARAMS if roots is None else {root: PARAMS[root] for root in roots}
 
-def parse_filters(items: List[Tuple[str, str]]) -> FilterType:
-  filters = {}
-  
   for key, value in items:
-    if key.startswith("filters"):
-      parts = key.split("[")
-      target_dict = filters
-      ##Remove first index: filters
-      parts.pop(0)
-
-      for i, part in enumerate(parts):
-        #remove ] char
-        part = part[:-1]
-
-        #is final condition (eq, contains, ...)   index in
-        if i == len(parts) -1:
-          if value == 'true':
-            target_dict[part] = True
-          elif value == 'false':
-            target_dict[part] = False
-          elif value == 'null':
-            target_dict[part] = None
-          else:
-            if part.isdigit(): #Case in, nin
-              target_dict[int(part)] = value
-            else:
-              target_dict[part] = value
-        
-        elif part in ["in", "nin"]:
-          if part not in target_dict:
-            target_dict[part] = []
-
-          #Get the index of the clause: ex. or[idx] ... and[idx]
-          idx = int(parts[i + 1][:-1])
-
-          #got index out of limit, so create empty dicts 
-          # (can happen due to the order of getting filters)
-          if idx >= len(target_dict[part]):
-            target_dict[part].extend([None] * (idx + 1 - len(target_dict[part])))
-            
-          target_dict = target_dict[part]
-          
-
-        elif part in ['and', 'or', 'not']:
-          if part not in target_dict:
-            target_dict[part] = []
-          
-          #Get the index of the clause: ex. or[idx] ... and[idx]
-          idx = int(parts[i + 1][:-1])
-
-          #got index out of limit, so create empty dicts 
-          # (can happen due to the order of getting filters)
-          if idx >= len(target_dict[part]):
-            target_dict[part].extend([{}] * (idx + 1 - len(target_dict[part])))
-        
-          #set the (nested) dict as the one to be modified
-          target_dict = target_dict[part][idx]
-        
-        #is a prop or relationship
-        elif not part.isdigit(): #Relationship case
-          if part not in target_dict:
-            target_dict[part] = {}
-          #set the (nested) dict as the one to be modified
-          target_dict = target_dict[part]
-
-  return filters
+    root = key.partition("[")[0]
+    handler = handlers.get(root)
+
+    if handler is None:
+      continue
+
+    _, parts = tokenize(key, max_key_length, max_depth, max_index)
+    handler(ctx, key, parts, value)
+
+  ctx.setdefault("offset", DEFAULT_OFFSET)
+  ctx.setdefault("limit", DEFAULT_LIMIT)
+
+  if ast:
+    ctx["filters"] = to_ast(ctx["filters"])
+
+  return ctx
+
+def parse_filters(items: List[Tuple[str, str]]) -> FilterType:
+  return parse_query(items, roots=("filters",))["filters"]
   
 def parse_sort(items: List[Tuple[str, str]]) -> List[SortType]:
-  sorts = []
+  return parse_query(items, roots=("sorts",))["sorts"]
   
-  for key, value in items:
-    if key.startswith("sorts"):
-      parts = key.split("[")
-      target_dict = {}
-      ##Remove first index: filters
-      parts.pop(0)
-      print(parts)
+@lru_cache(maxsize=MEMO_SIZE)
+def parse_query_string(
+  query_string: Union[bytes, str],
+  max_key_length: int = MAX_KEY_LENGTH,
+  max_depth: int = MAX_DEPTH,
+  max_index: int = MAX_INDEX,
+  ast: bool = False
+) -> FrozenDict:
+  """
+  Parse a raw query string in a frozen ctx. The last MEMO_SIZE query
+  strings are kept, so repeated ones are not parsed again, and the same
+  FrozenDict is returned for them.
 
-      for i, part in enumerate(parts):
-        #remove ] char
-        part = part[:-1]
+  Args:
+    query_string: The raw query string, ex. request.query_string.
+    max_key_length: Max length of a key.
+    max_depth: Max amount of bracket parts of a key.
+    max_index: Max index of in, nin, and, or, not and sorts.
+    ast: Return the filters as a validated AST (see to_ast) instead of a dict.
 
-        if part.isdigit():
-          idx = int(part)
-          len_sort = len(sorts)
+  Returns:
+    The frozen ctx.
+  """
+  if isinstance(query_string, bytes):
+    query_string = query_string.decode("utf-8", "replace")
 
-          if(idx >= len_sort):
-            sorts.extend([{}] * (idx + 1 - len_sort))
+  return freeze(parse_query(
+    parse_qsl(query_string, keep_blank_values=True),
+    max_key_length=max_key_length,
+    max_depth=max_depth,
+    max_index=max_index,
+    ast=ast
+  ))
 
-          target_dict = sorts[idx]
-        #is final property
-        elif i == len(parts) -1:
-          target_dict[part] = value
+def get_url_query_ctx(
+  budget: Optional["QueryBudget"] = None,
+  frozen: Optional[bool] = None,
+  ast: Optional[bool] = None
+) -> CtxType:
+  """
+  Parse the query string of the current request.
 
-        #is relationship name
-        elif i < len(parts) - 1:
-          field = part
+  Args:
+    budget: QueryBudget to enforce on the ctx, QS_BUDGET of the app config
+            by default (none if it is not set).
+    frozen: Whether to get a frozen ctx from parse_query_string, memoized
+            by query string, QS_FROZEN_CTX of the app config by default (False).
+    ast: Whether to get the filters as an AST, QS_FILTER_AST of the app
+         config by default (False).
 
-          if field not in target_dict:
-            target_dict[field] = {}
+  Returns:
+    The ctx with filters, offset, limit, sorts and the optional params.
+  """
+  config = current_app.config
+  start = time.perf_counter() if timing() else None
 
-          #set the (nested) dict as the one to be modified
-          target_dict = target_dict[field]
+  limits = {
+    "max_key_length": config.get("QS_MAX_KEY_LENGTH", MAX_KEY_LENGTH),
+    "max_depth": config.get("QS_MAX_DEPTH", MAX_DEPTH),
+    "max_index": config.get("QS_MAX_INDEX", MAX_INDEX)
+  }
 
-  return sorts
-  
-def get_url_query_ctx() -> Dict[str, Union[FilterType, int, List[SortType]]]:
-  filters = parse_filters(request.args.items(multi=True))
-  offset  = request.args.get("offset", default=0, type=int)
-  limit   = request.args.get("limit", default=10, type=int)
-  sorts   = parse_sort(request.args.items(multi=True))
+  if frozen is None:
+    frozen = config.get("QS_FROZEN_CTX", False)
 
-  ctx = {
-    "filters": filters,
-    "offset": offset,
-    "limit": limit,
-    "sorts": sorts
-  }
+  if ast is None:
+    ast = config.get("QS_FILTER_AST", False)
+
+  if frozen:
+    ctx = parse_query_string(request.query_string, ast=ast, **limits)
+  else:
+    ctx = parse_query(request.args.items(multi=True), ast=ast, **limits)
+
+  if "explain" in ctx and not explain_allowed():
+    ctx = {key: value for key, value in ctx.items() if key != "explain"}
+
+    if frozen:
+      ctx = freeze(ctx)
+
+  budget = budget or config.get("QS_BUDGET")
+
+  if budget is not None:
+    ctx = budget.enforce(ctx)
+
+    if frozen:
+      ctx = freeze(ctx)
+
+  if start is not None:
+    send_timing("parse", start, shape=ctx_shape(ctx))
+
+  return ctx
+
+def explain_allowed() -> bool:
+  """
+  Whether the current request can get the explain of its query: QS_EXPLAIN
+  of the app config, a bool or a callable of the request, by default only
+  in debug or testing mode.
+  """
+  allowed = current_app.config.get("QS_EXPLAIN")
+
+  if allowed is None:
+    return current_app.debug or current_app.testing
+
+  if callable(allowed):
+    return bool(allowed(request))
+
+  return bool(allowed)
 
-  return ctx
\ No newline at end of file
+def ctx_shape(ctx: CtxType) -> tuple:
+  """
+  The normalized (filters, sorts) shape of a ctx, without its values.
+  """
+  return normalize_filters(ctx.get("filters") or {})[0], normalize_sorts(ctx.get("sorts") or [])
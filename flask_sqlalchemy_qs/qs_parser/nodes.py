@@ -0,0 +1,312 @@
+"""
+Typed AST of the filters: hashable __slots__ nodes, validated once when
+they are built from the filters dict (see to_ast)
+"""
+from typing import Any, Dict, Iterable, Tuple
+
+from ..query.constants import CONDITIONS, JSON_CONDITIONS
+from .errors import QueryStringError
+
+BOOLEAN_OPERATORS = ("and", "or", "not")
+
+
+def _freeze(value: Any) -> Any:
+    if isinstance(value, (list, tuple)):
+        return tuple(value)
+    return value
+
+
+def _thaw(value: Any) -> Any:
+    if isinstance(value, tuple):
+        return list(value)
+    return value
+
+
+def _value_key(value: Any) -> Any:
+    # The types are part of the key, since 1 == True but they are not the same filter
+    if isinstance(value, tuple):
+        return tuple((type(item), item) for item in value)
+    return type(value), value
+
+
+class Node:
+    """
+    Base class of the filter nodes. Nodes are immutable, and equal when they
+    have the same type and key.
+    """
+
+    __slots__ = ("_hash",)
+
+    def _key(self) -> tuple:
+        raise NotImplementedError
+
+    def entry(self) -> Dict[str, Any]:
+        """
+        The node in the filters dict form.
+        """
+        raise NotImplementedError
+
+    def to_dict(self) -> Dict[str, Any]:
+        """
+        The filters dict of the node.
+        """
+        return self.entry()
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        if name != "_hash" and hasattr(self, "_hash"):
+            raise AttributeError(f"'{type(self).__name__}' nodes are immutable.")
+        super().__setattr__(name, value)
+
+    def __eq__(self, other: Any) -> bool:
+        return type(other) is type(self) and self._key() == other._key()
+
+    def __hash__(self) -> int:
+        if self._hash is None:
+            object.__setattr__(self, "_hash", hash((type(self).__name__,) + self._key()))
+        return self._hash
+
+
+class Comparison(Node):
+    """
+    A condition of a column: username eq "alex".
+    """
+
+    __slots__ = ("field", "operator", "value")
+
+    def __init__(self, field: str, operator: str, value: Any):
+        if operator not in CONDITIONS:
+            raise QueryStringError(f"'{operator}' is not a supported condition of '{field}'.")
+
+        self.field = field
+        self.operator = operator
+        self.value = _freeze(value)
+        self._hash = None
+
+    @property
+    def key(self) -> str:
+        return self.field
+
+    def _key(self) -> tuple:
+        return self.field, self.operator, _value_key(self.value)
+
+    def entry(self) -> Dict[str, Any]:
+        return {self.field: {self.operator: _thaw(self.value)}}
+
+    def __reduce__(self):
+        return (Comparison, (self.field, self.operator, self.value))
+
+    def __repr__(self) -> str:
+        return f"Comparison({self.field!r}, {self.operator!r}, {self.value!r})"
+
+
+class JsonPath(Node):
+    """
+    A condition of a path of a JSON column: json_data.a.b gt 10.
+    """
+
+    __slots__ = ("field", "path", "operator", "value")
+
+    def __init__(self, field: str, path: Tuple[str, ...], operator: str, value: Any):
+        if operator not in JSON_CONDITIONS:
+            raise QueryStringError(f"'{operator}' is not a supported condition of JSON paths.")
+
+        self.field = field
+        self.path = tuple(path)
+        self.operator = operator
+        self.value = _freeze(value)
+        self._hash = None
+
+    @property
+    def key(self) -> str:
+        return ".".join((self.field,) + self.path)
+
+    def _key(self) -> tuple:
+        return self.field, self.path, self.operator, _value_key(self.value)
+
+    def entry(self) -> Dict[str, Any]:
+        return {self.key: {self.operator: _thaw(self.value)}}
+
+    def __reduce__(self):
+        return (JsonPath, (self.field, self.path, self.operator, self.value))
+
+    def __repr__(self) -> str:
+        return f"JsonPath({self.field!r}, {self.path!r}, {self.operator!r}, {self.value!r})"
+
+
+class Relationship(Node):
+    """
+    The filters of a relationship: person (age gt 20). A clause that is not
+    an "and" group is wrapped in one.
+    """
+
+    __slots__ = ("name", "clause")
+
+    def __init__(self, name: str, clause: Node):
+        if not isinstance(clause, Node):
+            raise QueryStringError(f"The filters of '{name}' are not a node.")
+
+        if not isinstance(clause, Boolean) or clause.operator != "and":
+            clause = Boolean("and", (clause,))
+
+        self.name = name
+        self.clause = clause
+        self._hash = None
+
+    def _key(self) -> tuple:
+        return self.name, self.clause
+
+    def entry(self) -> Dict[str, Any]:
+        return {self.name: self.clause.to_dict()}
+
+    def __reduce__(self):
+        return (Relationship, (self.name, self.clause))
+
+    def __repr__(self) -> str:
+        return f"Relationship({self.name!r}, {self.clause!r})"
+
+
+class Boolean(Node):
+    """
+    and, or, not of clauses. The root of the filters, and the clause of a
+    relationship, are "and" groups.
+    """
+
+    __slots__ = ("operator", "clauses")
+
+    def __init__(self, operator: str, clauses: Tuple[Node, ...] = ()):
+        if operator not in BOOLEAN_OPERATORS:
+            raise QueryStringError(f"'{operator}' is not a boolean operator.")
+
+        clauses = tuple(clauses)
+
+        for clause in clauses:
+            if not isinstance(clause, Node):
+                raise QueryStringError(f"The clauses of '{operator}' are not nodes.")
+
+        self.operator = operator
+        self.clauses = clauses
+        self._hash = None
+
+    def _key(self) -> tuple:
+        return self.operator, self.clauses
+
+    def to_dict(self) -> Dict[str, Any]:
+        """
+        The filters dict of the node, an "and" group is merged in a single dict.
+        """
+        if self.operator != "and":
+            return self.entry()
+
+        filters: Dict[str, Any] = {}
+
+        for key, member in group_clauses(self.clauses).items():
+            if key in BOOLEAN_OPERATORS:
+                filters[key] = [clause.to_dict() for clause in member]
+            elif isinstance(member, dict):
+                filters[key] = {operator: _thaw(leaf.value) for operator, leaf in member.items()}
+            else:
+                filters[key] = Boolean("and", member).to_dict()
+
+        return filters
+
+    def entry(self) -> Dict[str, Any]:
+        return {self.operator: [clause.to_dict() for clause in self.clauses]}
+
+    def __reduce__(self):
+        return (Boolean, (self.operator, self.clauses))
+
+    def __bool__(self) -> bool:
+        return bool(self.clauses)
+
+    def __repr__(self) -> str:
+        return f"Boolean({self.operator!r}, {self.clauses!r})"
+
+
+def group_clauses(clauses: Iterable[Node]) -> Dict[str, Any]:
+    """
+    The clauses of an "and" group by key of its filters dict: the leaves of
+    each column or JSON path by operator, the clauses of each relationship,
+    the clauses of each boolean operator. The clauses that do not fit in the
+    dict (a second condition with the same operator, a second or / not) are
+    added to the "and" clauses, so nothing is dropped.
+
+    Args:
+        clauses: The clauses of the group.
+
+    Returns:
+        A dict of keys and their dict of leaves or list of clauses.
+    """
+    groups: Dict[str, Any] = {}
+
+    for clause in clauses:
+        if isinstance(clause, (Comparison, JsonPath)):
+            leaves = groups.setdefault(clause.key, {})
+
+            if isinstance(leaves, dict) and clause.operator not in leaves:
+                leaves[clause.operator] = clause
+                continue
+
+        elif isinstance(clause, Relationship):
+            members = groups.setdefault(clause.name, [])
+
+            if isinstance(members, list):
+                members.extend(clause.clause.clauses)
+                continue
+
+        elif isinstance(clause, Boolean) and clause.operator == "and":
+            # Each clause of a nested "and" is a group of the "and" list
+            groups.setdefault("and", []).extend(clause.clauses)
+            continue
+
+        elif isinstance(clause, Boolean) and clause.operator not in groups:
+            groups[clause.operator] = list(clause.clauses)
+            continue
+
+        groups.setdefault("and", []).append(clause)
+
+    return groups
+
+
+def _is_conditions(value: Dict[str, Any]) -> bool:
+    return bool(value) and all(key in CONDITIONS for key in value)
+
+
+def to_ast(filters: Any) -> Boolean:
+    """
+    Build and validate the AST of a filters dict.
+
+    Args:
+        filters: The filters, or an AST already.
+
+    Returns:
+        The root "and" group.
+    """
+    if isinstance(filters, Node):
+        return filters
+
+    if not isinstance(filters, dict):
+        raise QueryStringError("The filters are not a group of conditions.")
+
+    clauses = []
+
+    for key, value in filters.items():
+        if key in BOOLEAN_OPERATORS:
+            if not isinstance(value, (list, tuple)):
+                raise QueryStringError(f"'{key}' needs a list of filters.")
+
+            clauses.append(Boolean(key, tuple(to_ast(clause or {}) for clause in value)))
+
+        elif not isinstance(value, dict):
+            raise QueryStringError(f"'{key}' needs a condition, ex. {key}[eq]=value.")
+
+        elif "." in key and _is_conditions(value):
+            field, *path = key.split(".")
+            clauses.extend(JsonPath(field, tuple(path), operator, item) for operator, item in value.items())
+
+        elif _is_conditions(value):
+            clauses.extend(Comparison(key, operator, item) for operator, item in value.items())
+
+        else:
+            clauses.append(Relationship(key, to_ast(value)))
+
+    return Boolean("and", tuple(clauses))
@@ -0,0 +1,180 @@
+"""
+Batch of ctx queries, possibly of different models, executed concurrently
+on a thread pool, each one with its own session and pooled connection
+"""
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, Iterable, Mapping, Optional, Tuple, Union
+
+from sqlalchemy.orm import Session
+
+from ..qs_parser.main import parse_query_string
+from ..response import to_dict
+from ..signals import send_error
+from .builder import CtxBuilder, default_builder
+
+# items is None when the query failed, error is None when it did not.
+# elapsed are the seconds of the query, or of the batch when it timed out.
+BatchResult = namedtuple("BatchResult", ["items", "error", "elapsed"])
+
+BatchQuery = Union[Tuple[Any, Any], Tuple[Any, Any, Optional[Iterable[str]]]]
+
+
+class BatchTimeout(TimeoutError):
+    """
+    Error of the queries that did not finish within the time budget of a batch.
+    """
+
+
+class _Connections:
+    """
+    The DBAPI connections of the running queries of a batch, by key, so the
+    ones that exceed the time budget are interrupted instead of holding
+    their pooled connection after run_batch returns.
+    """
+
+    def __init__(self):
+        self._connections: Dict[str, Any] = {}
+        self._canceled = set()
+        self._lock = threading.Lock()
+
+    def add(self, key: str, dbapi_connection: Any) -> None:
+        with self._lock:
+            if key in self._canceled:
+                raise BatchTimeout(f"'{key}' did not finish within the time budget of the batch.")
+
+            self._connections[key] = dbapi_connection
+
+    def discard(self, key: str) -> None:
+        with self._lock:
+            self._connections.pop(key, None)
+
+    def canceled(self, key: str) -> bool:
+        with self._lock:
+            return key in self._canceled
+
+    def cancel(self, key: str) -> None:
+        # Under the lock, the connection is not returned to the pool meanwhile
+        with self._lock:
+            self._canceled.add(key)
+            dbapi_connection = self._connections.get(key)
+
+            if dbapi_connection is not None:
+                _interrupt(dbapi_connection)
+
+
+def _interrupt(dbapi_connection: Any) -> None:
+    # cancel() of psycopg and psycopg2, interrupt() of sqlite3; the other
+    # drivers have no way to stop a running statement, it runs to the end
+    for name in ("cancel", "interrupt"):
+        method = getattr(dbapi_connection, name, None)
+
+        if callable(method):
+            try:
+                method()
+            except Exception:
+                pass
+            return
+
+
+def _run_query(
+    key: str,
+    connections: _Connections,
+    bind: Any,
+    builder: CtxBuilder,
+    entity: Any,
+    ctx: Any,
+    allowed: Optional[Iterable[str]],
+    serializer: Callable[[Any], Any],
+) -> BatchResult:
+    start = time.perf_counter()
+
+    try:
+        if isinstance(ctx, (str, bytes)):
+            ctx = parse_query_string(ctx)
+
+        with Session(bind) as session:
+            statement = builder.select(entity, ctx, allowed)
+            connections.add(key, session.connection().connection.dbapi_connection)
+
+            try:
+                items = [serializer(item) for item in session.execute(statement).unique().scalars()]
+            finally:
+                connections.discard(key)
+
+    except Exception as e:
+        # The timeout of an interrupted query was reported by run_batch already
+        if not connections.canceled(key):
+            send_error("batch", e)
+        return BatchResult(None, e, time.perf_counter() - start)
+
+    return BatchResult(items, None, time.perf_counter() - start)
+
+
+def run_batch(
+    bind: Any,
+    queries: Mapping[str, BatchQuery],
+    builder: CtxBuilder = default_builder,
+    serializer: Callable[[Any], Any] = to_dict,
+    max_workers: int = 8,
+    timeout: Optional[float] = None,
+) -> Dict[str, BatchResult]:
+    """
+    Execute several ctx queries concurrently and return their results by key.
+
+    Each query runs in a thread of its own with a Session of bind, so it
+    gets its own connection from the engine pool; the pool should allow
+    max_workers connections. A query that fails does not fail the others,
+    its result has the error instead of the items.
+
+    Args:
+        bind: The Engine (or Connection factory) of the sessions, ex. db.engine.
+        queries: The (entity, ctx) or (entity, ctx, allowed) of each key. The
+                 ctx can be a parsed ctx or a raw query string, parsed with
+                 parse_query_string.
+        builder: The CtxBuilder that compiles the queries.
+        serializer: Callable to turn a result into a value, called in the
+                    thread of the query, while its session is open.
+        max_workers: Max amount of queries executed at a time.
+        timeout: Time budget in seconds of the whole batch. The results of
+                 the queries that did not finish in time are BatchTimeout
+                 errors, and their statements are interrupted on Postgres
+                 (psycopg, psycopg2) and SQLite.
+
+    Returns:
+        A BatchResult by key, in the order of queries.
+    """
+    start = time.perf_counter()
+    executor = ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(queries))), thread_name_prefix="qs-batch")
+    connections = _Connections()
+    futures = {}
+
+    try:
+        for key, query in queries.items():
+            entity, ctx, allowed = query if len(query) == 3 else (query[0], query[1], None)
+            futures[key] = executor.submit(_run_query, key, connections, bind, builder, entity, ctx, allowed, serializer)
+
+        wait(futures.values(), timeout=timeout)
+
+    finally:
+        # The pending queries are not started, the running ones are interrupted
+        # and not waited for (cancel_futures of shutdown needs Python 3.9)
+        for key, future in futures.items():
+            if not future.cancel() and not future.done():
+                connections.cancel(key)
+
+        executor.shutdown(wait=False)
+
+    results = {}
+
+    for key, future in futures.items():
+        if future.done() and not future.cancelled() and not connections.canceled(key):
+            results[key] = future.result()
+        else:
+            error = BatchTimeout(f"'{key}' did not finish within the {timeout}s time budget of the batch.")
+            send_error("batch", error)
+            results[key] = BatchResult(None, error, time.perf_counter() - start)
+
+    return results
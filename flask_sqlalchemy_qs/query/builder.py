@@ -0,0 +1,766 @@
+"""
+CtxBuilder class to compile the filters, sorts, includes and fields of a
+parsed ctx into 2.0 style select() statements, usable with Session and
+AsyncSession alike. BaseQuery is a thin wrapper over it.
+"""
+import time
+
+from sqlalchemy import Select, or_, and_, not_, distinct, func, inspect, select
+from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.orm import Mapper, joinedload, load_only, selectinload
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from ..qs_parser.main import QueryStringError
+from .constants import CONDITIONS, CASTS, FacetsType, FieldsType, FilterType, SortType, BooleanExpression, JSON_CONDITIONS, JSON_CASTS, JSON_TYPED_CONDITIONS
+from .facets import GROUPING_SETS_DIALECTS, bucket, facet_select
+from .in_list import InList, LargeList, list_converter
+from .joins import Join, JoinPaths, JoinRegistry
+from .plan import BOOLEAN_OPERATORS, FilterPlan, Param, PlanBuilder, PlanCache, SortPlan, normalize_filters, normalize_sorts, bound_condition
+from .registry import MapperInfo, MapperRegistry, JSON_OPERATORS
+from .usage import UsageRecorder
+from ..signals import send_timing, tagging, timing
+
+# Shared by the default builder and BaseQuery
+plan_cache = PlanCache()
+mapper_registry = MapperRegistry()
+join_paths = JoinPaths(mapper_registry)
+
+class CtxBuilder:
+    """
+    CtxBuilder compiles a parsed ctx (filters, sorts, limit, offset, include
+    and fields) for any mapped class.
+
+    Filters and sorts are compiled once per shape (mapper, structure, operators
+    and value types) and kept in plan_cache, so repeated shapes only bind
+    their values. plan_cache can be None to disable it.
+
+    Columns, relationships and operators of each mapper are looked up in
+    mapper_registry, built once per mapper.
+
+    Relationship filters are joined or compiled to correlated EXISTS
+    subqueries according to relationship_filter: "join", "exists", or
+    "auto" to use EXISTS for to-many relationships (uselist) only, so the
+    rows are not multiplied. A relationship can override it with
+    info={"qs_filter": "join" | "exists" | "auto"}.
+
+    Each relationship path is joined once per query, shared by the filters
+    and the sorts, with aliases from join_paths for the targets joined more
+    than once. Joins only needed inside or / not branches, or by the sorts,
+    are outer joins.
+
+    Included relationship paths are limited to include_max_depth levels.
+
+    Statements are tagged with their mapper and shape for usage_recorder,
+    if it is set, and for the stage_timed signal, if it has receivers.
+    """
+
+    def __init__(
+        self,
+        plan_cache: Optional[PlanCache] = plan_cache,
+        mapper_registry: MapperRegistry = mapper_registry,
+        relationship_filter: str = "auto",
+        include_max_depth: int = 3,
+        usage_recorder: Optional[UsageRecorder] = None,
+        join_paths: JoinPaths = join_paths,
+    ):
+        self.plan_cache = plan_cache
+        self.mapper_registry = mapper_registry
+        self.join_paths = join_paths
+        self.relationship_filter = relationship_filter
+        self.include_max_depth = include_max_depth
+        self.usage_recorder = usage_recorder
+
+    @staticmethod
+    def statement_mapper(statement: Any) -> Mapper:
+        """
+        Mapper of the first entity of a select() or Query.
+        """
+        return inspect(statement.column_descriptions[0]["entity"]).mapper
+
+    def filter_helper(
+        self,
+        filters: Iterable[tuple],
+        mapper: Mapper,
+        sqlalchemy_condition: BooleanExpression,
+        plan: PlanBuilder,
+        path: tuple = (),
+        entity: Any = None,
+    ) -> Any:
+        """
+        Helper function to handle filters.
+
+        Args:
+            filters: The normalized filters to be applied (see normalize_filters).
+            mapper: The mapper for the current entity.
+            sqlalchemy_condition: The SQLAlchemy boolean expression (or_, and_, not_).
+            plan: The plan being compiled, it collects the joins and bind parameters.
+            path: The relationship path of the current entity from the queried one.
+            entity: The joined entity or alias of the path, the mapped class by default.
+
+        Returns:
+            The SQLAlchemy condition of the filters, or None if there is none.
+        """
+        conditions = []
+        info = self.mapper_registry.get(mapper)
+        entity, selectable = self.path_entity(info, entity)
+
+        for filter in filters:
+            for key, value in filter:
+                is_json = False
+
+                # A leaf value without a condition, ex. filters[username]=abc
+                if key not in BOOLEAN_OPERATORS and (isinstance(value, Param) or not isinstance(value, tuple)):
+                    raise QueryStringError(
+                        f"'{key}' has no condition, ex. filters[{key}][eq]=value."
+                    )
+
+                #If the the key is a json field
+                if '.' in key:
+                    is_json = True
+                    (key, json_body) = key.split(".", 1)
+
+                # If the key refers to a column property
+                if key in info.columns:
+                    column = self.column(info, key, selectable)
+
+                    if is_json:
+                        if key not in info.json_columns:
+                            raise QueryStringError(
+                                f"'{key}' is not a JSON column."
+                            )
+
+                        json_path = self.json_path(json_body)
+                        json_type = info.json_types[key].get(json_body)
+
+                        for condition, filter_value in value:
+                            if condition not in JSON_OPERATORS:
+                                raise QueryStringError(
+                                    f"'{condition}' is not a supported condition."
+                                )
+
+                            value_type = filter_value.type if isinstance(filter_value, Param) else type(filter_value)
+                            converter = None
+
+                            # Query string values are cast to the declared type of the path
+                            if json_type in CASTS and value_type == str:
+                                converter = json_type
+                            if json_type is not None:
+                                value_type = json_type
+
+                            # Containment (@>) can use a GIN index of the JSONB column. Only for
+                            # the paths of a declared type: {"num": "5"} does not contain the
+                            # number 5, the other paths are compared as text, as on the other
+                            # dialects. The paths with array indexes are compared too, {"0": value}
+                            # is no array.
+                            if condition == "eq" and isinstance(column.type, JSONB) and filter_value is not None \
+                                    and json_type is not None and not any(isinstance(part, int) for part in json_path):
+                                def contained(value, json_path=json_path, converter=converter):
+                                    value = converter(value) if converter is not None else value
+
+                                    for part in reversed(json_path):
+                                        value = {part: value}
+
+                                    return value
+
+                                if isinstance(filter_value, Param):
+                                    conditions.append(column.contains(plan.bind(filter_value, contained)))
+                                else:
+                                    conditions.append(column.contains(contained(filter_value)))
+                                continue
+
+                            if condition not in JSON_TYPED_CONDITIONS:
+                                value_type = str
+
+                            element = self.json_element(column, json_path, value_type)
+                            condition_func = getattr(element, JSON_CONDITIONS[condition])
+
+                            if isinstance(filter_value, Param):
+                                filter_value = plan.bind(filter_value, converter)
+
+                            if condition in {"ncontains", "nicontains"}:
+                                conditions.append(not_(condition_func(filter_value)))
+                            else:
+                                conditions.append(condition_func(filter_value))
+                    else: 
+                        # Set all the property filters
+                        for condition, filter_value in value:
+                            # Lists are bound as a single parameter where the dialect allows it
+                            if condition in {"in", "nin"} and isinstance(filter_value, Param) \
+                                    and filter_value.type in (list, LargeList):
+                                python_type = info.python_types[key]
+                                converter = list_converter(python_type) if python_type in CASTS else None
+                                name = plan.bind(filter_value, converter).key
+
+                                conditions.append(InList(
+                                    column, name, condition == "nin", filter_value.type is LargeList
+                                ))
+                                continue
+
+                            if condition in info.operators[key]:
+                                column_condition = CONDITIONS[condition]
+                                condition_func = getattr(
+                                    column, column_condition
+                                )
+
+                                if isinstance(filter_value, Param):
+                                    #Cast value to its necessary type if needed
+                                    converter = None
+                                    if filter_value.type == str and info.python_types[key] in CASTS:
+                                        converter = info.python_types[key]
+
+                                    value = plan.bind(filter_value, converter)
+                                else: 
+                                    value = filter_value
+
+                                if condition in {"ncontains", "nicontains"}:
+                                    # No native ncontains, nor nicontains attr.
+                                    # Use of a not and the contains, and 
+                                    # icontains attrs.
+                                    conditions.append(
+                                        not_(condition_func(value))
+                                    )
+                                else:
+                                    conditions.append(
+                                        condition_func(value)
+                                    )
+                            else:
+                                raise QueryStringError(
+                                    f"'{condition}' is not a supported condition."
+                                )
+
+                # If the key refers to a relationship
+                elif key in info.relationships:
+                    relationship = info.relationships[key]
+                    attribute = getattr(entity, key)
+
+                    # Inside an EXISTS every relationship is correlated too
+                    if plan.correlated or self.relationship_strategy(info, key) == "exists":
+                        correlated, plan.correlated = plan.correlated, True
+
+                        try:
+                            r_condition = self.filter_helper(
+                                [value], relationship.mapper, and_, plan
+                            )
+                        finally:
+                            plan.correlated = correlated
+
+                        # any() for to-many, has() for to-one
+                        exists = attribute.any if relationship.uselist else attribute.has
+                        conditions.append(exists(r_condition))
+                    else:
+                        relationship_path = path + (key,)
+                        target, onclause = self.join_paths.target(plan.mapper, relationship_path)
+                        plan.join(Join(relationship_path, target, onclause, plan.optional))
+
+                        r_condition = self.filter_helper(
+                            [value], relationship.mapper, and_, plan, relationship_path, target
+                        )
+                        if r_condition is not None:
+                            conditions.append(r_condition)
+
+                # If the key is a boolean operator
+                elif key in {"and", "or", "not"}:
+                    # The joins of or / not branches are outer joins
+                    optional, plan.optional = plan.optional, plan.optional or key != "and"
+
+                    try:
+                        if key == "and":
+                            condition = self.filter_helper(
+                                value, mapper, and_, plan, path, entity
+                            )
+                        elif key == "or":
+                            condition = self.filter_helper(
+                                value, mapper, or_, plan, path, entity
+                            )
+                        elif key == "not":
+                            condition = self.filter_helper(
+                                value, mapper, not_, plan, path, entity
+                            )
+                    finally:
+                        plan.optional = optional
+
+                    if condition is not None:
+                        conditions.append(condition)
+
+                else:
+                    raise QueryStringError(
+                        f"'{key}' is not a column property, nor a relationship name, nor a boolean function of (and, or, not)."
+                    )
+
+        # Empty filters have no condition at all
+        if not conditions:
+            return None
+
+        if sqlalchemy_condition is not_ and len(conditions) > 1:
+            raise QueryStringError(
+                "'not' takes a single condition, join several ones with and / or."
+            )
+
+        return sqlalchemy_condition(*conditions)
+
+    @staticmethod
+    def path_entity(info: MapperInfo, entity: Any) -> Tuple[Any, Any]:
+        """
+        The entity of a relationship path, and the selectable of its alias
+        (None for the mapped class).
+        """
+        if entity is None or entity is info.entity:
+            return info.entity, None
+
+        return entity, inspect(entity).selectable
+
+    @staticmethod
+    def column(info: MapperInfo, key: str, selectable: Any) -> Any:
+        """
+        A column of the entity, or of its alias if selectable is set.
+        """
+        column = info.columns[key]
+
+        return column if selectable is None else selectable.corresponding_column(column)
+
+    @staticmethod
+    def json_path(body: str) -> Tuple[Any, ...]:
+        """
+        Path of a JSON key (json_data.a.0.b), digits are array indexes.
+        """
+        return tuple(int(part) if part.isdigit() else part for part in body.split("."))
+
+    @staticmethod
+    def json_element(column: Any, path: Tuple[Any, ...], value_type: Optional[type]) -> Any:
+        """
+        The element of a JSON column at path, as value_type (a string by
+        default). It compiles per dialect: json_extract on SQLite, ->> or
+        #>> and a cast on Postgres, ...
+        """
+        element = column[path[0]] if len(path) == 1 else column[path]
+
+        return getattr(element, JSON_CASTS.get(value_type, "as_string"))()
+
+    def relationship_strategy(self, info: MapperInfo, key: str) -> str:
+        """
+        Strategy to filter by a relationship.
+
+        Args:
+            info: The MapperInfo of the entity.
+            key: The relationship name.
+
+        Returns:
+            "join" or "exists".
+        """
+        strategy = info.filter_strategies[key] or self.relationship_filter
+
+        if strategy == "auto":
+            return "exists" if info.relationships[key].uselist else "join"
+
+        return strategy
+
+    def get_filter_plan(self, mapper: Mapper, filters: FilterType) -> Tuple[FilterPlan, List[Any]]:
+        """
+        Get the plan of the filters from plan_cache, compiling it on a miss.
+
+        Args:
+            mapper: The mapper of the filtered entity.
+            filters: The filters to be applied.
+
+        Returns:
+            A (plan, values) tuple, values are bound with bound_condition.
+        """
+        start = time.perf_counter() if timing() else None
+        shape, values = normalize_filters(filters)
+        key = (type(self), self.relationship_filter, mapper, "filters", shape)
+        plan = self.plan_cache.get(key) if self.plan_cache is not None else None
+
+        if plan is None:
+            builder = PlanBuilder(mapper)
+            conditions = self.filter_helper([shape], mapper, and_, builder)
+            plan = builder.filter_plan(conditions)
+
+            if self.plan_cache is not None:
+                self.plan_cache.set(key, plan)
+
+        if start is not None:
+            send_timing("compile", start, mapper, (shape, ()))
+
+        return plan, values
+
+    def sort_helper(
+        self, sort: tuple, mapper: Mapper, plan: PlanBuilder, path: tuple = (), entity: Any = None
+    ) -> None:
+        """
+        Helper function to handle sorting.
+
+        Args:
+            sort: The normalized sorting instructions (see normalize_sorts).
+            mapper: The mapper for the current entity.
+            plan: The plan being compiled, it collects the joins and order by clauses.
+            path: The relationship path of the current entity from the queried one.
+            entity: The joined entity or alias of the path, the mapped class by default.
+        """
+        info = self.mapper_registry.get(mapper)
+        entity, selectable = self.path_entity(info, entity)
+
+        for key, value in sort:
+            # If the key refers to a column property
+            if key in info.columns:
+                plan.order_by(self.column(info, key, selectable), value == "desc")
+
+            # If the key is a path of a JSON column
+            elif '.' in key and key.split(".", 1)[0] in info.json_columns:
+                (key, json_body) = key.split(".", 1)
+                json_type = info.json_types[key].get(json_body)
+                element = self.json_element(self.column(info, key, selectable), self.json_path(json_body), json_type)
+
+                plan.order_by(element, value == "desc")
+
+            # If the key refers to a relationship
+            # Sorts use outer joins, they do not drop the rows without a related one
+            elif key in info.relationships:
+                relationship = info.relationships[key]
+                relationship_path = path + (key,)
+                target, onclause = self.join_paths.target(plan.mapper, relationship_path)
+                plan.join(Join(relationship_path, target, onclause, True))
+
+                self.sort_helper(value, relationship.mapper, plan, relationship_path, target)
+
+            else:
+                raise QueryStringError(
+                    f"'{key}' is not a column property, nor a relationship name."
+                )
+
+    def get_sort_plan(self, mapper: Mapper, sorts: List[SortType]) -> SortPlan:
+        """
+        Get the plan of the sorts from plan_cache, compiling it on a miss.
+
+        Args:
+            mapper: The mapper of the sorted entity.
+            sorts: The sorting instructions.
+
+        Returns:
+            The SortPlan of the sorts.
+        """
+        start = time.perf_counter() if timing() else None
+        shape = normalize_sorts(sorts)
+        key = (type(self), mapper, "sorts", shape)
+        plan = self.plan_cache.get(key) if self.plan_cache is not None else None
+
+        if plan is None:
+            builder = PlanBuilder(mapper)
+
+            for sort in shape:
+                self.sort_helper(sort, mapper, builder)
+
+            plan = builder.sort_plan()
+
+            if self.plan_cache is not None:
+                self.plan_cache.set(key, plan)
+
+        if start is not None:
+            send_timing("compile", start, mapper, ((), shape))
+
+        return plan
+
+    def join(self, statement: Any, joins: Iterable[Join]) -> Any:
+        """
+        Join the relationship paths of a plan that are not present in the statement already.
+
+        Args:
+            statement: A select() or Query.
+            joins: The joins of the plan.
+
+        Returns:
+            The statement with the joins applied.
+        """
+        return JoinRegistry(joins).apply(statement)
+
+    def filter(self, statement: Any, filters: FilterType) -> Any:
+        """
+        Apply the filters to a select() or Query of a mapped class.
+
+        Args:
+            statement: A select() or Query.
+            filters: The filters to be applied.
+
+        Returns:
+            The statement with the joins and conditions of the filters.
+        """
+        mapper = self.statement_mapper(statement)
+        plan, values = self.get_filter_plan(mapper, filters)
+        statement = self.join(statement, plan.joins)
+
+        if self.usage_recorder is not None or tagging():
+            statement = UsageRecorder.tag(statement, mapper, filters=filters)
+
+        if plan.condition is None:
+            return statement
+
+        return statement.where(bound_condition(plan, values))
+
+    def sort(self, statement: Any, sorts: List[SortType]) -> Any:
+        """
+        Apply the sorts to a select() or Query of a mapped class.
+
+        Args:
+            statement: A select() or Query.
+            sorts: The sorting instructions.
+
+        Returns:
+            The statement with the joins and order by clauses of the sorts.
+        """
+        mapper = self.statement_mapper(statement)
+        plan = self.get_sort_plan(mapper, sorts)
+        statement = self.join(statement, plan.joins)
+
+        if self.usage_recorder is not None or tagging():
+            statement = UsageRecorder.tag(statement, mapper, sorts=sorts)
+
+        return statement.order_by(*plan.clauses)
+
+    def facet_expressions(self, mapper: Mapper, facets: FacetsType) -> Tuple[List[Any], JoinRegistry]:
+        """
+        The expressions of the facets, and the joins of their relationship paths.
+
+        Args:
+            mapper: The mapper of the queried entity.
+            facets: The bucket size (None for the plain values) of each path.
+
+        Returns:
+            The expressions and the JoinRegistry of the facets.
+        """
+        expressions = []
+        joins = JoinRegistry()
+
+        for path, size in facets.items():
+            *names, key = path.split(".")
+            info = self.mapper_registry.get(mapper)
+            entity = None
+
+            for i, name in enumerate(names):
+                if name not in info.relationships:
+                    raise QueryStringError(f"'{path}' is not a facet of a column or a relationship path.")
+
+                # Facets do not drop the rows without a related one, they count as None
+                target, onclause = self.join_paths.target(mapper, tuple(names[:i + 1]))
+                joins.add(Join(tuple(names[:i + 1]), target, onclause, True))
+                info = self.mapper_registry.get(info.relationships[name].mapper)
+                entity = target
+
+            if key not in info.columns:
+                raise QueryStringError(f"'{path}' is not a facet of a column or a relationship path.")
+
+            _, selectable = self.path_entity(info, entity)
+            column = self.column(info, key, selectable)
+
+            if size is not None:
+                if info.python_types[key] not in (int, float):
+                    raise QueryStringError(f"'{path}' is not a numeric column, it can not have buckets.")
+
+                column = bucket(column, size)
+
+            expressions.append(column)
+
+        return expressions, joins
+
+    def facets(self, statement: Any, facets: FacetsType, dialect: Optional[str] = None) -> Any:
+        """
+        The statement of the counts of the values of the facets of a
+        filtered select() or Query, for facet_counts.
+
+        All the facets are computed in one statement: GROUPING SETS on the
+        dialects that have them (GROUPING_SETS_DIALECTS), a UNION ALL of
+        one GROUP BY per facet otherwise. The entities are counted once
+        even if a to-many relationship is joined.
+
+        Args:
+            statement: A select() or Query, with the filters applied.
+            facets: The bucket size (None for the plain values) of each path.
+            dialect: The name of the dialect of the statement.
+
+        Returns:
+            The select() of the facets.
+        """
+        mapper = self.statement_mapper(statement)
+        expressions, joins = self.facet_expressions(mapper, facets)
+        statement = joins.apply(statement)
+        primary_key = mapper.primary_key
+
+        # Joined collections repeat the entity, its rows are counted once
+        multiplied = any(
+            getattr(getattr(join[1], "property", None), "uselist", False)
+            for join in statement._setup_joins
+        )
+
+        if multiplied and len(primary_key) == 1:
+            count = func.count(distinct(primary_key[0]))
+        else:
+            count = func.count()
+
+        return facet_select(statement, expressions, count, dialect in GROUPING_SETS_DIALECTS)
+
+    def field_attributes(self, info: MapperInfo, fields: FieldsType) -> Optional[List[Any]]:
+        """
+        Attributes of the sparse fieldset of an entity.
+
+        Args:
+            info: The MapperInfo of the entity.
+            fields: The column names by table name.
+
+        Returns:
+            The attributes, or None if the fields have no fieldset for the entity.
+        """
+        names = fields.get(info.name)
+
+        if names is None:
+            return None
+
+        for name in names:
+            if name not in info.columns:
+                raise QueryStringError(f"'{name}' is not a field of '{info.name}'.")
+
+        return [getattr(info.entity, name) for name in names]
+
+    def include_options(
+        self,
+        mapper: Mapper,
+        include: List[str],
+        allowed: Optional[Iterable[str]] = None,
+        fields: Optional[FieldsType] = None,
+    ) -> List[Any]:
+        """
+        Loader options to eager load the relationship paths of the context.
+
+        Each path (ex. "person" or "emails.user") is loaded with joinedload
+        for to-one relationships and selectinload for collections, so the
+        relationships are not lazy loaded once per row.
+
+        Args:
+            mapper: The mapper of the queried entity.
+            include: The relationship paths to be loaded.
+            allowed: The paths that can be loaded, all of them if None
+                     (up to include_max_depth).
+            fields: The column names by table name, to load only those of
+                    the included entities.
+
+        Returns:
+            The loader options.
+        """
+        allowed = None if allowed is None else set(allowed)
+        options = []
+
+        for path in include:
+            keys = path.split(".")
+
+            if len(keys) > self.include_max_depth:
+                raise QueryStringError(f"'{path}' exceeds the max include depth of {self.include_max_depth}.")
+
+            if allowed is not None and path not in allowed:
+                raise QueryStringError(f"'{path}' can not be included.")
+
+            loader = None
+            info = self.mapper_registry.get(mapper)
+
+            for key in keys:
+                if key not in info.relationships:
+                    raise QueryStringError(f"'{path}' is not a relationship path.")
+
+                relationship = info.relationships[key]
+                attribute = getattr(info.entity, key)
+
+                if relationship.uselist:
+                    loader = selectinload(attribute) if loader is None else loader.selectinload(attribute)
+                else:
+                    loader = joinedload(attribute) if loader is None else loader.joinedload(attribute)
+
+                info = self.mapper_registry.get(relationship.mapper)
+                attributes = None if fields is None else self.field_attributes(info, fields)
+
+                if attributes is not None:
+                    loader = loader.load_only(*attributes)
+
+            options.append(loader)
+
+        return options
+
+    def select(
+        self,
+        entity: Any,
+        ctx: Dict[str, Any],
+        allowed: Optional[Iterable[str]] = None,
+    ) -> Select:
+        """
+        Build a select() of a mapped class from a parsed ctx (see
+        get_url_query_ctx): filters, sorts, offset, limit, and the optional
+        include and fields.
+
+        Args:
+            entity: The mapped class.
+            ctx: The parsed ctx.
+            allowed: The relationship paths that can be included.
+
+        Returns:
+            The select() statement, for Session.execute or AsyncSession.execute
+        """
+        mapper = inspect(entity).mapper
+        statement = select(entity)
+        joins = JoinRegistry()
+        condition = None
+        clauses = ()
+
+        if ctx.get("filters"):
+            plan, values = self.get_filter_plan(mapper, ctx["filters"])
+
+            for join in plan.joins:
+                joins.add(join)
+
+            condition = bound_condition(plan, values)
+
+        if ctx.get("sorts"):
+            plan = self.get_sort_plan(mapper, ctx["sorts"])
+            clauses = plan.clauses
+
+            for join in plan.joins:
+                joins.add(join)
+
+        statement = joins.apply(statement)
+
+        if condition is not None:
+            statement = statement.where(condition)
+        if clauses:
+            statement = statement.order_by(*clauses)
+
+        fields = ctx.get("fields")
+
+        if fields:
+            attributes = self.field_attributes(self.mapper_registry.get(mapper), fields)
+
+            if attributes is not None:
+                statement = statement.options(load_only(*attributes))
+
+        if ctx.get("include"):
+            statement = statement.options(*self.include_options(mapper, ctx["include"], allowed, fields))
+
+        if self.usage_recorder is not None or tagging():
+            statement = UsageRecorder.tag(statement, mapper, ctx.get("filters"), ctx.get("sorts"))
+
+        if ctx.get("offset"):
+            statement = statement.offset(ctx["offset"])
+        if ctx.get("limit") is not None:
+            statement = statement.limit(ctx["limit"])
+
+        return statement
+
+default_builder = CtxBuilder()
+
+def select_by_ctx(entity: Any, ctx: Dict[str, Any], allowed: Optional[Iterable[str]] = None) -> Select:
+    """
+    Build a select() of a mapped class from a parsed ctx with the default
+    CtxBuilder (see CtxBuilder.select).
+
+    Args:
+        entity: The mapped class.
+        ctx: The parsed ctx.
+        allowed: The relationship paths that can be included.
+
+    Returns:
+        The select() statement, for Session.execute or AsyncSession.execute
+    """
+    return default_builder.select(entity, ctx, allowed)
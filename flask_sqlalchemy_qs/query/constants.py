@@ -1,12 +1,15 @@
 """
 This file is to integrate constants
 """
-from typing import Dict, Union
+from typing import Dict, List, Optional, Union
 from sqlalchemy import or_, and_, not_
 
 # Types
 FilterType = Dict[str, Union[bool, str, Dict]]
 SortType = Dict[str, Union[str, Dict]]
+FieldsType = Dict[str, List[str]]
+# Bucket size, or None, of each facet path
+FacetsType = Dict[str, Optional[Union[int, float]]]
 BooleanExpression = Union[or_, and_, not_]
 
 CONDITIONS = {
@@ -34,29 +37,27 @@ CONDITIONS = {
     "iendswith": "iendswith"
 }
 
+# Conditions of the JSON paths (json_data.a.b), applied to the JSON
+# element with the CONDITIONS method of the same name
 JSON_CONDITIONS = {
-    "eq": "=",
-    "ne": "!=",
-    "lt": "<",
-    "lte": "<=",
-    "gt": ">",
-    "gte": ">=",
-    "contains": "contains",
-    "ncontains": "not contains",
-    "icontains": "icontains",
-    "nicontains": "not icontains",
-    "like": "like",
-    "ilike": "ilike",
-    "not_like": "not like",
-    "not_ilike": "not ilike",
-    "startswith": "startswith",
-    "istartswith": "istartswith",
-    "endswith": "endswith",
-    "iendswith": "iendswith"
+    condition: CONDITIONS[condition]
+    for condition in (
+        "eq", "ne", "lt", "lte", "gt", "gte",
+        "contains", "ncontains", "icontains", "nicontains",
+        "like", "ilike", "not_like", "not_ilike",
+        "startswith", "istartswith", "endswith", "iendswith",
+    )
 }
+# Conditions compared with the element as a number or boolean, the others
+# compare it as a string
+JSON_TYPED_CONDITIONS = {"eq", "ne", "lt", "lte", "gt", "gte"}
 
 CASTS = {int, float}
+# Accessors of a JSON element by python type (json_extract on SQLite,
+# ->> and a cast on Postgres)
 JSON_CASTS = {
-    int: 'integer',
-    float: 'float'
-}
\ No newline at end of file
+    int: "as_integer",
+    float: "as_float",
+    bool: "as_boolean",
+    str: "as_string"
+}
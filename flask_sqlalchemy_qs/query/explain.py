@@ -0,0 +1,285 @@
+"""
+The compiled SQL and the dialect's EXPLAIN of ctx queries, and a sampled
+log of the slow ones keyed by their normalized shape
+"""
+import json
+import logging
+import random
+import threading
+import time
+from typing import Any, Dict, List, Sequence
+
+from sqlalchemy import event, inspect
+from sqlalchemy.engine import Engine
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.expression import ClauseElement, Executable
+
+from ..signals import USAGE_OPTION, taggers
+
+logger = logging.getLogger("flask_sqlalchemy_qs.slow_queries")
+
+# Prefix of the EXPLAIN statement of each dialect, "EXPLAIN " for the others
+PREFIXES = {
+    "postgresql": "EXPLAIN (FORMAT JSON) ",
+    "sqlite": "EXPLAIN QUERY PLAN ",
+    "mysql": "EXPLAIN FORMAT=JSON ",
+    "mariadb": "EXPLAIN FORMAT=JSON ",
+}
+
+# Dialects whose transaction is aborted by a failed statement, the EXPLAIN
+# of the slow query log runs in a savepoint there
+SAVEPOINT_DIALECTS = {"postgresql"}
+
+# The types the params of the explain keep, the others are shown as strings
+JSON_TYPES = (str, int, float, bool, type(None))
+
+
+class Explain(Executable, ClauseElement):
+    """
+    The EXPLAIN of a statement, in the syntax of the dialect it is executed with.
+    """
+
+    inherit_cache = False
+
+    def __init__(self, statement: Any):
+        self.statement = statement
+
+
+@compiles(Explain)
+def _compile_explain(element: Explain, compiler: Any, **kwargs: Any) -> str:
+    return PREFIXES.get(compiler.dialect.name, "EXPLAIN ") + compiler.process(element.statement, **kwargs)
+
+
+def plan_rows(dialect: str, rows: Sequence[Sequence[Any]]) -> Any:
+    """
+    The plan of the rows of an EXPLAIN: the JSON document of Postgres and
+    MySQL, the steps of SQLite, the plain rows of the other dialects.
+    """
+    if dialect in ("postgresql", "mysql", "mariadb") and rows:
+        plan = rows[0][0]
+        return json.loads(plan) if isinstance(plan, str) else plan
+
+    if dialect == "sqlite":
+        return [{"id": row[0], "parent": row[1], "detail": row[3]} for row in rows]
+
+    return [list(row) for row in rows]
+
+
+def statement_joins(statement: Any) -> List[Dict[str, Any]]:
+    """
+    The joins of a select() or Query, in order, with the name of their
+    target (the alias of the relationship path, see JoinPaths) and whether
+    they are outer joins.
+    """
+    joins = []
+
+    for target, onclause, _, flags in getattr(statement, "_setup_joins", ()):
+        info = inspect(target, raiseerr=False)
+
+        if getattr(info, "is_aliased_class", False):
+            name = info.name
+        elif getattr(info, "is_mapper", False):
+            name = info.local_table.name
+        else:
+            name = getattr(target, "name", str(target))
+
+        joins.append({
+            "target": name,
+            "onclause": str(onclause) if onclause is not None else None,
+            "outer": flags.get("isouter", False),
+        })
+
+    return joins
+
+
+def _json_params(params: Dict[str, Any]) -> Dict[str, Any]:
+    return {key: value if isinstance(value, JSON_TYPES) else str(value) for key, value in params.items()}
+
+
+def explain(connection: Any, statement: Any) -> Dict[str, Any]:
+    """
+    The compiled SQL of a select() or Query and its EXPLAIN.
+
+    Args:
+        connection: The Connection to explain the statement on, ex.
+                    session.connection().
+        statement: A select() or Query.
+
+    Returns:
+        The "dialect", "sql", "params", "joins" and "plan" of the statement.
+    """
+    if hasattr(statement, "statement"):
+        statement = statement.statement
+
+    dialect = connection.dialect.name
+    # The expanded state has the params of the in lists one by one
+    expanded = statement.compile(dialect=connection.dialect).construct_expanded_state()
+
+    return {
+        "dialect": dialect,
+        "sql": expanded.statement,
+        "params": _json_params(expanded.parameters),
+        "joins": statement_joins(statement),
+        "plan": plan_rows(dialect, connection.execute(Explain(statement)).all()),
+    }
+
+
+def _model(mapper: Any) -> str:
+    return getattr(mapper.local_table, "name", mapper.class_.__name__)
+
+
+class SlowQueryLog:
+    """
+    Log of the ctx statements whose execution exceeds threshold seconds,
+    keyed by model and normalized shape (the filters and sorts without
+    their values), with the SQL, the joins and the plan of the shape.
+
+    Only sample_rate of the slow statements are recorded, and each shape
+    is explained once, the first time it is recorded, so the overhead of
+    the log is bounded; the fast statements only take two clock reads.
+    Each entry is logged as a warning of the flask_sqlalchemy_qs.slow_queries
+    logger too. Enable the log with listen: it is opt-in, as the other
+    engine listeners of the package, since it needs the engine and makes
+    the queries built while it listens carry their shape.
+    """
+
+    def __init__(
+        self,
+        threshold: float = 0.5,
+        sample_rate: float = 1.0,
+        max_entries: int = 1000,
+        explain: bool = True,
+    ):
+        self.threshold = threshold
+        self.sample_rate = sample_rate
+        self.max_entries = max_entries
+        self.explain = explain
+        self._entries: Dict[tuple, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+
+    def listen(self, target: Any = Engine) -> None:
+        """
+        Time the ctx statements executed by an engine, which are tagged
+        with their shape while the log listens.
+
+        Args:
+            target: Engine class or instance, all engines by default.
+        """
+        event.listen(target, "before_cursor_execute", self._before_cursor_execute)
+        event.listen(target, "after_cursor_execute", self._after_cursor_execute)
+        taggers.add(self)
+
+    def remove(self, target: Any = Engine) -> None:
+        """
+        Remove the listeners added by listen.
+        """
+        event.remove(target, "before_cursor_execute", self._before_cursor_execute)
+        event.remove(target, "after_cursor_execute", self._after_cursor_execute)
+        taggers.discard(self)
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany) -> None:
+        if context is not None and USAGE_OPTION in context.execution_options:
+            context._qs_slow_start = time.perf_counter()
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany) -> None:
+        start = getattr(context, "_qs_slow_start", None)
+
+        if start is None:
+            return
+
+        elapsed = time.perf_counter() - start
+
+        if elapsed >= self.threshold and (self.sample_rate >= 1 or random.random() < self.sample_rate):
+            self.record(conn, context, statement, parameters, elapsed)
+
+    def _plan(self, conn: Any, statement: str, parameters: Any) -> Any:
+        # On a cursor of its own, with the driver SQL and params of the statement
+        dialect = conn.dialect.name
+        savepoint = dialect in SAVEPOINT_DIALECTS
+        cursor = conn.connection.dbapi_connection.cursor()
+
+        try:
+            if savepoint:
+                cursor.execute("SAVEPOINT qs_explain")
+
+            try:
+                cursor.execute(PREFIXES.get(dialect, "EXPLAIN ") + statement, parameters)
+                plan = plan_rows(dialect, cursor.fetchall())
+
+            except Exception as e:
+                # The failed EXPLAIN must not abort the transaction of the statement
+                if savepoint:
+                    cursor.execute("ROLLBACK TO SAVEPOINT qs_explain")
+
+                plan = {"error": str(e)}
+
+            if savepoint:
+                cursor.execute("RELEASE SAVEPOINT qs_explain")
+
+            return plan
+
+        except Exception as e:
+            return {"error": str(e)}
+
+        finally:
+            cursor.close()
+
+    def record(self, conn: Any, context: Any, statement: str, parameters: Any, elapsed: float) -> None:
+        """
+        Record a slow execution of a tagged statement.
+
+        Args:
+            conn: The Connection of the statement.
+            context: The execution context of the statement.
+            statement: The SQL of the statement.
+            parameters: The driver params of the statement.
+            elapsed: The execution time in seconds.
+        """
+        mapper, filter_shape, sort_shape = context.execution_options[USAGE_OPTION]
+        key = (mapper, filter_shape, sort_shape)
+
+        with self._lock:
+            entry = self._entries.get(key)
+
+            if entry is not None:
+                entry["count"] += 1
+                entry["total"] += elapsed
+                entry["max"] = max(entry["max"], elapsed)
+
+            elif len(self._entries) >= self.max_entries:
+                return
+
+        if entry is None:
+            compiled = getattr(context, "compiled", None)
+            entry = {
+                "model": _model(mapper),
+                "shape": [filter_shape, sort_shape],
+                "sql": statement,
+                "joins": statement_joins(compiled.statement) if compiled is not None else [],
+                "plan": self._plan(conn, statement, parameters) if self.explain else None,
+                "count": 1,
+                "total": elapsed,
+                "max": elapsed,
+            }
+
+            with self._lock:
+                entry = self._entries.setdefault(key, entry)
+
+        logger.warning("Slow query on %s (%.3fs): %r", entry["model"], elapsed, entry["shape"])
+
+    def entries(self) -> List[Dict[str, Any]]:
+        """
+        The recorded shapes, the slowest first.
+
+        Returns:
+            A list of dicts with the model, shape, sql, joins, plan, and the
+            count, total and max seconds of the slow executions of each shape.
+        """
+        with self._lock:
+            entries = [dict(entry) for entry in self._entries.values()]
+
+        return sorted(entries, key=lambda entry: -entry["max"])
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
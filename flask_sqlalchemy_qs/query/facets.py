@@ -0,0 +1,105 @@
+"""
+Facets of a ctx query: the counts of the values (or buckets of values) of
+several columns under the same filters, computed in a single statement
+"""
+from typing import Any, Dict, List, Optional, Sequence
+
+from sqlalchemy import Float, Integer, case, cast, func, literal_column, union_all
+from sqlalchemy.orm import Query
+
+# Dialects with GROUPING SETS, the others get a UNION ALL of GROUP BY
+GROUPING_SETS_DIALECTS = {"postgresql", "mssql", "oracle"}
+
+
+def bucket(column: Any, size: float) -> Any:
+    """
+    The bucket of size of a numeric column, floor(column / size) * size,
+    without the floor function that SQLite may not have.
+    """
+    # The numbers are inline, so the GROUP BY expression is the same as the
+    # selected one with any parameter style
+    size = literal_column(repr(size))
+    value = cast(column, Float) / size
+    truncated = cast(value, Integer)
+
+    # The cast truncates (SQLite) or rounds (Postgres), both are fixed down to the floor
+    return (truncated - case((value < truncated, literal_column("1")), else_=literal_column("0"))) * size
+
+
+def _with_columns(statement: Any, *columns: Any) -> Any:
+    if isinstance(statement, Query):
+        return statement.with_entities(*columns)
+
+    return statement.with_only_columns(*columns, maintain_column_froms=True)
+
+
+def facet_select(statement: Any, expressions: Sequence[Any], count: Any, grouping_sets: bool) -> Any:
+    """
+    The statement of the facets of a filtered select() or Query.
+
+    Args:
+        statement: The select() or Query, with the joins of the facets.
+        expressions: The expression of each facet.
+        count: The aggregate of each value.
+        grouping_sets: Whether to use GROUPING SETS, or a UNION ALL.
+
+    Returns:
+        The select() of the facet counts, for facet_counts.
+    """
+    statement = statement.order_by(None).limit(None).offset(None)
+
+    if isinstance(statement, Query):
+        statement = statement.enable_eagerloads(False)
+
+    if grouping_sets:
+        columns = [expression.label(f"f{i}") for i, expression in enumerate(expressions)]
+        # GROUPING(expression) is 0 in the rows grouped by it
+        columns += [func.grouping(expression).label(f"g{i}") for i, expression in enumerate(expressions)]
+        statement = _with_columns(statement, *columns, count.label("count")) \
+            .group_by(func.grouping_sets(*expressions))
+
+        return statement.statement if isinstance(statement, Query) else statement
+
+    selects = []
+
+    for i, expression in enumerate(expressions):
+        select = _with_columns(statement, literal_column(str(i)).label("facet"), expression.label("value"), count.label("count")) \
+            .group_by(expression)
+        selects.append(select.statement if isinstance(select, Query) else select)
+
+    return union_all(*selects) if len(selects) > 1 else selects[0]
+
+
+def facet_counts(rows: Sequence[Any], paths: Sequence[str], limit: Optional[int] = None) -> Dict[str, List[Dict[str, Any]]]:
+    """
+    The counts of each facet from the rows of facet_select, by count
+    (descending) and value.
+
+    Args:
+        rows: The rows of the facet statement.
+        paths: The paths of the facets, in the order of their expressions.
+        limit: Max amount of values of each facet.
+
+    Returns:
+        The {"value": value, "count": count} of each facet path.
+    """
+    counts: Dict[str, List[Dict[str, Any]]] = {path: [] for path in paths}
+
+    for row in rows:
+        mapping = row._mapping
+
+        if "facet" in mapping:
+            index, value = mapping["facet"], mapping["value"]
+        else:
+            index = next(i for i in range(len(paths)) if mapping[f"g{i}"] == 0)
+            value = mapping[f"f{index}"]
+
+        counts[paths[index]].append({"value": value, "count": mapping["count"]})
+
+    for path, values in counts.items():
+        values.sort(key=lambda item: (-item["count"], item["value"] is None, item["value"] if item["value"] is not None else 0))
+
+        if limit is not None:
+            del values[limit:]
+
+    return counts
@@ -0,0 +1,98 @@
+"""
+in / nin conditions that pick their SQL by dialect and list size, so lists
+of thousands of values neither render thousands of parameters nor hit the
+parameter limits of the database
+"""
+from typing import Any, Callable, List
+
+from sqlalchemy import JSON, Boolean, bindparam, func
+from sqlalchemy.dialects.postgresql import ARRAY
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql import ColumnElement, all_, any_, select
+from sqlalchemy.sql.visitors import InternalTraversal
+
+# Lists with more values are large lists, they are compiled apart (see
+# normalize_filters) since their SQL can differ
+LARGE_IN_LIST = 500
+
+
+class LargeList(list):
+    """
+    Type of the Param of a large in / nin list in the filter shapes.
+    """
+
+
+class InList(ColumnElement):
+    """
+    column IN (values) or column NOT IN (values), compiled as:
+
+    - Postgres: column = ANY(:array) / column != ALL(:array), a single
+      array parameter for any size.
+    - SQLite, large lists: column IN (SELECT value FROM json_each(:json)),
+      a single JSON parameter.
+    - Otherwise: an expanding parameter, column IN (:p_1, :p_2, ...).
+
+    The parameters share the name of the plan parameter, so values are
+    bound by bound_condition as the other ones.
+    """
+
+    __visit_name__ = "qs_in_list"
+    inherit_cache = True
+    type = Boolean()
+    # A comparison already, so it is not compared to 1 where booleans are
+    # integers (SQLite, MySQL), which would prevent the use of an index
+    _is_implicitly_boolean = True
+
+    _traverse_internals = [
+        ("column", InternalTraversal.dp_clauseelement),
+        ("expanding", InternalTraversal.dp_clauseelement),
+        ("array", InternalTraversal.dp_clauseelement),
+        ("json", InternalTraversal.dp_clauseelement),
+        ("negate", InternalTraversal.dp_boolean),
+        ("large", InternalTraversal.dp_boolean),
+    ]
+
+    def __init__(self, column: Any, name: str, negate: bool = False, large: bool = False):
+        self.column = column
+        self.expanding = bindparam(name, expanding=True)
+        self.array = bindparam(name, type_=ARRAY(column.type))
+        self.json = bindparam(name, type_=JSON())
+        self.negate = negate
+        self.large = large
+
+
+@compiles(InList)
+def _compile_in_list(element: InList, compiler: Any, **kw: Any) -> str:
+    method = element.column.notin_ if element.negate else element.column.in_
+
+    return compiler.process(method(element.expanding), **kw)
+
+
+@compiles(InList, "postgresql")
+def _compile_in_list_postgresql(element: InList, compiler: Any, **kw: Any) -> str:
+    if element.negate:
+        return compiler.process(element.column != all_(element.array), **kw)
+
+    return compiler.process(element.column == any_(element.array), **kw)
+
+
+@compiles(InList, "sqlite")
+def _compile_in_list_sqlite(element: InList, compiler: Any, **kw: Any) -> str:
+    if not element.large:
+        return _compile_in_list(element, compiler, **kw)
+
+    values = select(func.json_each(element.json).table_valued("value").c.value).scalar_subquery()
+    method = element.column.notin_ if element.negate else element.column.in_
+
+    return compiler.process(method(values), **kw)
+
+
+def list_converter(python_type: type) -> Callable[[List[Any]], List[Any]]:
+    """
+    Converter of the values of a list to the python type of the column,
+    since query string values are strings.
+    """
+    def convert(values: List[Any]) -> List[Any]:
+        return [python_type(value) if isinstance(value, str) else value for value in values]
+
+    return convert
@@ -0,0 +1,133 @@
+"""
+Join registry of a query: the relationship paths of its filters and sorts,
+each joined once, with aliases for the targets that are already part of
+the query
+"""
+import threading
+from collections import OrderedDict, deque, namedtuple
+from typing import Any, Dict, Iterable, Iterator, Tuple
+
+from sqlalchemy import inspect
+from sqlalchemy.orm import Mapper, aliased
+
+from .registry import MapperRegistry
+
+# path is the tuple of relationship names from the queried entity, target the
+# entity (or alias) joined and onclause the relationship attribute of the parent
+Join = namedtuple("Join", ["path", "target", "onclause", "outer"])
+
+
+class JoinPaths:
+    """
+    Targets and onclauses of the relationship paths of a queried entity.
+
+    The first path (breadth first, in declaration order) to each mapper
+    joins the mapper itself, any other path to it (self-referential
+    relationships, a path back to the queried entity, two relationships to
+    the same entity) joins an alias. The same path always gets the same
+    target, so the plans of the filters and the sorts, compiled and cached
+    apart, join it once when they are applied together.
+    """
+
+    def __init__(self, mapper_registry: MapperRegistry):
+        self.mapper_registry = mapper_registry
+        self._primary: Dict[Mapper, Dict[Mapper, tuple]] = {}
+        self._targets: Dict[Tuple[Mapper, tuple], Tuple[Any, Any]] = {}
+        self._lock = threading.Lock()
+
+    def primary_paths(self, mapper: Mapper) -> Dict[Mapper, tuple]:
+        """
+        The first path to each mapper reachable from mapper.
+        """
+        paths = self._primary.get(mapper)
+
+        if paths is None:
+            paths = {mapper: ()}
+            queue = deque([mapper])
+
+            while queue:
+                current = queue.popleft()
+
+                for key, relationship in self.mapper_registry.get(current).relationships.items():
+                    if relationship.mapper not in paths:
+                        paths[relationship.mapper] = paths[current] + (key,)
+                        queue.append(relationship.mapper)
+
+            paths = self._primary.setdefault(mapper, paths)
+
+        return paths
+
+    def target(self, mapper: Mapper, path: tuple) -> Tuple[Any, Any]:
+        """
+        The (target, onclause) of a relationship path.
+
+        Args:
+            mapper: The mapper of the queried entity.
+            path: The relationship names from the queried entity.
+
+        Returns:
+            The entity or alias to join, and the relationship attribute to join it on.
+        """
+        key = (mapper, path)
+        target = self._targets.get(key)
+
+        if target is not None:
+            return target
+
+        parent = self.target(mapper, path[:-1])[0] if len(path) > 1 else mapper.entity
+        relationship = self.mapper_registry.get(inspect(parent).mapper).relationships[path[-1]]
+        entity = relationship.mapper.entity
+
+        if self.primary_paths(mapper).get(relationship.mapper) != path:
+            entity = aliased(entity, name="_".join((relationship.mapper.local_table.name,) + path))
+
+        with self._lock:
+            return self._targets.setdefault(key, (entity, getattr(parent, path[-1])))
+
+
+class JoinRegistry:
+    """
+    The joins of a query by relationship path. A path used by several
+    filters, or by the filters and the sorts, is joined once: as an inner
+    join if any condition requires it, and as an outer join if it is only
+    used inside or / not branches or by the sorts, so it does not drop the
+    rows without a related one.
+    """
+
+    def __init__(self, joins: Iterable[Join] = ()):
+        self._joins: Dict[tuple, Join] = OrderedDict()
+
+        for join in joins:
+            self.add(join)
+
+    def add(self, join: Join) -> None:
+        current = self._joins.get(join.path)
+
+        if current is None:
+            self._joins[join.path] = join
+        elif current.outer and not join.outer:
+            self._joins[join.path] = current._replace(outer=False)
+
+    def __iter__(self) -> Iterator[Join]:
+        return iter(self._joins.values())
+
+    def __len__(self) -> int:
+        return len(self._joins)
+
+    def apply(self, statement: Any) -> Any:
+        """
+        Join the paths that are not joined in a select() or Query already.
+
+        Args:
+            statement: A select() or Query.
+
+        Returns:
+            The statement with the joins applied.
+        """
+        joined = {id(join[1]) for join in statement._setup_joins}
+
+        for join in self:
+            if id(join.onclause) not in joined:
+                statement = statement.join(join.target, join.onclause, isouter=join.outer)
+
+        return statement
@@ -2,250 +2,428 @@
 BaseQuery class to extend Query class and make use of filtering and
 sorting features
 """
-
-from sqlalchemy import asc, desc, or_, and_, not_, text, bindparam
-from sqlalchemy.orm import Query, Mapper
-from typing import List
-
-from .constants import CONDITIONS, CASTS, FilterType, SortType, BooleanExpression, JSON_CONDITIONS, JSON_CASTS
+import time
+
+from sqlalchemy import asc, desc
+from sqlalchemy.orm import Query, Mapper, load_only
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional
+
+from .builder import CtxBuilder, plan_cache, mapper_registry
+from .constants import FacetsType, FieldsType, FilterType, SortType
+from .explain import explain
+from .facets import facet_counts
+from .pagination import NULLS_FIRST_DIALECTS, TOTALS, Page, count_total, decode_cursor, encode_cursor, nullable_keys, seek_condition, to_many_path, window_total, with_primary_key
+from .plan import PlanCache
+from .registry import MapperRegistry
+from .result_cache import MISSING, ResultCache, ctx_tables, statement_tables
+from .routing import ROUTE_CTX_OPTION, ROUTE_OPTION, ReplicaRouter, merge_ctx
+from .timeouts import COST_OPTION, TIMEOUT_OPTION, StatementTimeout
+from .usage import UsageRecorder
+from ..qs_parser.errors import QueryStringError
+from ..response import to_dict
+from ..signals import USAGE_OPTION, send_error, send_timing, timing
 
 class BaseQuery(Query):
     """
     BaseQuery class extends the Query class and provides additional filtering and sorting features.
+
+    It is a thin wrapper over CtxBuilder, configured by the class attributes
+    plan_cache, mapper_registry, relationship_filter and include_max_depth
+    (see CtxBuilder), which can be overridden in a subclass.
+
+    result_cache is an opt-in ResultCache used by cached_by_ctx,
+    usage_recorder an opt-in UsageRecorder of the filters and sorts executed,
+    router an opt-in ReplicaRouter of the ctx queries, and statement_timeout
+    an opt-in StatementTimeout of the ctx queries (see apply_timeouts).
     """
 
-    def filter_helper(
-        self,
-        filters: FilterType,
-        mapper: Mapper,
-        sqlalchemy_condition: BooleanExpression,
-        query: Query,
-    ) -> Query:
+    plan_cache: Optional[PlanCache] = plan_cache
+    mapper_registry: MapperRegistry = mapper_registry
+    relationship_filter: str = "auto"
+    include_max_depth: int = 3
+    result_cache: Optional[ResultCache] = None
+    usage_recorder: Optional[UsageRecorder] = None
+    router: Optional[ReplicaRouter] = None
+    statement_timeout: Optional[StatementTimeout] = None
+
+    @property
+    def ctx_builder(self) -> CtxBuilder:
+        """
+        The CtxBuilder with the configuration of the query class.
         """
-        Helper function to handle filters.
+        return CtxBuilder(
+            self.plan_cache,
+            self.mapper_registry,
+            self.relationship_filter,
+            self.include_max_depth,
+            self.usage_recorder,
+        )
+
+    def ctx_mapper(self) -> Mapper:
+        """
+        The mapper of the queried entity.
+        """
+        return CtxBuilder.statement_mapper(self)
+
+    def filter_by_ctx(self, filters: FilterType) -> Query:
+        """
+        Function to generate filters based on the context.
 
         Args:
             filters: The filters to be applied.
-            mapper: The mapper for the current entity.
-            sqlalchemy_condition: The SQLAlchemy boolean expression (or_, and_, not_).
-            query: The current Query object.
 
         Returns:
             A Query object with the applied filters.
         """
-        conditions = []
-        column_names = [column.key for column in mapper.columns]
-        relation_names = [relationship.key for relationship in mapper.relationships]
-        json_params_counter = 1
-
-        for filter in filters:
-            for key, value in filter.items():
-                try:
-                    is_json = False
-
-                    #If the the key is a json field
-                    if '.' in key:
-                        is_json = True
-                        (key, json_body) = key.split(".", 1)
-
-                    # If the key refers to a column property
-                    if key in column_names:
-                        idx = column_names.index(key)
-                        column = mapper.columns[idx]
-
-                        if is_json:
-                            # Agregar la condición a las condiciones existentes
-                            for condition, filter_value in value.items():
-                                if condition in JSON_CONDITIONS:
-                                    # Construir la condición JSON como una cadena de texto
-                                    if type(filter_value) in JSON_CASTS:
-                                        condition_sql = f"CAST({column.key} ->> :json_body_{json_params_counter} AS {JSON_CASTS[type(filter_value)]}) {JSON_CONDITIONS[condition]} :filter_value_{json_params_counter}"
-                                    else:
-                                        condition_sql = f"{column.key} ->> :json_body_{json_params_counter} {JSON_CONDITIONS[condition]} :filter_value_{json_params_counter}"
-
-                                    # Agregar los parámetros con nombre para evitar inyección SQL
-                                    conditions.append(text(condition_sql).bindparams(
-                                        bindparam(f'json_body_{json_params_counter}', json_body),
-                                        bindparam(f'filter_value_{json_params_counter}', filter_value)
-                                    ))
-                                    json_params_counter += 1
-                                else:
-                                    raise Exception(
-                                        f"'{condition}' is not a supported condition."
-                                    )
-                        else: 
-                            # Set all the property filters
-                            for condition, filter_value in value.items():
-                                if condition in CONDITIONS:
-                                    column_condition = CONDITIONS[condition]
-                                    condition_func = getattr(
-                                        column, column_condition
-                                    )
-                                    
-                                    #Cast value to its necessary type if needed
-                                    if type(filter_value) == str and column.type.python_type in CASTS:
-                                        value = column.type.python_type(filter_value)
-                                    else: 
-                                        value = filter_value
-
-                                    if condition in {"ncontains", "nicontains"}:
-                                        # No native ncontains, nor nicontains attr.
-                                        # Use of a not and the contains, and 
-                                        # icontains attrs.
-                                        conditions.append(
-                                            not_(condition_func(value))
-                                        )
-                                    else:
-                                        conditions.append(
-                                            condition_func(value)
-                                        )
-                                else:
-                                    raise Exception(
-                                        f"'{condition}' is not a supported condition."
-                                    )
-
-                    # If the key refers to a relationship
-                    elif key in relation_names:
-                        relationship = mapper.relationships[key]
-                        joins = query._setup_joins
-                        joined_tables = set()
-
-                        for join in joins:
-                            joined_tables.add(join[0])
-
-                        # If relationship is not present in query already, join it.
-                        if key not in joined_tables:
-                            query = query.join(
-                                relationship.mapper.entity,
-                                getattr(mapper.entity, key),
-                            )
-
-                        r_condition, query = self.filter_helper(
-                            [value], relationship.mapper, and_, query
-                        )
-                        conditions.append(r_condition)
-
-                    # If the key is a boolean operator
-                    elif key in {"and", "or", "not"}:
-                        if key == "and":
-                            condition, query = self.filter_helper(
-                                value, mapper, and_, query
-                            )
-                        elif key == "or":
-                            condition, query = self.filter_helper(
-                                value, mapper, or_, query
-                            )
-                        elif key == "not":
-                            condition, query = self.filter_helper(
-                                value, mapper, not_, query
-                            )
-
-                        conditions.append(condition)
-
-                    else:
-                        raise Exception(
-                            f"'{key}' is not a column property, nor a relationship name, nor a boolean function of (and, or, not)."
-                        )
-
-                except Exception as e:
-                    # Handle the exception here
-                    print(f"Exception occurred: {str(e)}")
-
-        return sqlalchemy_condition(*conditions), query
+        try:
+            return self.ctx_builder.filter(self, filters).route_by_ctx({"filters": filters}) \
+                .timeout_by_ctx({"filters": filters})
 
-    def filter_by_ctx(self, filters: FilterType) -> Query:
+        except Exception as e:
+            send_error("filter", e, self.ctx_mapper())
+            raise
+
+    def sort_by_ctx(self, sorts: List[SortType]) -> Query:
         """
-        Function to generate filters based on the context.
+        Function to generate sorting based on the context.
 
         Args:
-            filters: The filters to be applied.
+            sorts: The sorting instructions.
 
         Returns:
-            A Query object with the applied filters.
+            A Query object with the applied sorting.
         """
         try:
-            mapper = self._entity_from_pre_ent_zero()
-            conditions, query = self.filter_helper([filters], mapper, and_, self)
-
-            # Generate filter by conditions
-            return query.filter(conditions)
+            return self.ctx_builder.sort(self, sorts).route_by_ctx({"sorts": sorts}) \
+                .timeout_by_ctx({"sorts": sorts})
 
         except Exception as e:
-            # Handle the exception here
-            print(f"Exception occurred: {str(e)}")
+            send_error("sort", e, self.ctx_mapper())
+            raise
+
+    def route_by_ctx(self, ctx: Dict[str, Any], purpose: str = "read") -> Query:
+        """
+        Function to tag the query with the route of the context given by the
+        router (see ReplicaRouter.route), if any. The parts of the context
+        applied to the query add up (see merge_ctx), the route is the one of
+        the whole context applied so far, so a rule on its cost sees the
+        filters and the sorts together. A purpose other than "read" is kept.
+
+        Args:
+            ctx: The parsed context, or the part of it applied to the query.
+            purpose: "read", "facets" or "export".
+
+        Returns:
+            A Query object with the route execution option.
+        """
+        if self.router is None:
+            return self
+
+        routed, routed_purpose = self.get_execution_options().get(ROUTE_CTX_OPTION, ({}, "read"))
+        ctx = merge_ctx(routed, ctx)
+        purpose = routed_purpose if purpose == "read" else purpose
+
+        return self.execution_options(**{ROUTE_CTX_OPTION: (ctx, purpose), ROUTE_OPTION: self.router.route(ctx, purpose)})
+
+    def timeout_by_ctx(self, ctx: Dict[str, Any]) -> Query:
+        """
+        Function to set the timeout of the query from the cost of the context
+        (see StatementTimeout), if statement_timeout is set. The costs of the
+        parts of the context applied to the query add up.
+
+        Args:
+            ctx: The parsed context, or the part of it applied to the query.
+
+        Returns:
+            A Query object with the timeout execution option.
+        """
+        if self.statement_timeout is None:
+            return self
+
+        cost = self.get_execution_options().get(COST_OPTION, 0) + self.statement_timeout.cost(ctx)
 
-    def sort_helper(
-        self, sort: SortType, mapper: Mapper, query: Query
+        return self.execution_options(**{COST_OPTION: cost, TIMEOUT_OPTION: self.statement_timeout.seconds(cost)})
+
+    def all(self) -> List[Any]:
+        """
+        Return the results as a list, sending the materialize stage
+        (fetching the rows and building the entities) of ctx queries to
+        stage_timed when it has receivers.
+        """
+        usage = self.get_execution_options().get(USAGE_OPTION) if timing() else None
+
+        if usage is None:
+            return super().all()
+
+        result = self._iter()
+        start = time.perf_counter()
+        items = result.all()
+
+        mapper, filter_shape, sort_shape = usage
+        send_timing("materialize", start, mapper, (filter_shape, sort_shape))
+
+        return items
+
+    def fields_by_ctx(self, fields: FieldsType) -> Query:
+        """
+        Function to load only the fields of the context (and the primary key)
+        of the queried entity, the other columns are deferred.
+
+        Args:
+            fields: The column names by table name, ex. {"users": ["username"]}.
+
+        Returns:
+            A Query object with the load_only option.
+        """
+        info = self.mapper_registry.get(self.ctx_mapper())
+        attributes = self.ctx_builder.field_attributes(info, fields)
+
+        return self if attributes is None else self.options(load_only(*attributes))
+
+    def columns_by_ctx(self, fields: FieldsType) -> Query:
+        """
+        Function to query the fields of the context as plain rows, skipping
+        the ORM entities and identity map. Each row is a tuple, and
+        row._mapping gives a dict like access.
+
+        Args:
+            fields: The column names by table name, ex. {"users": ["username"]}.
+
+        Returns:
+            A Query object of the columns, all of them if there is no fieldset.
+        """
+        info = self.mapper_registry.get(self.ctx_mapper())
+        attributes = self.ctx_builder.field_attributes(info, fields)
+
+        if attributes is None:
+            attributes = [getattr(info.entity, name) for name in info.columns]
+
+        return self.with_entities(*attributes)
+
+    def include_by_ctx(
+        self,
+        include: List[str],
+        allowed: Optional[Iterable[str]] = None,
+        fields: Optional[FieldsType] = None,
     ) -> Query:
         """
-        Helper function to handle sorting.
+        Function to eager load relationships based on the context, see
+        CtxBuilder.include_options.
 
         Args:
-            sort: The sorting instructions.
-            mapper: The mapper for the current entity.
-            query: The current Query object.
+            include: The relationship paths to be loaded.
+            allowed: The paths that can be loaded, all of them if None
+                     (up to include_max_depth).
+            fields: The column names by table name, to load only those of
+                    the included entities.
 
         Returns:
-            A Query object with the applied sorting.
+            A Query object with the loader options.
+        """
+        options = self.ctx_builder.include_options(self.ctx_mapper(), include, allowed, fields)
+
+        return self.options(*options) if options else self
+
+    def cached_by_ctx(
+        self,
+        ctx: Dict[str, Any],
+        serializer: Callable[[Any], Any] = to_dict,
+        allowed: Optional[Iterable[str]] = None,
+    ) -> List[Any]:
         """
-        column_names = [column.key for column in mapper.columns]
-        relation_names = [relationship.key for relationship in mapper.relationships]
+        Function to get the serialized results of the context (filters, sorts,
+        offset, limit, include and fields) through result_cache, if it is set.
 
-        for key, value in sort.items():
-            try:
-                # If the key refers to a column property
-                if key in column_names:
-                    idx = column_names.index(key)
-                    column = mapper.columns[idx]
+        Results are cached serialized, never as entities bound to a session.
 
-                    if value.lower() == "desc":
-                        query = query.order_by(desc(column))
-                    else:
-                        query = query.order_by(asc(column))
+        Args:
+            ctx: The parsed ctx.
+            serializer: Callable to turn a result into a cacheable value.
+            allowed: The relationship paths that can be included.
 
-                # If the key refers to a relationship
-                elif key in relation_names:
-                    relationship = mapper.relationships[key]
-                    joins = query._setup_joins
-                    joined_tables = set()
+        Returns:
+            The list of serialized results.
+        """
+        cache = self.result_cache
+        mapper = self.ctx_mapper()
 
-                    for join in joins:
-                        joined_tables.add(join[0])
+        if cache is not None:
+            # The criteria already on the query are part of the key
+            key = cache.key(mapper, ctx, f"{serializer.__module__}.{serializer.__qualname__}", self.statement)
+            tables = ctx_tables(mapper, ctx, self.mapper_registry) | statement_tables(self.statement)
+            results = cache.get(key, tables)
 
-                    # If relationship is not present in query already, join it.
-                    if key not in joined_tables:
-                        query = query.join(
-                            relationship.mapper.entity,
-                            getattr(mapper.entity, key),
-                        )
+            if results is not MISSING:
+                return results
 
-                    query = self.sort_helper(value, relationship.mapper, query)
+            # Read before the query, a commit while it runs leaves the results stale
+            versions = cache.versions(tables)
 
-            except Exception as e:
-                # Handle the exception here
-                print(f"Exception occurred: {str(e)}")
+        query = self.filter_by_ctx(ctx.get("filters") or {}) \
+                    .sort_by_ctx(ctx.get("sorts") or []) \
+                    .fields_by_ctx(ctx.get("fields") or {}) \
+                    .include_by_ctx(ctx.get("include") or [], allowed, ctx.get("fields")) \
+                    .offset(ctx.get("offset")) \
+                    .limit(ctx.get("limit"))
+        results = [serializer(item) for item in query.all()]
 
-        return query
+        if cache is not None:
+            cache.set(key, tables, results, versions)
 
-    def sort_by_ctx(self, sorts: List[SortType]) -> Query:
+        return results
+
+    def facets_by_ctx(self, facets: FacetsType, limit: Optional[int] = None) -> Dict[str, List[Dict[str, Any]]]:
         """
-        Function to generate sorting based on the context.
+        Function to count the values of the facets of the context under the
+        filters of the query, in a single statement (see CtxBuilder.facets).
 
         Args:
+            facets: The bucket size (None for the plain values) of each
+                    column or relationship path, ex. {"status": None, "person.age": 10}.
+            limit: Max amount of values of each facet, the most frequent ones.
+
+        Returns:
+            The {"value": value, "count": count} of each facet.
+        """
+        if not facets:
+            return {}
+
+        mapper = self.ctx_mapper()
+        dialect = self.session.get_bind(mapper=mapper).dialect.name
+        statement = self.ctx_builder.facets(self, facets, dialect)
+        # The options of the query are not kept by the UNION ALL of the facets
+        options = self.route_by_ctx({"facets": facets}, "facets").timeout_by_ctx({"facets": facets}).get_execution_options()
+
+        return facet_counts(self.session.execute(statement, execution_options=options).all(), list(facets), limit)
+
+    def explain_by_ctx(self) -> Dict[str, Any]:
+        """
+        Function to get the compiled SQL of the query and the EXPLAIN of the
+        database, for the explain param of the context (see explain_allowed).
+
+        Returns:
+            The "dialect", "sql", "params", "joins" and "plan" of the query.
+        """
+        connection = self.session.connection(bind_arguments={"mapper": self.ctx_mapper()})
+
+        return explain(connection, self)
+
+    def stream_by_ctx(
+        self,
+        filters: Optional[FilterType] = None,
+        sorts: Optional[List[SortType]] = None,
+        batch_size: int = 1000,
+    ) -> Iterator[Any]:
+        """
+        Function to iterate over all the results of the context with bounded
+        memory. Rows are fetched in batches of batch_size with yield_per,
+        using a server side cursor where the dialect supports it
+        (stream_results).
+
+        Args:
+            filters: The filters to be applied.
             sorts: The sorting instructions.
+            batch_size: The amount of rows fetched at a time.
 
         Returns:
-            A Query object with the applied sorting.
+            An iterator of the results.
         """
-        try:
-            mapper = self._entity_from_pre_ent_zero()
-            query = self
+        # The filters and sorts add their part of the ctx to the route
+        query = self.route_by_ctx({}, "export")
 
-            for sort in sorts:
-                query = self.sort_helper(sort, mapper, self)
+        if filters:
+            query = query.filter_by_ctx(filters)
+        if sorts:
+            query = query.sort_by_ctx(sorts)
 
-            return query
+        return iter(query.yield_per(batch_size))
 
-        except Exception as e:
-            # Handle the exception here
-            print(f"Exception occurred: {str(e)}")
\ No newline at end of file
+    def paginate_by_ctx(
+        self,
+        sorts: List[SortType],
+        limit: int,
+        cursor: Optional[str] = None,
+        total: Optional[str] = None,
+        count_cap: Optional[int] = None,
+    ) -> Page:
+        """
+        Function to get a page with keyset (seek) pagination based on the context.
+
+        The sorts are completed with the primary key as tie-breaker, and the
+        page starts right after the row the cursor points to, so deep pages
+        are as cheap as the first one.
+
+        The total amount of items is counted along with the page, according to total:
+
+        - "window": COUNT(*) OVER () in the statement of the page, or a
+          DISTINCT count subquery when the joins of the query can repeat
+          its rows. Only the first page (no cursor) has the total, the
+          next ones keep it.
+        - "concurrent": a count on a connection of its own, of the replica
+          the query is routed to and with its timeout, run while the page
+          is fetched. It only sees committed rows.
+        - "estimate": the estimate of the query planner on Postgres, a
+          count capped to count_cap (10000 by default) on other databases.
+
+        Args:
+            sorts: The sorting instructions.
+            limit: The max amount of items of the page.
+            cursor: The next_cursor of the previous page, None for the first page.
+            total: None to not count the items, or "window", "concurrent" or "estimate".
+            count_cap: Stop the count of "concurrent" and "estimate" after
+                       count_cap items, the total is then "capped".
+
+        Returns:
+            A Page with the items, the cursor of the next page and the total.
+
+        Raises:
+            QueryStringError: If a sort goes through a to-many relationship.
+        """
+        if total is not None and total not in TOTALS:
+            raise ValueError(f"'{total}' is not a total mode, use one of {TOTALS}.")
+
+        builder = self.ctx_builder
+        mapper = self.ctx_mapper()
+        plan = builder.get_sort_plan(mapper, sorts)
+        path = to_many_path((join.path for join in plan.joins), mapper, self.mapper_registry)
+
+        # Each related row would be an item, and the same entity in several pages
+        if path is not None:
+            raise QueryStringError(f"'{'.'.join(path)}' is a to-many relationship, the pages can not be sorted by it.")
+
+        keys = with_primary_key(plan.keys, mapper)
+        query = builder.join(self, plan.joins)
+        count = None
+        columns = [column for column, _ in keys]
+
+        if total in ("concurrent", "estimate"):
+            # On the replica the page is routed to, with its timeout
+            bind = self.router.replica_for(self.session, self.get_execution_options()) if self.router is not None else None
+            count = count_total(query, mapper, total, count_cap, bind)
+        elif total == "window" and cursor is None:
+            columns.append(window_total(query, mapper))
+
+        if cursor is not None:
+            values = decode_cursor(cursor, keys)
+            nulls_first = self.session.get_bind(mapper=mapper).dialect.name in NULLS_FIRST_DIALECTS
+            query = query.filter(seek_condition(keys, values, nullable_keys(keys, mapper), nulls_first))
+
+        clauses = [desc(column) if descending else asc(column) for column, descending in keys]
+        rows = query.add_columns(*columns) \
+                    .order_by(*clauses) \
+                    .limit(limit + 1) \
+                    .all()
+
+        next_cursor = None
+        page_total, total_kind = None, "exact"
+
+        if count is not None:
+            page_total, total_kind = count.result()
+        elif total == "window" and cursor is None:
+            page_total = rows[0][-1] if rows else 0
+
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = encode_cursor(tuple(rows[-1])[1:len(keys) + 1])
+
+        return Page([row[0] for row in rows], limit, next_cursor, page_total, total_kind)
@@ -0,0 +1,436 @@
+"""
+Keyset (seek) pagination helpers: opaque cursors and seek conditions built
+from the keys of a sort plan, and the total count of the pages
+"""
+import base64
+import binascii
+import json
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import date, datetime, time
+from decimal import Decimal
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+from uuid import UUID
+
+from sqlalchemy import and_, distinct, false, func, or_, select, tuple_
+from sqlalchemy.orm import Mapper, Query, RelationshipProperty
+
+from ..qs_parser.main import QueryStringError
+from .explain import Explain
+from .registry import MapperRegistry
+from .timeouts import TIMEOUT_OPTION
+
+# Types restored from their string form when a cursor is decoded
+CURSOR_TYPES = {datetime, date, time, Decimal, UUID}
+
+Key = Tuple[Any, bool]
+
+# Dialects that sort NULL before the other values in ascending order
+NULLS_FIRST_DIALECTS = {"sqlite", "mysql", "mariadb", "mssql"}
+
+# Modes of the total of paginate_by_ctx
+TOTALS = ("window", "concurrent", "estimate")
+
+# Cap of the count of "estimate" where there is no planner estimate
+ESTIMATE_CAP = 10000
+
+# Max amount of counts running at a time in the background
+COUNT_WORKERS = 4
+
+_count_executor = None
+_count_lock = threading.Lock()
+
+
+class Page:
+    """
+    A page of keyset pagination.
+
+    Attributes:
+        items: The entities of the page.
+        limit: The max amount of items of the page.
+        next_cursor: The cursor of the next page, None if it is the last one.
+        total: The amount of items of all the pages, None if it was not counted.
+        total_kind: "exact", "capped" (there are more than total items) or
+                    "estimate" (the estimate of the query planner).
+    """
+
+    __slots__ = ("items", "limit", "next_cursor", "total", "total_kind")
+
+    def __init__(
+        self,
+        items: List[Any],
+        limit: int,
+        next_cursor: Optional[str],
+        total: Optional[int] = None,
+        total_kind: str = "exact",
+    ):
+        self.items = items
+        self.limit = limit
+        self.next_cursor = next_cursor
+        self.total = total
+        self.total_kind = total_kind
+
+    @property
+    def has_next(self) -> bool:
+        return self.next_cursor is not None
+
+    @property
+    def total_label(self) -> Optional[str]:
+        """
+        The total for display: "1,234", "10,000+" or "~1,234,000".
+        """
+        if self.total is None:
+            return None
+        if self.total_kind == "capped":
+            return f"{self.total:,}+"
+        if self.total_kind == "estimate":
+            return f"~{self.total:,}"
+
+        return f"{self.total:,}"
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self) -> int:
+        return len(self.items)
+
+    def __repr__(self) -> str:
+        return f"<Page items={len(self.items)!r}, next_cursor={self.next_cursor!r}>"
+
+
+def with_primary_key(keys: Sequence[Key], mapper: Mapper) -> List[Key]:
+    """
+    Append the primary key columns of the mapper to the sort keys as
+    tie-breaker, unless they are sorted already.
+
+    Args:
+        keys: The (column, descending) keys of a sort plan.
+        mapper: The mapper of the paginated entity.
+
+    Returns:
+        The keys with the primary key.
+    """
+    keys = list(keys)
+    columns = {column for column, _ in keys}
+
+    for column in mapper.primary_key:
+        if column not in columns:
+            keys.append((column, False))
+
+    return keys
+
+
+def nullable_keys(keys: Sequence[Key], mapper: Mapper) -> List[bool]:
+    """
+    Whether each sort key can be NULL: nullable columns, and the columns of
+    joined tables, since the sort joins are outer joins.
+
+    Args:
+        keys: The (column, descending) keys.
+        mapper: The mapper of the paginated entity.
+
+    Returns:
+        A bool for each key.
+    """
+    tables = set(mapper.tables)
+
+    # JSON path elements have no nullable, any path can be missing
+    return [getattr(column, "nullable", True) or getattr(column, "table", None) not in tables for column, _ in keys]
+
+
+def to_many_path(paths: Iterable[tuple], mapper: Mapper, registry: MapperRegistry) -> Optional[tuple]:
+    """
+    The first relationship path that goes through a to-many relationship,
+    whose join repeats the rows of the entity, None if there is none.
+
+    Args:
+        paths: The relationship paths, ex. the paths of the joins of a plan.
+        mapper: The mapper of the queried entity.
+        registry: The MapperRegistry to look up the relationships.
+
+    Returns:
+        The path up to the to-many relationship, or None.
+    """
+    for path in paths:
+        current = mapper
+
+        for index, key in enumerate(path):
+            relationship = registry.get(current).relationships[key]
+
+            if relationship.uselist:
+                return path[:index + 1]
+
+            current = relationship.mapper
+
+    return None
+
+
+def _after(column: Any, value: Any, descending: bool, nulls_first: bool) -> Any:
+    # NULL is the first value of the ascending order when nulls_first
+    if value is None:
+        if descending == nulls_first:
+            return false()
+        return column.is_not(None)
+
+    seek = column < value if descending else column > value
+
+    if descending == nulls_first:
+        return or_(seek, column.is_(None))
+
+    return seek
+
+
+def seek_condition(
+    keys: Sequence[Key],
+    values: Sequence[Any],
+    nullable: Optional[Sequence[bool]] = None,
+    nulls_first: bool = False,
+) -> Any:
+    """
+    Condition of the rows after the given values in the order of the keys.
+
+    A row-value comparison is used when all keys have the same direction
+    and none can be NULL, otherwise it is expanded:
+    (a > x) OR (a = x AND b < y) OR ..., with IS NULL / IS NOT NULL
+    branches for the keys that can be NULL.
+
+    Args:
+        keys: The (column, descending) keys.
+        values: The values of the keys in the last row of the previous page.
+        nullable: Whether each key can be NULL (see nullable_keys), all of
+                  them by default.
+        nulls_first: Whether the dialect sorts NULL before the other values
+                     in ascending order (see NULLS_FIRST_DIALECTS).
+
+    Returns:
+        The SQLAlchemy condition.
+    """
+    if nullable is None:
+        nullable = [True] * len(keys)
+
+    directions = {descending for _, descending in keys}
+
+    if len(directions) == 1 and not any(nullable) and all(value is not None for value in values):
+        descending = directions.pop()
+        columns = [column for column, _ in keys]
+
+        if len(columns) == 1:
+            left, right = columns[0], values[0]
+        else:
+            left, right = tuple_(*columns), tuple_(*values)
+
+        return left < right if descending else left > right
+
+    conditions = []
+
+    for i, (column, descending) in enumerate(keys):
+        equals = [keys[j][0].is_(None) if values[j] is None else keys[j][0] == values[j] for j in range(i)]
+
+        if nullable[i]:
+            seek = _after(column, values[i], descending, nulls_first)
+        else:
+            seek = column < values[i] if descending else column > values[i]
+
+        conditions.append(and_(*equals, seek))
+
+    return or_(*conditions)
+
+
+def _dump(value: Any) -> Any:
+    if isinstance(value, (datetime, date, time)):
+        return value.isoformat()
+    if isinstance(value, (Decimal, UUID)):
+        return str(value)
+
+    return value
+
+
+def _load(value: Any, column: Any) -> Any:
+    if value is None:
+        return None
+
+    try:
+        python_type = column.type.python_type
+    except NotImplementedError:
+        return value
+
+    if python_type in CURSOR_TYPES and isinstance(value, str):
+        if python_type in (datetime, date, time):
+            return python_type.fromisoformat(value)
+
+        return python_type(value)
+
+    return value
+
+
+def encode_cursor(values: Sequence[Any]) -> str:
+    """
+    Encode the key values of a row in an opaque cursor.
+
+    Args:
+        values: The values of the sort keys.
+
+    Returns:
+        The cursor.
+    """
+    data = json.dumps([_dump(value) for value in values], separators=(",", ":"))
+
+    return base64.urlsafe_b64encode(data.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str, keys: Sequence[Key]) -> List[Any]:
+    """
+    Decode a cursor into the values of the sort keys.
+
+    Args:
+        cursor: The cursor given by encode_cursor.
+        keys: The (column, descending) keys the cursor was built for.
+
+    Returns:
+        The values of the keys.
+    """
+    try:
+        data = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        values = json.loads(data)
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise QueryStringError("The cursor is not valid.")
+
+    if not isinstance(values, list) or len(values) != len(keys):
+        raise QueryStringError("The cursor does not match the sorts.")
+
+    try:
+        return [_load(value, column) for value, (column, _) in zip(values, keys)]
+    except (TypeError, ValueError):
+        raise QueryStringError("The cursor is not valid.")
+
+
+def count_statements(query: Query, mapper: Mapper, cap: Optional[int] = None) -> Tuple[Any, Any]:
+    """
+    The statements of the rows and of the count of a filtered query,
+    without its order, limit, offset and eager loads.
+
+    Args:
+        query: The query, with its filters and joins.
+        mapper: The mapper of the paginated entity.
+        cap: Stop counting after cap + 1 rows.
+
+    Returns:
+        The (rows, count) select() statements.
+    """
+    # The primary key keeps the entity in the FROM clause, and DISTINCT
+    # counts it once through the joins of to-many relationships
+    base = query.enable_eagerloads(False) \
+                .order_by(None) \
+                .limit(None) \
+                .offset(None)
+    rows = base.with_entities(*mapper.primary_key).distinct()
+
+    if cap is None and len(mapper.primary_key) == 1:
+        count = base.with_entities(func.count(distinct(mapper.primary_key[0]))).statement
+    else:
+        count = select(func.count()).select_from((rows if cap is None else rows.limit(cap + 1)).subquery())
+
+    return rows.statement, count
+
+
+def repeats_rows(query: Query) -> bool:
+    """
+    Whether the joins of a query can repeat the rows of its entity: the
+    joins of to-many relationships, and the ones that are not through a
+    relationship, whose cardinality is unknown.
+    """
+    for _, onclause, _, _ in getattr(query, "_setup_joins", ()):
+        relationship = getattr(onclause, "property", None)
+
+        if not isinstance(relationship, RelationshipProperty) or relationship.uselist:
+            return True
+
+    return False
+
+
+def window_total(query: Query, mapper: Mapper) -> Any:
+    """
+    The column of the total of the rows of a query, in the statement of its
+    page: COUNT(*) OVER (), or the DISTINCT count of count_statements when
+    the joins of the query repeat the rows of the entity.
+    """
+    if not repeats_rows(query):
+        return func.count().over()
+
+    _, count = count_statements(query, mapper)
+
+    # Not correlated, the count is of all the rows, not of the one of the page
+    return count.correlate(None).scalar_subquery()
+
+
+def planner_estimate(connection: Any, statement: Any) -> int:
+    """
+    Rows estimated by the Postgres planner for a statement, from the row
+    estimates of the tables (pg_class.reltuples) and of the conditions.
+    """
+    # Explain compiles the statement as any other, expanding in lists included
+    plan = connection.execute(Explain(statement)).scalar()
+
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+
+    return int(plan[0]["Plan"]["Plan Rows"])
+
+
+def _count(bind: Any, rows: Any, count: Any, mode: str, cap: Optional[int], options: Dict[str, Any]) -> Tuple[int, str]:
+    with bind.connect() as connection:
+        connection = connection.execution_options(**options)
+
+        if mode == "estimate" and connection.dialect.name == "postgresql":
+            return planner_estimate(connection, rows), "estimate"
+
+        total = connection.execute(count).scalar()
+
+    if cap is not None and total > cap:
+        return cap, "capped"
+
+    return total, "exact"
+
+
+def count_total(
+    query: Query,
+    mapper: Mapper,
+    mode: str,
+    cap: Optional[int] = None,
+    bind: Any = None,
+) -> "Future[Tuple[int, str]]":
+    """
+    Start counting the rows of a query on a connection of its own, so the
+    count runs while the page is fetched. The count has the statement
+    timeout (TIMEOUT_OPTION) of the query.
+
+    Args:
+        query: The query, with its filters and joins.
+        mapper: The mapper of the paginated entity.
+        mode: "concurrent" for a count, "estimate" for the planner estimate
+              on Postgres and a count capped to cap (ESTIMATE_CAP by default)
+              on other databases.
+        cap: Stop counting after cap rows, the total is then "capped".
+        bind: The engine to count on, ex. the replica the query is routed
+              to, the bind of the session by default.
+
+    Returns:
+        A Future of the (total, total_kind) of the query.
+    """
+    global _count_executor
+
+    if mode == "estimate" and cap is None:
+        cap = ESTIMATE_CAP
+
+    if bind is None:
+        bind = query.session.get_bind(mapper=mapper)
+
+    options = query.get_execution_options()
+    options = {TIMEOUT_OPTION: options[TIMEOUT_OPTION]} if options.get(TIMEOUT_OPTION) is not None else {}
+    rows, count = count_statements(query, mapper, cap)
+
+    with _count_lock:
+        if _count_executor is None:
+            _count_executor = ThreadPoolExecutor(max_workers=COUNT_WORKERS, thread_name_prefix="qs-count")
+
+    return _count_executor.submit(_count, bind, rows, count, mode, cap, options)
@@ -0,0 +1,348 @@
+"""
+Plan cache to reuse the filter and sort expressions built by BaseQuery
+across requests that share the same filter shape
+"""
+import threading
+from collections import OrderedDict, namedtuple
+from functools import lru_cache
+from itertools import count
+from typing import Any, Callable, Hashable, Iterable, List, Optional, Tuple, Union
+
+from sqlalchemy import asc, bindparam, desc
+from sqlalchemy.sql.visitors import cloned_traverse
+
+from ..qs_parser.errors import QueryStringError
+from ..qs_parser.nodes import Boolean, Node, group_clauses
+from .constants import FilterType, SortType
+from .in_list import LARGE_IN_LIST, LargeList
+from .joins import Join, JoinRegistry
+
+# A leaf value of a normalized filter, replaced by a bind parameter in the plan.
+# The type of the value is part of the shape since it decides casts.
+Param = namedtuple("Param", ["index", "type"])
+
+FilterPlan = namedtuple("FilterPlan", ["condition", "joins", "binds"])
+# keys are the (column, descending) pairs of the clauses
+SortPlan = namedtuple("SortPlan", ["clauses", "joins", "keys"])
+CacheInfo = namedtuple("CacheInfo", ["hits", "misses", "maxsize", "currsize"])
+
+# Conditions whose values are rendered inline (IS NULL, IS TRUE, ...)
+LITERAL_CONDITIONS = {"is", "is_not"}
+BOOLEAN_OPERATORS = {"and", "or", "not"}
+
+_plan_ids = count()
+
+
+def normalize_filters(filters: Union[FilterType, Node]) -> Tuple[tuple, List[Any]]:
+    """
+    Split the filters in a hashable shape and the list of its values.
+
+    The filters can be a dict or an AST (see to_ast); the shape of an AST
+    is read from its nodes, without building its dict form, and memoized
+    per node. It is the same shape of the equivalent dict.
+
+    Keys are sorted so the same filters given in a different order share the
+    same shape. Values are replaced by Param placeholders, except the ones
+    of LITERAL_CONDITIONS and None values, which stay in the shape. Lists
+    are typed list, or LargeList over LARGE_IN_LIST values.
+
+    Args:
+        filters: The filters to be normalized.
+
+    Returns:
+        A (shape, values) tuple.
+    """
+    if isinstance(filters, Node):
+        return _normalize_node(filters)
+
+    values = []
+    shape = _normalize_filter(filters, values)
+
+    return shape, values
+
+
+def _group(node: Node) -> Tuple[Node, ...]:
+    # The clauses of a node that is a group of the filters dict
+    return node.clauses if isinstance(node, Boolean) and node.operator == "and" else (node,)
+
+
+@lru_cache(maxsize=1024)
+def _normalize_node(node: Node) -> Tuple[tuple, Tuple[Any, ...]]:
+    values = []
+    shape = _normalize_clauses(_group(node), values)
+
+    return shape, tuple(values)
+
+
+def _normalize_clauses(clauses: Iterable[Node], values: List[Any]) -> tuple:
+    # The nodes are read as they are, in the order and shape of their filters dict
+    items = []
+    groups = group_clauses(clauses)
+
+    for key in sorted(groups, key=str):
+        member = groups[key]
+
+        if key in BOOLEAN_OPERATORS:
+            value = tuple(_normalize_clauses(_group(clause), values) for clause in member)
+        elif isinstance(member, dict):
+            value = tuple(
+                (operator, _normalize_value(operator, _list(member[operator].value), values)) for operator in sorted(member)
+            )
+        else:
+            value = _normalize_clauses(member, values)
+
+        items.append((key, value))
+
+    return tuple(items)
+
+
+def _list(value: Any) -> Any:
+    # The lists of the nodes are tuples, the ones of the dict form are lists
+    return list(value) if isinstance(value, tuple) else value
+
+
+def _normalize_value(key: str, value: Any, values: List[Any]) -> Any:
+    if key in LITERAL_CONDITIONS or value is None:
+        return value
+
+    if isinstance(value, (list, tuple)):
+        param = Param(len(values), LargeList if len(value) > LARGE_IN_LIST else list)
+    else:
+        param = Param(len(values), type(value))
+
+    values.append(value)
+
+    return param
+
+
+def _normalize_filter(filters: FilterType, values: List[Any]) -> tuple:
+    items = []
+
+    for key, value in sorted(filters.items(), key=lambda item: str(item[0])):
+        if key in BOOLEAN_OPERATORS and isinstance(value, (list, tuple)):
+            value = tuple(
+                _normalize_filter(clause or {}, values) for clause in value
+            )
+        elif isinstance(value, dict):
+            value = _normalize_filter(value, values)
+        else:
+            value = _normalize_value(key, value, values)
+
+        items.append((key, value))
+
+    return tuple(items)
+
+
+def normalize_sorts(sorts: List[SortType]) -> tuple:
+    """
+    Freeze the sorts in a hashable shape. The order of the sorts (and the
+    keys inside them) is kept since it is the sorting priority.
+
+    Args:
+        sorts: The sorting instructions.
+
+    Returns:
+        The shape of the sorts.
+    """
+    return tuple(_normalize_sort(sort) for sort in sorts)
+
+
+def _normalize_sort(sort: SortType) -> tuple:
+    items = []
+
+    for key, value in sort.items():
+        if isinstance(value, dict):
+            value = _normalize_sort(value)
+        elif isinstance(value, str):
+            value = value.lower()
+
+        items.append((key, value))
+
+    return tuple(items)
+
+
+class PlanBuilder:
+    """
+    Collects the joins, bind parameters and order by clauses of a plan while
+    BaseQuery compiles it.
+    """
+
+    def __init__(self, mapper: Any = None):
+        self.prefix = f"qs{next(_plan_ids)}"
+        # The mapper of the queried entity, the root of the join paths
+        self.mapper = mapper
+        self.joins = JoinRegistry()
+        self.binds = []
+        self.clauses = []
+        self.keys = []
+        # Whether the filters are compiled inside an EXISTS subquery
+        self.correlated = False
+        # Whether the filters are compiled inside an or / not branch
+        self.optional = False
+        self._literals = count()
+
+    def join(self, join: Join) -> None:
+        """
+        Add a join to the plan, only once per relationship path.
+        """
+        self.joins.add(join)
+
+    def bind(
+        self,
+        param: Param,
+        converter: Optional[Callable] = None,
+        expanding: bool = False,
+    ) -> Any:
+        """
+        Create the bind parameter for a Param placeholder.
+
+        Args:
+            param: The placeholder of the value.
+            converter: Callable to cast the value before binding it.
+            expanding: Whether the value is a list (in, nin).
+
+        Returns:
+            A BindParameter.
+        """
+        name = f"{self.prefix}_{param.index}"
+        self.binds.append((param.index, name, converter))
+
+        return bindparam(name, expanding=expanding)
+
+    def order_by(self, column: Any, descending: bool) -> None:
+        """
+        Add an order by clause to the plan.
+        """
+        self.clauses.append(desc(column) if descending else asc(column))
+        self.keys.append((column, descending))
+
+    def literal(self, value: Any) -> Any:
+        """
+        Create a bind parameter for a value that is part of the shape.
+        """
+        return bindparam(f"{self.prefix}_l{next(self._literals)}", value)
+
+    def filter_plan(self, condition: Any) -> FilterPlan:
+        return FilterPlan(condition, tuple(self.joins), tuple(self.binds))
+
+    def sort_plan(self) -> SortPlan:
+        return SortPlan(tuple(self.clauses), tuple(self.joins), tuple(self.keys))
+
+
+def bind_values(plan: FilterPlan, values: List[Any]) -> dict:
+    """
+    Map the values of a normalized filter to the bind parameters of a plan.
+
+    Args:
+        plan: The filter plan.
+        values: The values returned by normalize_filters.
+
+    Returns:
+        A dict of bind parameter names and values.
+
+    Raises:
+        QueryStringError: If a value can not be converted to the type of its column.
+    """
+    params = {}
+
+    for index, name, converter in plan.binds:
+        value = values[index]
+
+        try:
+            params[name] = converter(value) if converter is not None else value
+        except (TypeError, ValueError) as e:
+            raise QueryStringError(f"'{value}' is not a valid value: {e}") from e
+
+    return params
+
+
+def bound_condition(plan: FilterPlan, values: List[Any]) -> Any:
+    """
+    Copy of the condition of a plan with the values of a normalized filter.
+
+    The bind parameters of the copy are unique, so the same plan can be
+    applied more than once to a statement with different values.
+
+    Args:
+        plan: The filter plan.
+        values: The values returned by normalize_filters.
+
+    Returns:
+        The bound condition.
+    """
+    params = bind_values(plan, values)
+
+    def visit_bindparam(bind: Any) -> None:
+        if bind.key in params:
+            bind.value = params[bind.key]
+            bind.required = False
+
+        bind._convert_to_unique()
+
+    # As ClauseElement.unique_params(), deprecated on conditions
+    return cloned_traverse(plan.condition, {"maintain_key": True, "detect_subquery_cols": True}, {"bindparam": visit_bindparam})
+
+
+class PlanCache:
+    """
+    Thread safe LRU cache of filter and sort plans, with hit and miss counters.
+    """
+
+    def __init__(self, maxsize: int = 256):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._plans = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable) -> Any:
+        """
+        Get a plan and mark it as the most recently used.
+
+        Args:
+            key: The key of the plan.
+
+        Returns:
+            The plan, or None if it is not cached.
+        """
+        with self._lock:
+            plan = self._plans.get(key)
+
+            if plan is None:
+                self.misses += 1
+            else:
+                self._plans.move_to_end(key)
+                self.hits += 1
+
+            return plan
+
+    def set(self, key: Hashable, plan: Any) -> None:
+        """
+        Store a plan, evicting the least recently used ones over maxsize.
+
+        Args:
+            key: The key of the plan.
+            plan: The plan.
+        """
+        with self._lock:
+            self._plans[key] = plan
+            self._plans.move_to_end(key)
+
+            while len(self._plans) > self.maxsize:
+                self._plans.popitem(last=False)
+
+    def clear(self) -> None:
+        """
+        Remove all the plans and reset the counters.
+        """
+        with self._lock:
+            self._plans.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def cache_info(self) -> CacheInfo:
+        with self._lock:
+            return CacheInfo(self.hits, self.misses, self.maxsize, len(self._plans))
+
+    def __len__(self) -> int:
+        return len(self._plans)
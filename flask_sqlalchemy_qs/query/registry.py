@@ -0,0 +1,129 @@
+"""
+Registry of precomputed mapper metadata used by the filter and sort helpers
+"""
+from typing import Any, Dict, FrozenSet, Iterable, Optional
+
+from sqlalchemy import JSON
+from sqlalchemy.orm import Mapper
+
+from .constants import CONDITIONS, JSON_CONDITIONS
+
+OPERATORS = frozenset(CONDITIONS)
+JSON_OPERATORS = frozenset(JSON_CONDITIONS)
+
+
+class MapperInfo:
+    """
+    Dict based lookups of the columns, relationships, python types, JSON
+    columns and allowed operators of a mapper, the filter strategy set in
+    the info of each relationship (qs_filter) and the types of the JSON
+    paths set in the info of each JSON column (qs_json_types), ex.
+    info={"qs_json_types": {"num": int, "a.b": float}}.
+    """
+
+    __slots__ = (
+        "mapper",
+        "entity",
+        "name",
+        "columns",
+        "relationships",
+        "python_types",
+        "json_columns",
+        "json_types",
+        "operators",
+        "filter_strategies",
+    )
+
+    def __init__(self, mapper: Mapper):
+        self.mapper = mapper
+        self.entity = mapper.entity
+        # Name of the entity in sparse fieldsets: fields[name]=a,b
+        self.name = getattr(mapper.local_table, "name", mapper.class_.__name__)
+        self.columns: Dict[str, Any] = {}
+        self.relationships: Dict[str, Any] = {}
+        self.python_types: Dict[str, Optional[type]] = {}
+        self.json_columns: FrozenSet[str] = frozenset()
+        self.json_types: Dict[str, Dict[str, type]] = {}
+        self.operators: Dict[str, FrozenSet[str]] = {}
+        self.filter_strategies: Dict[str, Optional[str]] = {}
+
+        json_columns = set()
+
+        for column in mapper.columns:
+            # The first column with a key wins, as in mapper.columns lookups
+            if column.key in self.columns:
+                continue
+
+            self.columns[column.key] = column
+
+            try:
+                self.python_types[column.key] = column.type.python_type
+            except NotImplementedError:
+                self.python_types[column.key] = None
+
+            # Operators of the JSON paths of a column are JSON_OPERATORS
+            self.operators[column.key] = OPERATORS
+
+            if isinstance(column.type, JSON):
+                json_columns.add(column.key)
+                self.json_types[column.key] = dict(column.info.get("qs_json_types", {}))
+
+        for relationship in mapper.relationships:
+            self.relationships[relationship.key] = relationship
+            self.filter_strategies[relationship.key] = relationship.info.get("qs_filter")
+
+        self.json_columns = frozenset(json_columns)
+
+    def __repr__(self) -> str:
+        return f"<MapperInfo {self.mapper.class_.__name__}>"
+
+
+class MapperRegistry:
+    """
+    Builds the MapperInfo of each mapper once, lazily on first use or at
+    startup with warm().
+    """
+
+    def __init__(self):
+        self._infos: Dict[Mapper, MapperInfo] = {}
+
+    def get(self, mapper: Mapper) -> MapperInfo:
+        """
+        Get the MapperInfo of a mapper, building it if needed.
+
+        Args:
+            mapper: The mapper of the entity.
+
+        Returns:
+            The MapperInfo of the mapper.
+        """
+        info = self._infos.get(mapper)
+
+        if info is None:
+            # Two threads may build the same info, the last one is kept.
+            info = MapperInfo(mapper)
+            self._infos[mapper] = info
+
+        return info
+
+    def warm(self, mappers: Iterable[Mapper]) -> None:
+        """
+        Build the MapperInfo of several mappers, ex. db.Model.registry.mappers
+
+        Args:
+            mappers: The mappers to be registered.
+        """
+        for mapper in mappers:
+            self.get(mapper)
+
+    def clear(self) -> None:
+        """
+        Remove all the MapperInfo, ex. after mappers are reconfigured.
+        """
+        self._infos.clear()
+
+    def __contains__(self, mapper: Mapper) -> bool:
+        return mapper in self._infos
+
+    def __len__(self) -> int:
+        return len(self._infos)
@@ -0,0 +1,411 @@
+"""
+Opt-in cache of the results of ctx queries, with TTL, LRU eviction,
+pluggable backends and invalidation by table on commit
+"""
+import hashlib
+import os
+import pickle
+import stat
+import tempfile
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, Optional, Set, Tuple
+
+from sqlalchemy import Table, event, inspect
+from sqlalchemy.orm import Mapper, Session
+from sqlalchemy.sql.util import find_tables
+
+from ..qs_parser.nodes import Node
+from .plan import normalize_filters, normalize_sorts
+from .registry import MapperRegistry
+
+MISSING = object()
+
+
+class MemoryBackend:
+    """
+    In process backend, a thread safe LRU of maxsize entries.
+    """
+
+    def __init__(self, maxsize: int = 1024):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._versions: Dict[str, str] = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Any:
+        with self._lock:
+            entry = self._entries.get(key, MISSING)
+
+            if entry is not MISSING:
+                self._entries.move_to_end(key)
+
+            return entry
+
+    def set(self, key: str, entry: Any) -> None:
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def versions(self, tables: Iterable[str]) -> Tuple[str, ...]:
+        return tuple(self._versions.get(table, "") for table in tables)
+
+    def bump(self, tables: Iterable[str]) -> None:
+        for table in tables:
+            self._versions[table] = uuid.uuid4().hex
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class FileBackend:
+    """
+    Local file backend shared by the processes of a host, ex. gunicorn
+    workers. A directory in /dev/shm keeps it in shared memory.
+
+    Entries are pickled in files named by their key and evicted by least
+    recent use over maxsize. Table versions are files too, so a commit in a
+    worker invalidates the entries of the others.
+
+    Since the entries are unpickled, the directory is created private (mode
+    0700), and it must belong to the user of the process and not be
+    writable by others.
+    """
+
+    def __init__(self, directory: str, maxsize: int = 1024):
+        self.directory = directory
+        self.maxsize = maxsize
+        self._entries_dir = os.path.join(self.directory, "entries")
+        self._versions_dir = os.path.join(self.directory, "versions")
+
+        for path in (self.directory, self._entries_dir, self._versions_dir):
+            os.makedirs(path, mode=0o700, exist_ok=True)
+            self._check(path)
+
+    @staticmethod
+    def _check(path: str) -> None:
+        status = os.lstat(path)
+
+        if not stat.S_ISDIR(status.st_mode):
+            raise PermissionError(f"The cache directory '{path}' is not a directory.")
+        if hasattr(os, "getuid") and status.st_uid != os.getuid():
+            raise PermissionError(f"The cache directory '{path}' belongs to another user.")
+        if status.st_mode & (stat.S_IWGRP | stat.S_IWOTH):
+            raise PermissionError(f"The cache directory '{path}' is writable by other users.")
+
+    def _write(self, path: str, data: bytes) -> None:
+        # Atomic replace, readers never see a partial file
+        fd, tmp = tempfile.mkstemp(dir=self.directory)
+
+        with os.fdopen(fd, "wb") as file:
+            file.write(data)
+
+        os.replace(tmp, path)
+
+    def get(self, key: str) -> Any:
+        path = os.path.join(self._entries_dir, key)
+
+        try:
+            with open(path, "rb") as file:
+                entry = pickle.load(file)
+            # The modification time is the last use of the entry
+            os.utime(path)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return MISSING
+
+        return entry
+
+    def set(self, key: str, entry: Any) -> None:
+        self._write(os.path.join(self._entries_dir, key), pickle.dumps(entry))
+
+        entries = list(os.scandir(self._entries_dir))
+
+        if len(entries) > self.maxsize:
+            entries.sort(key=lambda item: item.stat().st_mtime)
+
+            for item in entries[:len(entries) - self.maxsize]:
+                self.delete(item.name)
+
+    def delete(self, key: str) -> None:
+        try:
+            os.remove(os.path.join(self._entries_dir, key))
+        except OSError:
+            pass
+
+    def clear(self) -> None:
+        for item in os.scandir(self._entries_dir):
+            self.delete(item.name)
+
+    def versions(self, tables: Iterable[str]) -> Tuple[str, ...]:
+        versions = []
+
+        for table in tables:
+            try:
+                with open(os.path.join(self._versions_dir, table), "rb") as file:
+                    versions.append(file.read().decode())
+            except OSError:
+                versions.append("")
+
+        return tuple(versions)
+
+    def bump(self, tables: Iterable[str]) -> None:
+        # A new unique version, concurrent bumps never restore an old one
+        for table in tables:
+            self._write(os.path.join(self._versions_dir, table), uuid.uuid4().hex.encode())
+
+    def __len__(self) -> int:
+        return sum(1 for _ in os.scandir(self._entries_dir))
+
+
+class ResultCache:
+    """
+    Cache of the results of ctx queries keyed by the model and the
+    normalized ctx (filters, sorts, limit, offset, include and fields).
+
+    Entries expire after ttl seconds, and are invalidated when a session
+    commits changes to any table the query touched, including the tables of
+    the relationships in the filters, sorts and includes (see listen).
+    """
+
+    def __init__(self, backend: Any = None, ttl: float = 60):
+        self.backend = backend if backend is not None else MemoryBackend()
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, mapper: Mapper, ctx: Dict[str, Any], namespace: str = "", statement: Any = None) -> str:
+        """
+        Key of the results of a ctx query.
+
+        Args:
+            mapper: The mapper of the queried entity.
+            ctx: The parsed ctx.
+            namespace: Extra text to tell apart results of the same ctx, ex. the serializer.
+            statement: The statement the ctx is applied to, its criteria and
+                       bound values are part of the key (ex. a tenant filter).
+
+        Returns:
+            The key, a hex digest.
+        """
+        shape, values = normalize_filters(ctx.get("filters") or {})
+        fields = ctx.get("fields") or {}
+        normalized = (
+            mapper.class_.__module__,
+            mapper.class_.__qualname__,
+            namespace,
+            statement_key(statement) if statement is not None else None,
+            shape,
+            values,
+            normalize_sorts(ctx.get("sorts") or []),
+            ctx.get("limit"),
+            ctx.get("offset"),
+            tuple(ctx.get("include") or ()),
+            tuple(sorted((name, tuple(names)) for name, names in fields.items())),
+        )
+
+        return hashlib.sha256(repr(normalized).encode()).hexdigest()
+
+    def get(self, key: str, tables: Iterable[str]) -> Any:
+        """
+        Get the results of a key, MISSING if they are not cached, expired
+        or any of the tables changed since they were stored.
+        """
+        tables = sorted(tables)
+        entry = self.backend.get(key)
+
+        if entry is not MISSING:
+            expires, versions, value = entry
+
+            if expires >= time.time() and versions == self.backend.versions(tables):
+                self.hits += 1
+                return value
+
+            self.backend.delete(key)
+
+        self.misses += 1
+        return MISSING
+
+    def versions(self, tables: Iterable[str]) -> Tuple[str, ...]:
+        """
+        The current versions of the tables, to read before running the query
+        whose results are stored with set.
+        """
+        return self.backend.versions(sorted(tables))
+
+    def set(self, key: str, tables: Iterable[str], value: Any, versions: Optional[Tuple[str, ...]] = None) -> None:
+        """
+        Store the results of a key with the versions of its tables.
+
+        Args:
+            key: The key of the results.
+            tables: The tables the query touched.
+            value: The results.
+            versions: The versions read before running the query, so a commit
+                      that lands while it runs invalidates the results. The
+                      current ones by default.
+        """
+        if versions is None:
+            versions = self.versions(tables)
+
+        self.backend.set(key, (time.time() + self.ttl, versions, value))
+
+    def invalidate(self, tables: Iterable[str]) -> None:
+        """
+        Invalidate the results of the queries that touched the tables.
+        """
+        self.backend.bump(tables)
+
+    def clear(self) -> None:
+        self.backend.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def listen(self, target: Any = Session) -> None:
+        """
+        Invalidate the tables written by a session when it commits. The
+        written tables are collected on flush, and on ORM update and delete
+        statements.
+
+        Args:
+            target: Session class, sessionmaker or scoped_session, all sessions by default.
+        """
+        event.listen(target, "after_flush", _collect_flushed_tables)
+        event.listen(target, "do_orm_execute", _collect_executed_tables)
+        event.listen(target, "after_commit", self._after_commit)
+        event.listen(target, "after_rollback", _discard_tables)
+
+    def remove(self, target: Any = Session) -> None:
+        """
+        Remove the listeners added by listen.
+        """
+        event.remove(target, "after_flush", _collect_flushed_tables)
+        event.remove(target, "do_orm_execute", _collect_executed_tables)
+        event.remove(target, "after_commit", self._after_commit)
+        event.remove(target, "after_rollback", _discard_tables)
+
+    def _after_commit(self, session: Session) -> None:
+        tables = session.info.pop(WRITTEN_TABLES, None)
+
+        if tables:
+            self.invalidate(tables)
+
+
+WRITTEN_TABLES = "flask_sqlalchemy_qs_written_tables"
+
+
+def _written(session: Session) -> Set[str]:
+    return session.info.setdefault(WRITTEN_TABLES, set())
+
+
+def _collect_flushed_tables(session: Session, flush_context: Any) -> None:
+    tables = _written(session)
+
+    for instance in (*session.new, *session.dirty, *session.deleted):
+        mapper = inspect(instance).mapper
+        tables.update(table.name for table in mapper.tables)
+
+        # Many to many collections are written in the secondary tables
+        for relationship in mapper.relationships:
+            if relationship.secondary is not None:
+                tables.add(relationship.secondary.name)
+
+
+def _collect_executed_tables(orm_execute_state: Any) -> None:
+    mapper = orm_execute_state.bind_mapper
+
+    if (orm_execute_state.is_update or orm_execute_state.is_delete) and mapper is not None:
+        _written(orm_execute_state.session).update(table.name for table in mapper.tables)
+
+
+def _discard_tables(session: Session) -> None:
+    session.info.pop(WRITTEN_TABLES, None)
+
+
+def statement_key(statement: Any) -> Tuple[str, Tuple[Tuple[str, str], ...]]:
+    """
+    The compiled SQL and the bound values of a statement, which tell apart
+    the results of a ctx applied to differently filtered queries.
+    """
+    compiled = statement.compile()
+    params = tuple(sorted((name, repr(value)) for name, value in compiled.params.items()))
+
+    return str(compiled), params
+
+
+def statement_tables(statement: Any) -> Set[str]:
+    """
+    Names of the tables a statement touches, in its joins and subqueries too.
+    """
+    return {table.name for table in find_tables(statement, check_columns=True, include_joins=True)
+            if isinstance(table, Table)}
+
+
+def ctx_tables(mapper: Mapper, ctx: Dict[str, Any], registry: MapperRegistry) -> Set[str]:
+    """
+    Names of the tables a ctx query touches: the ones of the entity and of
+    the relationships in its filters, sorts and include paths.
+
+    Args:
+        mapper: The mapper of the queried entity.
+        ctx: The parsed ctx.
+        registry: The MapperRegistry to look up the relationships.
+
+    Returns:
+        The table names.
+    """
+    tables = {table.name for table in mapper.tables}
+
+    def visit(mapper: Mapper, node: Any) -> None:
+        if isinstance(node, (list, tuple)):
+            for item in node:
+                visit(mapper, item)
+            return
+
+        if isinstance(node, Node):
+            node = node.to_dict()
+
+        if not isinstance(node, dict):
+            return
+
+        info = registry.get(mapper)
+
+        for key, value in node.items():
+            key = key.split(".", 1)[0] if isinstance(key, str) else key
+
+            if key in info.relationships:
+                relationship = info.relationships[key]
+                tables.update(table.name for table in relationship.mapper.tables)
+
+                if relationship.secondary is not None:
+                    tables.add(relationship.secondary.name)
+
+                visit(relationship.mapper, value)
+            elif key in ("and", "or", "not"):
+                visit(mapper, value)
+
+    visit(mapper, ctx.get("filters") or {})
+    visit(mapper, ctx.get("sorts") or [])
+
+    for path in ctx.get("include") or ():
+        node = {}
+        target = node
+
+        for key in path.split("."):
+            target = target.setdefault(key, {})
+
+        visit(mapper, node)
+
+    return tables
@@ -0,0 +1,246 @@
+"""
+Routing of ctx queries to read replicas, round robin or to the least
+loaded one, by rules on the parsed ctx, with a read-your-writes pin to the
+primary after a session writes
+"""
+import threading
+import time
+from itertools import count
+from typing import Any, Callable, Dict, Iterable, Optional
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from ..qs_parser.cost import estimate_cost
+from ..qs_parser.nodes import Node
+
+# Execution option with the route of a statement, "replica" or "primary".
+# Statements without it go to the bind of the session.
+ROUTE_OPTION = "qs_route"
+# Execution option with the (ctx, purpose) a query is routed by, the parts
+# of the ctx applied to the query so far
+ROUTE_CTX_OPTION = "qs_route_ctx"
+
+STRATEGIES = ("round_robin", "least_loaded")
+
+# Keys of session.info
+WROTE = "flask_sqlalchemy_qs_wrote"
+PIN_UNTIL = "flask_sqlalchemy_qs_pin_until"
+REPLICA = "flask_sqlalchemy_qs_replica"
+
+# A rule gets the (partial) ctx of a query and its purpose ("read", "facets"
+# or "export") and returns its route, or None to leave it to the next rules
+Rule = Callable[[Dict[str, Any], str], Optional[str]]
+
+
+def _filters_dict(filters: Any) -> Dict[str, Any]:
+    return filters.to_dict() if isinstance(filters, Node) else dict(filters or {})
+
+
+def merge_ctx(ctx: Dict[str, Any], part: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    The ctx with a part of it applied to a query later, ex. the sorts after
+    the filters: the filters of both are and-ed, the sorts are appended,
+    the other keys of the part replace the ones of the ctx.
+
+    Args:
+        ctx: The ctx applied so far.
+        part: The part applied now.
+
+    Returns:
+        The combined ctx.
+    """
+    merged = dict(ctx)
+
+    for key, value in part.items():
+        if key == "filters" and merged.get("filters") and value:
+            filters, other = _filters_dict(merged["filters"]), _filters_dict(value)
+            # Disjoint filters are one group, the others are and-ed as two
+            merged["filters"] = {**filters, **other} if not filters.keys() & other.keys() else {"and": [filters, other]}
+        elif key == "sorts" and merged.get("sorts"):
+            merged["sorts"] = list(merged["sorts"]) + list(value or [])
+        else:
+            merged[key] = value
+
+    return merged
+
+
+def for_purposes(*purposes: str, route: str = "replica") -> Rule:
+    """
+    Rule to route the queries of some purposes, ex. for_purposes("facets", "export").
+    """
+    def rule(ctx: Dict[str, Any], purpose: str) -> Optional[str]:
+        return route if purpose in purposes else None
+
+    return rule
+
+
+def min_cost(cost: float, route: str = "replica", weights: Optional[Dict[str, float]] = None) -> Rule:
+    """
+    Rule to route the queries whose estimated cost (see estimate_cost) is
+    at least cost, ex. heavy scans.
+    """
+    def rule(ctx: Dict[str, Any], purpose: str) -> Optional[str]:
+        return route if estimate_cost(ctx, weights).cost >= cost else None
+
+    return rule
+
+
+class ReplicaRouter:
+    """
+    Sends the reads tagged with the ROUTE_OPTION "replica" to one of the
+    replica engines, once listen() is called for the sessions.
+
+    A session keeps the replica it picked until its transaction ends, and
+    reads from the primary while it has flushed changes, and for
+    pin_seconds after it commits them, so it reads its own writes.
+
+    BaseQuery tags its ctx queries with route(), when its router is set,
+    on the ctx applied to the query so far (see merge_ctx).
+    """
+
+    def __init__(
+        self,
+        replicas: Iterable[Any],
+        strategy: str = "round_robin",
+        pin_seconds: float = 5.0,
+        default: str = "replica",
+        rules: Iterable[Rule] = (),
+    ):
+        if strategy not in STRATEGIES:
+            raise ValueError(f"'{strategy}' is not a routing strategy, use one of {STRATEGIES}.")
+
+        self.replicas = list(replicas)
+        self.strategy = strategy
+        self.pin_seconds = pin_seconds
+        self.default = default
+        self.rules = list(rules)
+        # Connections checked out of the pool of each replica
+        self.loads = {replica: 0 for replica in self.replicas}
+        self._turns = count()
+        self._lock = threading.Lock()
+
+        for replica in self.replicas:
+            event.listen(replica, "checkout", self._checkout(replica))
+            event.listen(replica, "checkin", self._checkin(replica))
+
+    def _checkout(self, replica: Any) -> Callable:
+        def checkout(dbapi_connection, connection_record, connection_proxy) -> None:
+            with self._lock:
+                self.loads[replica] += 1
+
+        return checkout
+
+    def _checkin(self, replica: Any) -> Callable:
+        def checkin(dbapi_connection, connection_record) -> None:
+            with self._lock:
+                self.loads[replica] -= 1
+
+        return checkin
+
+    def route(self, ctx: Dict[str, Any], purpose: str = "read") -> str:
+        """
+        The route of a query: the one of the first rule that decides, the default otherwise.
+
+        Args:
+            ctx: The parsed ctx, or the part of it the query has.
+            purpose: "read", "facets" or "export".
+
+        Returns:
+            "replica" or "primary".
+        """
+        for rule in self.rules:
+            route = rule(ctx, purpose)
+
+            if route is not None:
+                return route
+
+        return self.default
+
+    def choose(self) -> Any:
+        """
+        The next replica, in turns or the one with less connections in use.
+        """
+        turn = next(self._turns) % len(self.replicas)
+
+        if self.strategy == "round_robin":
+            return self.replicas[turn]
+
+        # Starting at the turn, so the ties are spread too
+        candidates = self.replicas[turn:] + self.replicas[:turn]
+
+        with self._lock:
+            return min(candidates, key=self.loads.__getitem__)
+
+    def pinned(self, session: Session) -> bool:
+        """
+        Whether the reads of a session go to the primary to see its writes.
+        """
+        return session.info.get(WROTE, False) or session.info.get(PIN_UNTIL, 0) > time.monotonic()
+
+    def replica_for(self, session: Session, execution_options: Dict[str, Any]) -> Optional[Any]:
+        """
+        The replica of a read of a session with execution_options, the one
+        the session picked already, None if it goes to the bind of the session.
+        """
+        if execution_options.get(ROUTE_OPTION) != "replica" or not self.replicas or self.pinned(session):
+            return None
+
+        replica = session.info.get(REPLICA)
+
+        if replica is None:
+            replica = session.info[REPLICA] = self.choose()
+
+        return replica
+
+    def _do_orm_execute(self, orm_execute_state: Any) -> None:
+        session = orm_execute_state.session
+
+        if not orm_execute_state.is_select:
+            session.info[WROTE] = True
+            return
+
+        if orm_execute_state.bind_arguments.get("bind") is not None:
+            return
+
+        replica = self.replica_for(session, orm_execute_state.execution_options)
+
+        if replica is not None:
+            orm_execute_state.bind_arguments["bind"] = replica
+
+    def _after_flush(self, session: Session, flush_context: Any) -> None:
+        session.info[WROTE] = True
+
+    def _after_commit(self, session: Session) -> None:
+        if session.info.pop(WROTE, False):
+            session.info[PIN_UNTIL] = time.monotonic() + self.pin_seconds
+
+    def _after_rollback(self, session: Session) -> None:
+        session.info.pop(WROTE, None)
+
+    def _after_transaction_end(self, session: Session, transaction: Any) -> None:
+        if transaction.parent is None:
+            session.info.pop(REPLICA, None)
+
+    def listen(self, target: Any = Session) -> None:
+        """
+        Route the statements of the sessions of target.
+
+        Args:
+            target: Session class, sessionmaker or scoped_session (ex. db.session).
+        """
+        event.listen(target, "do_orm_execute", self._do_orm_execute)
+        event.listen(target, "after_flush", self._after_flush)
+        event.listen(target, "after_commit", self._after_commit)
+        event.listen(target, "after_rollback", self._after_rollback)
+        event.listen(target, "after_transaction_end", self._after_transaction_end)
+
+    def remove(self, target: Any = Session) -> None:
+        """
+        Remove the listeners added by listen.
+        """
+        event.remove(target, "do_orm_execute", self._do_orm_execute)
+        event.remove(target, "after_flush", self._after_flush)
+        event.remove(target, "after_commit", self._after_commit)
+        event.remove(target, "after_rollback", self._after_rollback)
+        event.remove(target, "after_transaction_end", self._after_transaction_end)
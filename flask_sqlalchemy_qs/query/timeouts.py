@@ -0,0 +1,179 @@
+"""
+Statement timeouts of ctx queries, derived from their estimated cost and
+enforced by the database (Postgres statement_timeout) or the driver
+(SQLite progress handler), with a typed QueryTimeout error
+"""
+import time
+from typing import Any, Dict, Optional
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from werkzeug.exceptions import ServiceUnavailable
+
+from ..qs_parser.cost import estimate_cost
+from ..signals import send_error
+
+# Execution option with the timeout in seconds of a statement
+TIMEOUT_OPTION = "qs_timeout"
+# Execution option with the cost of the ctx applied to a query so far
+COST_OPTION = "qs_cost"
+
+# Key of the connection info with the dialect name of the timeout in effect
+TIMEOUT_SET = "flask_sqlalchemy_qs_timeout"
+
+# SQLite virtual machine instructions between the checks of the deadline
+PROGRESS_STEPS = 1000
+
+# SQLSTATE of the statements canceled by Postgres (query_canceled)
+QUERY_CANCELED = "57014"
+
+
+class QueryTimeout(ServiceUnavailable, TimeoutError):
+    """
+    Raised when a statement exceeds its timeout. Flask answers it with a 503
+    response, register an error handler to answer something else (ex. 422).
+    """
+
+    def __init__(self, seconds: float, description: Optional[str] = None):
+        super().__init__(description or f"The query did not finish within its {seconds:g}s time budget.")
+        self.seconds = seconds
+
+
+class StatementTimeout:
+    """
+    Timeout of the ctx queries of an endpoint: the default seconds, plus
+    per_cost seconds for each point of the estimated cost of the ctx (see
+    estimate_cost), up to max_seconds.
+    """
+
+    def __init__(
+        self,
+        default: float = 2.0,
+        per_cost: float = 0.05,
+        max_seconds: Optional[float] = 30.0,
+        weights: Optional[Dict[str, float]] = None,
+    ):
+        self.default = default
+        self.per_cost = per_cost
+        self.max_seconds = max_seconds
+        self.weights = weights
+
+    def seconds(self, cost: float) -> float:
+        """
+        The timeout of a query of cost.
+        """
+        seconds = self.default + cost * self.per_cost
+        return seconds if self.max_seconds is None else min(seconds, self.max_seconds)
+
+    def cost(self, ctx: Dict[str, Any]) -> float:
+        """
+        The estimated cost of a ctx, or of the part of it a query has.
+        """
+        return estimate_cost(ctx, self.weights).cost
+
+    def for_ctx(self, ctx: Dict[str, Any]) -> float:
+        """
+        The timeout of the query of a ctx, ex. for the execution options of
+        a select(): .execution_options(qs_timeout=timeout.for_ctx(ctx))
+        """
+        return self.seconds(self.cost(ctx))
+
+
+def _execute(connection: Any, sql: str) -> None:
+    # On a cursor of its own, so the statement being executed is left untouched
+    cursor = connection.connection.dbapi_connection.cursor()
+
+    try:
+        cursor.execute(sql)
+    finally:
+        cursor.close()
+
+
+def _set_postgresql(connection: Any, seconds: Optional[float]) -> None:
+    # Local to the transaction, it ends with it if the statement is canceled
+    if seconds is None:
+        _execute(connection, "SET LOCAL statement_timeout TO DEFAULT")
+    else:
+        _execute(connection, f"SET LOCAL statement_timeout = {max(1, int(seconds * 1000))}")
+
+
+def _set_sqlite(connection: Any, seconds: Optional[float]) -> None:
+    dbapi_connection = connection.connection.dbapi_connection
+
+    if seconds is None:
+        dbapi_connection.set_progress_handler(None, PROGRESS_STEPS)
+        return
+
+    deadline = time.monotonic() + seconds
+    # Kept until the next statement, so the rows fetched after the execute are bounded too
+    dbapi_connection.set_progress_handler(lambda: time.monotonic() > deadline, PROGRESS_STEPS)
+
+
+SETTERS = {
+    "postgresql": _set_postgresql,
+    "sqlite": _set_sqlite,
+}
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany) -> None:
+    seconds = context.execution_options.get(TIMEOUT_OPTION) if context is not None else None
+    setter = SETTERS.get(conn.dialect.name)
+
+    if setter is None:
+        return
+
+    if seconds is not None:
+        setter(conn, seconds)
+        conn.info[TIMEOUT_SET] = conn.dialect.name
+
+    elif conn.info.pop(TIMEOUT_SET, None) is not None:
+        setter(conn, None)
+
+
+def _handle_error(exception_context) -> None:
+    context = exception_context.execution_context
+
+    if context is None or context.execution_options.get(TIMEOUT_OPTION) is None:
+        return
+
+    error = exception_context.original_exception
+    dialect = exception_context.dialect.name
+
+    if dialect == "sqlite":
+        timed_out = str(error) == "interrupted"
+    elif dialect == "postgresql":
+        timed_out = QUERY_CANCELED in (getattr(error, "pgcode", None), getattr(error, "sqlstate", None))
+    else:
+        timed_out = False
+
+    if timed_out:
+        timeout = QueryTimeout(context.execution_options[TIMEOUT_OPTION])
+        send_error("execute", timeout)
+        raise timeout from error
+
+
+def _checkin(dbapi_connection, connection_record) -> None:
+    if connection_record is not None and connection_record.info.pop(TIMEOUT_SET, None) == "sqlite":
+        dbapi_connection.set_progress_handler(None, PROGRESS_STEPS)
+
+
+def apply_timeouts(target: Any = Engine) -> None:
+    """
+    Enforce the TIMEOUT_OPTION of the statements run by an engine, on
+    Postgres and SQLite. The other dialects ignore it.
+
+    Args:
+        target: Engine class or instance, all engines by default.
+    """
+    event.listen(target, "before_cursor_execute", _before_cursor_execute)
+    event.listen(target, "handle_error", _handle_error)
+    event.listen(target, "checkin", _checkin)
+
+
+def remove_timeouts(target: Any = Engine) -> None:
+    """
+    Remove the listeners added by apply_timeouts.
+    """
+    event.remove(target, "before_cursor_execute", _before_cursor_execute)
+    event.remove(target, "handle_error", _handle_error)
+    event.remove(target, "checkin", _checkin)
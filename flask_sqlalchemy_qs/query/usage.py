@@ -0,0 +1,490 @@
+"""
+Opt-in recorder of the filters and sorts used in production, and an
+advisor that proposes the indexes they are missing
+"""
+import json
+import threading
+import time
+import weakref
+from collections import Counter, namedtuple
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import UniqueConstraint, event
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Mapper
+
+from .constants import FilterType, SortType
+from .plan import BOOLEAN_OPERATORS, normalize_filters, normalize_sorts
+from .registry import MapperInfo, MapperRegistry
+from ..signals import USAGE_OPTION
+
+# Operators an index is useful for: equality first, then ranges (and sorts)
+EQUALITY_OPERATORS = {"eq", "in", "is"}
+RANGE_OPERATORS = {"lt", "lte", "gt", "gte", "startswith"}
+# Case insensitive prefixes, useful with an index on lower(column)
+LOWER_OPERATORS = {"istartswith", "ilike"}
+
+IndexSuggestion = namedtuple(
+    "IndexSuggestion", ["table", "columns", "expression", "count", "latency", "reason"]
+)
+
+
+class _ThreadStats:
+    """
+    The counters of a thread, merged into its UsageRecorder when the thread ends.
+    """
+
+    __slots__ = ("stats", "__weakref__")
+
+    def __init__(self):
+        self.stats: Dict[tuple, list] = {}
+
+
+def _merge(merged: Dict[tuple, Any], stats: Dict[tuple, Any]) -> None:
+    for usage, (count, total, slowest) in list(stats.items()):
+        entry = merged.get(usage)
+
+        if entry is None:
+            merged[usage] = (count, total, slowest)
+        else:
+            merged[usage] = (entry[0] + count, entry[1] + total, max(entry[2], slowest))
+
+
+class UsageRecorder:
+    """
+    Aggregates how often each filter and sort shape is executed, and its
+    latency, per model.
+
+    Each thread counts in its own dict, so recording takes no lock; the
+    dicts are merged when the usage is read, and when their thread ends,
+    so short lived threads do not pile up dicts. The shapes are expanded to
+    columns and operators only then, so recording is a single dict update.
+
+    Statements are tagged by CtxBuilder (see tag), also used for the
+    signals, and timed with engine events, enable them with listen.
+    """
+
+    def __init__(self, mapper_registry: Optional[MapperRegistry] = None):
+        self.mapper_registry = mapper_registry
+        self._local = threading.local()
+        self._threads: "weakref.WeakSet[_ThreadStats]" = weakref.WeakSet()
+        # Counters of the threads that ended
+        self._retired: Dict[tuple, Tuple[int, float, float]] = {}
+        self._lock = threading.RLock()
+
+    @staticmethod
+    def tag(
+        statement: Any,
+        mapper: Mapper,
+        filters: Optional[FilterType] = None,
+        sorts: Optional[List[SortType]] = None,
+    ) -> Any:
+        """
+        Tag a select() or Query with the shape of its filters or sorts,
+        keeping the ones it was tagged with before.
+
+        Args:
+            statement: A select() or Query.
+            mapper: The mapper of the queried entity.
+            filters: The filters applied to the statement.
+            sorts: The sorts applied to the statement.
+
+        Returns:
+            The tagged statement.
+        """
+        _, filter_shape, sort_shape = statement.get_execution_options().get(
+            USAGE_OPTION, (mapper, (), ())
+        )
+
+        if filters:
+            filter_shape = normalize_filters(filters)[0]
+        if sorts:
+            sort_shape = normalize_sorts(sorts)
+
+        return statement.execution_options(
+            **{USAGE_OPTION: (mapper, filter_shape, sort_shape)}
+        )
+
+    def record(self, usage: tuple, elapsed: float) -> None:
+        """
+        Count an execution of a tagged statement.
+
+        Args:
+            usage: The (mapper, filter shape, sort shape) tag.
+            elapsed: The execution time in seconds.
+        """
+        thread = getattr(self._local, "thread", None)
+
+        if thread is None:
+            thread = self._local.thread = _ThreadStats()
+
+            with self._lock:
+                self._threads.add(thread)
+
+            weakref.finalize(thread, self._retire, thread.stats)
+
+        stats = thread.stats
+        entry = stats.get(usage)
+
+        if entry is None:
+            stats[usage] = [1, elapsed, elapsed]
+        else:
+            entry[0] += 1
+            entry[1] += elapsed
+
+            if elapsed > entry[2]:
+                entry[2] = elapsed
+
+    def snapshot(self) -> Dict[tuple, Tuple[int, float, float]]:
+        """
+        Merge the counters of all the threads.
+
+        Returns:
+            A dict of tags and (count, total seconds, max seconds) tuples.
+        """
+        with self._lock:
+            threads = [thread.stats for thread in self._threads]
+            merged = dict(self._retired)
+
+        for stats in threads:
+            _merge(merged, stats)
+
+        return merged
+
+    def _retire(self, stats: Dict[tuple, list]) -> None:
+        with self._lock:
+            _merge(self._retired, stats)
+
+    def clear(self) -> None:
+        """
+        Reset the counters of all the threads.
+        """
+        with self._lock:
+            for thread in self._threads:
+                thread.stats.clear()
+
+            self._retired.clear()
+
+    def report(self) -> Dict[str, Any]:
+        """
+        The usage by column ("table.column") and by query pattern, JSON
+        serializable to be read by advise in another process.
+
+        Returns:
+            A dict with the "columns" and "patterns" usage.
+        """
+        registry = self.mapper_registry or MapperRegistry()
+        columns: Dict[str, Dict[str, Any]] = {}
+        patterns = []
+
+        for (mapper, filter_shape, sort_shape), (count, total, slowest) in self.snapshot().items():
+            info = registry.get(mapper)
+            filters: List[Tuple[str, str, str]] = []
+            sorts: List[Tuple[str, str, str]] = []
+            joins: List[Tuple[str, Tuple[str, ...]]] = []
+
+            _filter_usage(filter_shape, info, registry, filters, joins)
+
+            for sort in sort_shape:
+                _sort_usage(sort, info, registry, sorts, joins)
+
+            for kind, used in (("filters", filters), ("sorts", sorts)):
+                for table, column, operator in used:
+                    usage = columns.setdefault(
+                        f"{table}.{column}",
+                        {"filters": Counter(), "sorts": Counter(), "count": 0, "latency": 0.0},
+                    )
+                    usage[kind][operator] += count
+
+            for name in {f"{table}.{column}" for table, column, _ in filters + sorts}:
+                columns[name]["count"] += count
+                columns[name]["latency"] += total
+
+            patterns.append({
+                "table": info.mapper.local_table.name,
+                "filters": filters,
+                "sorts": sorts,
+                "joins": joins,
+                "count": count,
+                "latency": total,
+                "max_latency": slowest,
+            })
+
+        for usage in columns.values():
+            usage["filters"] = dict(usage["filters"])
+            usage["sorts"] = dict(usage["sorts"])
+
+        patterns.sort(key=lambda pattern: -pattern["latency"])
+
+        return {"columns": columns, "patterns": patterns}
+
+    def dump(self, path: str) -> None:
+        """
+        Write the report to a JSON file, for the qs-index-advisor command.
+        """
+        with open(path, "w") as file:
+            json.dump(self.report(), file, indent=2)
+
+    def listen(self, target: Any = Engine) -> None:
+        """
+        Time the tagged statements executed by an engine.
+
+        Args:
+            target: Engine class or instance, all engines by default.
+        """
+        event.listen(target, "before_cursor_execute", self._before_cursor_execute)
+        event.listen(target, "after_cursor_execute", self._after_cursor_execute)
+
+    def remove(self, target: Any = Engine) -> None:
+        """
+        Remove the listeners added by listen.
+        """
+        event.remove(target, "before_cursor_execute", self._before_cursor_execute)
+        event.remove(target, "after_cursor_execute", self._after_cursor_execute)
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany) -> None:
+        if context is not None and USAGE_OPTION in context.execution_options:
+            context._qs_usage_start = time.perf_counter()
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany) -> None:
+        start = getattr(context, "_qs_usage_start", None)
+
+        if start is not None:
+            self.record(context.execution_options[USAGE_OPTION], time.perf_counter() - start)
+
+
+def _filter_usage(
+    shape: tuple,
+    info: MapperInfo,
+    registry: MapperRegistry,
+    filters: List[Tuple[str, str, str]],
+    joins: List[Tuple[str, Tuple[str, ...]]],
+) -> None:
+    for key, value in shape:
+        if key in BOOLEAN_OPERATORS and isinstance(value, tuple):
+            for clause in value:
+                _filter_usage(clause, info, registry, filters, joins)
+
+        elif key in info.relationships:
+            relationship = info.relationships[key]
+            _join_usage(relationship, joins)
+            _filter_usage(value, registry.get(relationship.mapper), registry, filters, joins)
+
+        elif key.split(".", 1)[0] in info.columns and isinstance(value, tuple):
+            name, _, path = key.partition(".")
+            column = info.columns[name]
+            column_name = f"{column.name}.{path}" if path else column.name
+
+            for operator, _ in value:
+                filters.append((column.table.name, column_name, operator))
+
+
+def _sort_usage(
+    shape: tuple,
+    info: MapperInfo,
+    registry: MapperRegistry,
+    sorts: List[Tuple[str, str, str]],
+    joins: List[Tuple[str, Tuple[str, ...]]],
+) -> None:
+    for key, value in shape:
+        if key in info.columns:
+            column = info.columns[key]
+            sorts.append((column.table.name, column.name, value))
+
+        elif key in info.relationships and isinstance(value, tuple):
+            relationship = info.relationships[key]
+            _join_usage(relationship, joins)
+            _sort_usage(value, registry.get(relationship.mapper), registry, sorts, joins)
+
+
+def _join_usage(relationship: Any, joins: List[Tuple[str, Tuple[str, ...]]]) -> None:
+    # The remote side of a join is looked up once per row of the other side
+    tables: Dict[str, List[str]] = {}
+
+    for column in relationship.remote_side:
+        tables.setdefault(column.table.name, []).append(column.name)
+
+    for table, columns in tables.items():
+        join = (table, tuple(sorted(columns)))
+
+        if join not in joins:
+            joins.append(join)
+
+
+def _existing_indexes(metadata: Any) -> Dict[str, List[Tuple[str, ...]]]:
+    """
+    Leading columns of the indexes, primary keys and unique constraints of
+    each table. Expression indexes are listed as "lower(column)".
+    """
+    indexes: Dict[str, List[Tuple[str, ...]]] = {}
+
+    for table in metadata.tables.values():
+        found = indexes.setdefault(table.name, [])
+
+        # Foreign keys do not create an index (on Postgres)
+        for constraint in (table.primary_key, *(c for c in table.constraints if isinstance(c, UniqueConstraint))):
+            names = tuple(column.name for column in getattr(constraint, "columns", ()))
+
+            if names:
+                found.append(names)
+
+        for index in table.indexes:
+            names = []
+
+            for expression in index.expressions:
+                name = getattr(expression, "name", None)
+
+                if isinstance(name, str) and getattr(expression, "table", None) is not None:
+                    names.append(name)
+                else:
+                    names.append(str(expression).replace(f"{table.name}.", "").lower())
+
+            found.append(tuple(names))
+
+    return indexes
+
+
+def _covered(columns: Tuple[str, ...], indexes: Iterable[Tuple[str, ...]]) -> bool:
+    return any(index[:len(columns)] == columns for index in indexes)
+
+
+def _pattern_indexes(pattern: Dict[str, Any]) -> List[Tuple[str, Tuple[str, ...], bool, str]]:
+    """
+    Indexes useful for a query pattern: equality columns, then sort columns
+    or the first range column, per table; lower() indexes for case
+    insensitive prefixes, and the remote columns of the joins.
+    """
+    tables: Dict[str, Dict[str, list]] = {}
+
+    for table, column, operator in pattern["filters"]:
+        if "." in column:
+            continue
+
+        usage = tables.setdefault(table, {"eq": [], "range": [], "lower": [], "sort": []})
+
+        if operator in EQUALITY_OPERATORS:
+            kind = "eq"
+        elif operator in RANGE_OPERATORS:
+            kind = "range"
+        elif operator in LOWER_OPERATORS:
+            kind = "lower"
+        else:
+            continue
+
+        if column not in usage[kind]:
+            usage[kind].append(column)
+
+    root = pattern["table"]
+    sorts = pattern["sorts"]
+
+    # Sorts can only use the index of the root table when all of them are on it
+    if sorts and all(table == root for table, _, _ in sorts):
+        usage = tables.setdefault(root, {"eq": [], "range": [], "lower": [], "sort": []})
+        usage["sort"] = [column for _, column, _ in sorts]
+
+    suggestions = []
+
+    for table, usage in tables.items():
+        columns = list(usage["eq"])
+        reason = "filter"
+
+        if usage["sort"]:
+            columns += [column for column in usage["sort"] if column not in columns]
+            reason = "filter and sort" if usage["eq"] else "sort"
+        elif usage["range"]:
+            columns += [column for column in usage["range"][:1] if column not in columns]
+
+        if columns:
+            suggestions.append((table, tuple(columns), False, reason))
+
+        for column in usage["lower"]:
+            suggestions.append((table, (f"lower({column})",), True, "case insensitive filter"))
+
+    for table, columns in pattern["joins"]:
+        suggestions.append((table, tuple(columns), False, "join"))
+
+    return suggestions
+
+
+def advise(report: Dict[str, Any], metadata: Any, min_count: int = 1) -> List[IndexSuggestion]:
+    """
+    Propose the indexes missing in the metadata for the patterns of a
+    usage report (see UsageRecorder.report), the ones with the most total
+    latency first.
+
+    Args:
+        report: The usage report.
+        metadata: The MetaData of the tables.
+        min_count: Patterns executed fewer times are ignored.
+
+    Returns:
+        The list of IndexSuggestion.
+    """
+    indexes = _existing_indexes(metadata)
+    found: Dict[Tuple[str, Tuple[str, ...], bool], list] = {}
+
+    for pattern in report["patterns"]:
+        if pattern["count"] < min_count:
+            continue
+
+        for table, columns, expression, reason in _pattern_indexes(pattern):
+            if _covered(columns, indexes.get(table, ())):
+                continue
+
+            entry = found.setdefault((table, columns, expression), [0, 0.0, reason])
+            entry[0] += pattern["count"]
+            entry[1] += pattern["latency"]
+
+    # An index is also useful for the queries that use a prefix of it
+    for key in list(found):
+        table, columns, expression = key
+
+        for other in found:
+            if other != key and other[0] == table and other[2] == expression \
+                    and len(other[1]) > len(columns) and other[1][:len(columns)] == columns:
+                found[other][0] += found[key][0]
+                found[other][1] += found[key][1]
+                del found[key]
+                break
+
+    suggestions = [
+        IndexSuggestion(table, columns, expression, count, latency, reason)
+        for (table, columns, expression), (count, latency, reason) in found.items()
+    ]
+
+    return sorted(suggestions, key=lambda suggestion: (-suggestion.latency, -suggestion.count))
+
+
+def create_index_sql(suggestion: IndexSuggestion) -> str:
+    """
+    The CREATE INDEX statement of a suggestion.
+    """
+    names = "_".join(
+        column.replace("(", "_").replace(")", "") for column in suggestion.columns
+    )
+
+    return f"CREATE INDEX ix_{suggestion.table}_{names} ON {suggestion.table} ({', '.join(suggestion.columns)})"
+
+
+@click.command("qs-index-advisor")
+@click.argument("report", type=click.Path(exists=True, dir_okay=False))
+@click.option("--min-count", default=1, help="Ignore the patterns executed fewer times.")
+@with_appcontext
+def index_advisor_command(report: str, min_count: int) -> None:
+    """
+    Print the CREATE INDEX statements proposed for a usage REPORT file
+    (see UsageRecorder.dump). Register it with app.cli.add_command.
+    """
+    with open(report) as file:
+        usage = json.load(file)
+
+    metadata = current_app.extensions["sqlalchemy"].metadata
+
+    for suggestion in advise(usage, metadata, min_count):
+        click.echo(
+            f"{create_index_sql(suggestion)};  "
+            f"-- {suggestion.reason}, {suggestion.count} queries, {suggestion.latency:.3f}s"
+        )
@@ -0,0 +1,112 @@
+"""
+Flask response helpers for the results of ctx queries
+"""
+import json
+from typing import Any, Callable, Dict, Iterable, Iterator, Optional
+
+from flask import Response, stream_with_context
+from sqlalchemy import inspect
+from sqlalchemy.engine import Row
+from werkzeug.exceptions import HTTPException
+
+def to_dict(item: Any) -> Dict[str, Any]:
+  """
+  Default serializer: rows by their mapping, entities by as_dict() if they
+  have it, otherwise by their loaded column attributes (deferred columns
+  are not loaded).
+  """
+  if isinstance(item, Row):
+    return dict(item._mapping)
+
+  if hasattr(item, "as_dict"):
+    return item.as_dict()
+
+  state = inspect(item)
+  return {attr.key: state.dict[attr.key] for attr in state.mapper.column_attrs if attr.key in state.dict}
+
+def iter_ndjson(
+  items: Iterable[Any],
+  serializer: Callable[[Any], Any] = to_dict,
+  chunk_size: int = 500
+) -> Iterator[str]:
+  """
+  Serialize the items as newline delimited JSON, chunk_size lines per chunk.
+
+  Args:
+    items: The items, ex. the iterator of BaseQuery.stream_by_ctx
+    serializer: Callable to turn an item into a JSON serializable value.
+    chunk_size: The amount of lines of each chunk.
+
+  Returns:
+    An iterator of the chunks.
+  """
+  lines = []
+
+  for item in items:
+    lines.append(json.dumps(serializer(item), default=str))
+
+    if len(lines) >= chunk_size:
+      lines.append("")
+      yield "\n".join(lines)
+      lines = []
+
+  if lines:
+    lines.append("")
+    yield "\n".join(lines)
+
+def ndjson_response(
+  items: Iterable[Any],
+  serializer: Callable[[Any], Any] = to_dict,
+  chunk_size: int = 500,
+  headers: Optional[Dict[str, str]] = None
+) -> Response:
+  """
+  Streamed application/x-ndjson response of the items. The request context
+  is kept while streaming, so items can be lazily fetched from the database.
+
+  Args:
+    items: The items, ex. the iterator of BaseQuery.stream_by_ctx
+    serializer: Callable to turn an item into a JSON serializable value.
+    chunk_size: The amount of lines of each chunk.
+    headers: Extra headers of the response.
+
+  Returns:
+    The Flask Response.
+  """
+  return Response(
+    stream_with_context(iter_ndjson(items, serializer, chunk_size)),
+    mimetype="application/x-ndjson",
+    headers=headers
+  )
+
+def batch_error(error: Exception) -> Dict[str, Any]:
+  """
+  The status and message of the error of a batch query. Only the messages
+  of HTTP errors (ex. QueryStringError) and timeouts are shown.
+  """
+  if isinstance(error, HTTPException):
+    return {"status": error.code, "message": error.description}
+
+  if isinstance(error, TimeoutError):
+    return {"status": 504, "message": str(error)}
+
+  return {"status": 500, "message": "The query failed."}
+
+def batch_response(results: Dict[str, Any], status: int = 200) -> Response:
+  """
+  JSON response of the results of run_batch, {"key": {"data": [...]}} or
+  {"key": {"error": {"status": 400, "message": "..."}}} for each key.
+
+  Args:
+    results: The BatchResult by key, items must be JSON serializable.
+    status: The status of the response, the errors have their own.
+
+  Returns:
+    The Flask Response.
+  """
+  body = {
+    key: {"data": result.items} if result.error is None else {"error": batch_error(result.error)}
+    for key, result in results.items()
+  }
+
+  return Response(json.dumps(body, default=str), status=status, mimetype="application/json")
@@ -0,0 +1,74 @@
+"""
+Signals with the timing of each stage of a ctx query, and the engine
+listeners that time its execution
+"""
+import time
+from typing import Any
+
+from blinker import Namespace
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+qs_signals = Namespace()
+
+#Sent with the stage name ("parse", "compile", "execute" or "materialize") as
+#sender, and the elapsed seconds, mapper (None for parse) and normalized
+#shape of the query as keyword arguments.
+stage_timed = qs_signals.signal("stage-timed")
+
+#Sent with the stage name as sender and the exception (and the mapper) when
+#a filter, sort or query of the ctx fails.
+ctx_error = qs_signals.signal("ctx-error")
+
+#Execution option with the (mapper, filter shape, sort shape) of a statement
+USAGE_OPTION = "qs_usage"
+
+#Engine listeners, besides the stage_timed receivers, that read USAGE_OPTION
+taggers = set()
+
+def timing() -> bool:
+  """
+  Whether stage_timed has receivers, checked before taking any time.
+  """
+  return bool(stage_timed.receivers)
+
+def tagging() -> bool:
+  """
+  Whether the ctx statements are tagged with USAGE_OPTION for a listener.
+  """
+  return bool(taggers) or timing()
+
+def send_timing(stage: str, start: float, mapper: Any = None, shape: Any = None) -> None:
+  stage_timed.send(stage, elapsed=time.perf_counter() - start, mapper=mapper, shape=shape)
+
+def send_error(stage: str, error: Exception, mapper: Any = None) -> None:
+  if ctx_error.receivers:
+    ctx_error.send(stage, error=error, mapper=mapper)
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany) -> None:
+  if context is not None and USAGE_OPTION in context.execution_options and timing():
+    context._qs_timing_start = time.perf_counter()
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany) -> None:
+  start = getattr(context, "_qs_timing_start", None)
+
+  if start is not None:
+    mapper, filter_shape, sort_shape = context.execution_options[USAGE_OPTION]
+    send_timing("execute", start, mapper, (filter_shape, sort_shape))
+
+def instrument(target: Any = Engine) -> None:
+  """
+  Send the execute stage of the ctx statements run by an engine.
+
+  Args:
+    target: Engine class or instance, all engines by default.
+  """
+  event.listen(target, "before_cursor_execute", _before_cursor_execute)
+  event.listen(target, "after_cursor_execute", _after_cursor_execute)
+
+def uninstrument(target: Any = Engine) -> None:
+  """
+  Remove the listeners added by instrument.
+  """
+  event.remove(target, "before_cursor_execute", _before_cursor_execute)
+  event.remove(target, "after_cursor_execute", _after_cursor_execute)
@@ -20,9 +20,9 @@ setup(
         "Operating System :: OS Independent",
         "Framework :: Flask"
     ],
-    install_requires=["sqlalchemy >= 2.0", "flask >= 2.2", "flask-sqlalchemy >= 3.0"],
+    install_requires=["sqlalchemy >= 2.0", "flask >= 2.2", "flask-sqlalchemy >= 3.0", "blinker >= 1.6"],
     extras_require={
-        "dev": ["pytest>=7.0", "twine>=4.0"],
+        "dev": ["pytest>=7.0", "twine>=4.0", "aiosqlite>=0.17"],
     },
     python_requires=">=3.7",
 )
\ No newline at end of file
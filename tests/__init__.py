@@ -18,7 +18,7 @@ class User(Base):
   username  = db.Column(db.String(50), unique=True)
   person    = db.relationship("Person", uselist=False, back_populates="user")
   emails    = db.relationship("Email", back_populates="user")
-  json_data = db.Column(db.JSON, nullable=True)
+  json_data = db.Column(db.JSON, nullable=True, info={"qs_json_types": {"num": int, "a.b": int}})
 
   def __repr__(self):
     return f'<User id={self.id!r}, username={self.username!r}>'
@@ -1,7 +1,7 @@
 import pytest
 import json
 from flask import jsonify
-from flask_sqlalchemy_qs import get_url_query_ctx
+from flask_sqlalchemy_qs import get_url_query_ctx, ndjson_response
 from tests import app, db, User, Person, Email
 
 @pytest.fixture(scope="session")
@@ -32,6 +32,14 @@ def client():
           results.append(user_dict)
 
         return jsonify({"users": results})
+
+    if 'export_users' not in app.view_functions:
+      @app.route('/users/export', methods=['GET'])
+      def export_users():
+        ctx = get_url_query_ctx()
+        users = User.query.stream_by_ctx(filters=ctx["filters"], sorts=ctx["sorts"], batch_size=2)
+
+        return ndjson_response(users, chunk_size=3)
   
   with app.test_client() as client:
     yield client
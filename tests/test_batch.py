@@ -0,0 +1,100 @@
+import json
+import threading
+import time
+
+import pytest
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import Session
+from flask_sqlalchemy_qs import BatchTimeout, CtxBuilder, QueryStringError, batch_response, run_batch
+from tests import db, User, Person, Email
+
+@pytest.fixture
+def engine(tmp_path):
+  engine = create_engine(f"sqlite:///{tmp_path / 'batch.db'}")
+  db.metadata.create_all(engine)
+
+  with Session(engine) as session:
+    session.add_all([
+      User(username="alex", person=Person(name="Alex", age=30), emails=[Email(address="alex@example.com")]),
+      User(username="ivan", person=Person(name="Ivan", age=40), emails=[Email(address="ivan@example.org")])
+    ])
+    session.commit()
+
+  yield engine
+  engine.dispose()
+
+def test_run_batch(engine):
+  results = run_batch(engine, {
+    "users": (User, {"filters": {"person": {"age": {"gt": "35"}}}, "sorts": [], "limit": 10}),
+    "emails": (Email, "filters[address][endswith]=.com&sorts[0][id]=asc"),
+    "persons": (Person, {"sorts": [{"age": "desc"}], "limit": 1})
+  })
+
+  assert list(results) == ["users", "emails", "persons"]
+  assert [user["username"] for user in results["users"].items] == ["ivan"]
+  assert [email["address"] for email in results["emails"].items] == ["alex@example.com"]
+  assert [person["name"] for person in results["persons"].items] == ["Ivan"]
+  assert all(result.error is None for result in results.values())
+
+def test_run_batch_concurrent(engine):
+  threads = set()
+
+  def serializer(item):
+    threads.add(threading.get_ident())
+    time.sleep(0.05)
+    return item.id
+
+  results = run_batch(engine, {key: (User, {"sorts": [{"id": "asc"}]}) for key in "abcd"}, serializer=serializer)
+
+  assert all(result.items == [1, 2] for result in results.values())
+  assert len(threads) > 1
+
+def test_run_batch_error_isolation(engine):
+  results = run_batch(engine, {
+    "bad": (User, "filters" + "[a]" * 20 + "=1"),
+    "broken": (object, {}),
+    "users": (User, {})
+  })
+
+  assert isinstance(results["bad"].error, QueryStringError)
+  assert results["broken"].items is None
+  assert len(results["users"].items) == 2
+
+  body = json.loads(batch_response(results).get_data())
+
+  assert body["bad"]["error"]["status"] == 400
+  assert body["broken"]["error"] == {"status": 500, "message": "The query failed."}
+  assert len(body["users"]["data"]) == 2
+
+def test_run_batch_timeout(engine):
+  def serializer(item):
+    if item.username == "ivan":
+      time.sleep(0.3)
+    return item.id
+
+  results = run_batch(engine, {
+    "fast": (User, {"filters": {"username": {"eq": "alex"}}}),
+    "slow": (User, {"filters": {"username": {"eq": "ivan"}}}),
+  }, serializer=serializer, timeout=0.15)
+
+  assert results["fast"].items == [1]
+  assert isinstance(results["slow"].error, BatchTimeout)
+  assert json.loads(batch_response(results).get_data())["slow"]["error"]["status"] == 504
+
+def test_run_batch_timeout_interrupts(engine):
+  class SlowBuilder(CtxBuilder):
+    def select(self, entity, ctx, allowed=None):
+      # Counts for seconds on SQLite unless interrupted
+      slow = text("(WITH RECURSIVE c(x) AS (SELECT 1 UNION ALL SELECT x + 1 FROM c WHERE x < 100000000) SELECT count(*) FROM c) > 0")
+      return super().select(entity, ctx, allowed).where(slow)
+
+  start = time.perf_counter()
+  results = run_batch(engine, {"slow": (User, {})}, builder=SlowBuilder(), timeout=0.1)
+
+  assert isinstance(results["slow"].error, BatchTimeout)
+
+  # The interrupted query gives its connection back to the pool
+  while engine.pool.checkedout() and time.perf_counter() - start < 2:
+    time.sleep(0.01)
+
+  assert engine.pool.checkedout() == 0
@@ -0,0 +1,71 @@
+import asyncio
+import pytest
+from sqlalchemy import create_engine, select
+from sqlalchemy.orm import Session
+from flask_sqlalchemy_qs import CtxBuilder, select_by_ctx
+from tests import db, User, Person
+
+def test_select_by_ctx(setup_entities):
+  ctx = {
+    "filters": {"person": {"age": {"gte": "22"}}},
+    "sorts": [{"person": {"age": "DESC"}}],
+    "offset": 0,
+    "limit": 10
+  }
+  statement = select_by_ctx(User, ctx)
+  users = db.session.execute(statement).scalars().all()
+
+  assert [user.person.age for user in users] == [25, 22]
+  # persons is joined once for the filters and the sorts
+  assert str(statement).count("JOIN persons") == 1
+
+def test_select_by_ctx_limit_offset_include(setup_entities):
+  ctx = {
+    "filters": {"emails": {"address": {"contains": "email_1"}}},
+    "sorts": [{"id": "ASC"}],
+    "offset": 1,
+    "limit": 2,
+    "include": ["person"],
+    "fields": {"users": ["username"]}
+  }
+  users = db.session.execute(select_by_ctx(User, ctx)).unique().scalars().all()
+
+  assert [user.id for user in users] == [2, 3]
+
+def test_builder_on_select(setup_entities):
+  builder = CtxBuilder(relationship_filter="join")
+  statement = builder.filter(select(User), {"emails": {"address": {"startswith": "marco"}}})
+  statement = builder.sort(statement, [{"emails": {"address": "ASC"}}])
+
+  assert str(statement).count("JOIN emails") == 1
+  assert [user.id for user in db.session.execute(statement).scalars()] == [2, 2]
+
+def test_select_by_ctx_async(tmp_path):
+  pytest.importorskip("aiosqlite")
+  from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+
+  url = f"sqlite:///{tmp_path / 'async.db'}"
+  engine = create_engine(url)
+  db.metadata.create_all(engine)
+
+  with Session(engine) as session:
+    session.add_all([
+      User(username="a", person=Person(name="A", age=30)),
+      User(username="b", person=Person(name="B", age=40))
+    ])
+    session.commit()
+
+  ctx = {"filters": {"person": {"age": {"gt": "35"}}}, "sorts": [], "offset": 0, "limit": 10}
+
+  async def run():
+    async_engine = create_async_engine(url.replace("sqlite://", "sqlite+aiosqlite://"))
+
+    async with AsyncSession(async_engine) as session:
+      result = await session.execute(select_by_ctx(User, ctx))
+      usernames = [user.username for user in result.scalars()]
+
+    await async_engine.dispose()
+    return usernames
+
+  assert asyncio.run(run()) == ["b"]
+  engine.dispose()
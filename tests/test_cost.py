@@ -0,0 +1,76 @@
+import pytest
+from flask_sqlalchemy_qs import QueryBudget, QueryCostError, estimate_cost, parse_query
+
+def ctx(query):
+  return parse_query(item.split("=", 1) for item in query.split("&"))
+
+def test_estimate_cost():
+  cost = estimate_cost(ctx(
+    "filters[or][0][username][icontains]=a&filters[or][1][person][age][in][0]=20&filters[or][1][person][age][in][1]=22"
+    "&sorts[0][person][age]=desc&limit=20"
+  ))
+  assert cost.depth == 3
+  assert cost.predicates == 2
+  assert cost.joins == 2
+  assert cost.in_size == 2
+  assert cost.non_sargable == 1
+  assert cost.sorts == 1
+  assert cost.limit == 20
+
+def test_estimate_cost_like_wildcard():
+  assert estimate_cost(ctx("filters[username][like]=a%")).non_sargable == 0
+  assert estimate_cost(ctx("filters[username][like]=%a")).non_sargable == 1
+
+def test_budget_clamps_limit():
+  query_ctx = ctx("filters[id][eq]=1&limit=500")
+  clamped = QueryBudget(max_limit=100).enforce(query_ctx)
+  assert clamped["limit"] == 100
+  assert query_ctx["limit"] == 500
+
+  with pytest.raises(QueryCostError):
+    QueryBudget(max_limit=100, clamp_limit=False).enforce(query_ctx)
+
+@pytest.mark.parametrize("budget, query", [
+  (QueryBudget(max_joins=1), "filters[person][age][eq]=1&sorts[0][person][name]=asc"),
+  (QueryBudget(max_in_size=2), "filters[id][in][0]=1&filters[id][in][1]=2&filters[id][in][2]=3"),
+  (QueryBudget(max_non_sargable=0), "filters[username][endswith]=x"),
+  (QueryBudget(max_depth=2), "filters[not][0][or][0][id][eq]=1"),
+  (QueryBudget(max_predicates=1), "filters[id][gt]=1&filters[id][lt]=3"),
+  (QueryBudget(max_offset=100), "offset=1000"),
+  (QueryBudget(max_cost=5), "filters[username][icontains]=a"),
+])
+def test_budget_rejects(budget, query):
+  with pytest.raises(QueryCostError):
+    budget.enforce(ctx(query))
+
+def test_budget_endpoint(client):
+  from tests.conftest import app
+  app.config["QS_BUDGET"] = QueryBudget(max_limit=5)
+
+  try:
+    response = client.get("/endpoint?limit=50")
+    assert response.status_code == 200
+    assert response.json["ctx"]["limit"] == 5
+
+    response = client.get("/endpoint?filters[username][endswith]=a&filters[email][endswith]=b&filters[name][icontains]=c&filters[a][icontains]=d")
+    assert response.status_code == 400
+  finally:
+    app.config.pop("QS_BUDGET")
+
+def test_boolean_inside_relationship():
+  nested = ctx(
+    "filters[person][or][0][name][icontains]=a&filters[person][or][1][name][endswith]=b"
+    "&filters[person][or][2][name][icontains]=c&filters[person][or][3][name][endswith]=d"
+  )
+  top = ctx(
+    "filters[or][0][username][icontains]=a&filters[or][1][username][endswith]=b"
+    "&filters[or][2][username][icontains]=c&filters[or][3][username][endswith]=d"
+  )
+  cost = estimate_cost(nested)
+
+  assert (cost.predicates, cost.non_sargable, cost.joins) == (4, 4, 1)
+  assert cost.cost == estimate_cost(top).cost + 5
+
+  for query in (nested, top):
+    with pytest.raises(QueryCostError):
+      QueryBudget().enforce(query)
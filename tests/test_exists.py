@@ -0,0 +1,46 @@
+from flask_sqlalchemy_qs import BaseQuery
+from tests import db, User
+
+class JoinQuery(BaseQuery):
+  relationship_filter = "join"
+
+def test_to_many_filter_uses_exists(setup_entities):
+  query = User.query.filter_by_ctx(filters={"emails": {"address": {"contains": "email"}}})
+  sql = str(query.statement)
+
+  assert "EXISTS" in sql
+  assert "JOIN" not in sql
+  # One row per user, no duplicated rows to count
+  assert query.count() == 4
+
+def test_to_one_filter_uses_join(setup_entities):
+  sql = str(User.query.filter_by_ctx(filters={"person": {"age": {"eq": "20"}}}).statement)
+
+  assert "JOIN" in sql
+  assert "EXISTS" not in sql
+
+def test_join_strategy(setup_entities):
+  query = JoinQuery(User, session=db.session()).filter_by_ctx(filters={"emails": {"address": {"contains": "email"}}})
+
+  assert "JOIN" in str(query.statement)
+  assert query.count() == 6
+
+def test_nested_relationships_inside_exists(setup_entities):
+  filters = {"emails": {"user": {"person": {"age": {"eq": "25"}}}}}
+  users = User.query.filter_by_ctx(filters=filters).all()
+
+  assert [user.username for user in users] == ["marco_username@example.com"]
+
+def test_exists_in_boolean_expressions(setup_entities):
+  filters = {
+    "or": [
+      {"emails": {"address": {"startswith": "ivan"}}},
+      {"person": {"age": {"eq": "25"}}}
+    ]
+  }
+  users = User.query.filter_by_ctx(filters=filters).all()
+
+  assert sorted(user.username for user in users) == [
+    "ivan_username@example.com",
+    "marco_username@example.com"
+  ]
@@ -0,0 +1,118 @@
+import logging
+
+import pytest
+from flask import Flask
+from sqlalchemy import create_engine, text
+from flask_sqlalchemy_qs import CtxBuilder, SlowQueryLog, explain, explain_allowed, get_url_query_ctx, parse_query
+from flask_sqlalchemy_qs.query import explain as explain_module
+from flask_sqlalchemy_qs.query.explain import statement_joins
+from flask_sqlalchemy_qs.signals import tagging
+from tests import db, User
+
+@pytest.fixture
+def slow_log(setup_entities):
+  log = SlowQueryLog(threshold=0)
+  log.listen(db.engine)
+  yield log
+  log.remove(db.engine)
+
+def test_parse_explain():
+  assert parse_query([("explain", "1")])["explain"] is True
+  assert parse_query([("explain", "true"), ("explain", "0")])["explain"] is True
+  assert parse_query([("explain", "0")])["explain"] is False
+  assert "explain" not in parse_query([("limit", "1")])
+
+@pytest.mark.parametrize("config, debug, allowed", [
+  ({}, False, False),
+  ({}, True, True),
+  ({"QS_EXPLAIN": True}, False, True),
+  ({"QS_EXPLAIN": False}, True, False),
+  ({"QS_EXPLAIN": lambda request: request.headers.get("X-Debug") == "1"}, False, True),
+])
+def test_explain_guard(config, debug, allowed):
+  app = Flask(__name__)
+  app.config.update(config)
+  app.debug = debug
+
+  for frozen in (False, True):
+    app.config["QS_FROZEN_CTX"] = frozen
+
+    with app.test_request_context("/users?explain=1&limit=5", headers={"X-Debug": "1"}):
+      assert explain_allowed() is allowed
+      assert get_url_query_ctx().get("explain", False) is allowed
+
+def test_explain_by_ctx(setup_entities):
+  query = User.query.filter_by_ctx({"person": {"age": {"in": ["20", "25"]}}}).sort_by_ctx([{"id": "desc"}])
+  result = query.explain_by_ctx()
+
+  assert result["dialect"] == "sqlite"
+  assert "JOIN persons" in result["sql"] and "ORDER BY users.id DESC" in result["sql"]
+  assert sorted(result["params"].values()) == [20, 25]
+  assert result["joins"] == [{"target": "persons", "onclause": "User.person", "outer": False}]
+  assert any("users" in step["detail"] or "persons" in step["detail"] for step in result["plan"])
+
+def test_explain_select(setup_entities):
+  statement = CtxBuilder().select(User, {"filters": {"or": [{"username": {"eq": "a"}}, {"person": {"name": {"eq": "b"}}}]}})
+  result = explain(db.session.connection(), statement)
+
+  assert [join["outer"] for join in result["joins"]] == [True]
+  assert result["plan"]
+
+def test_slow_query_log(slow_log, caplog):
+  assert tagging()
+
+  with caplog.at_level(logging.WARNING, logger="flask_sqlalchemy_qs.slow_queries"):
+    User.query.filter_by_ctx({"person": {"age": {"gte": "20"}}}).all()
+    User.query.filter_by_ctx({"person": {"age": {"gte": "25"}}}).all()
+    User.query.sort_by_ctx([{"username": "asc"}]).all()
+    # Plain queries are not ctx queries
+    db.session.execute(text("SELECT 1")).all()
+
+  entries = slow_log.entries()
+  by_model = {(entry["model"], len(entry["joins"])): entry for entry in entries}
+
+  assert len(entries) == 2
+  assert len(caplog.records) == 3
+
+  filtered = by_model[("users", 1)]
+  assert filtered["count"] == 2
+  assert filtered["shape"][0] == (("person", (("age", (("gte", (0, str)),)),)),)
+  assert filtered["joins"][0]["target"] == "persons"
+  assert "JOIN persons" in filtered["sql"]
+  assert filtered["plan"] and "error" not in filtered["plan"]
+  assert filtered["max"] <= filtered["total"]
+
+def test_slow_query_log_threshold_and_sampling(setup_entities):
+  log = SlowQueryLog(threshold=10)
+  sampled = SlowQueryLog(threshold=0, sample_rate=0)
+
+  for target in (log, sampled):
+    target.listen(db.engine)
+
+  try:
+    User.query.filter_by_ctx({"id": {"eq": "1"}}).all()
+  finally:
+    for target in (log, sampled):
+      target.remove(db.engine)
+
+  assert log.entries() == [] and sampled.entries() == []
+  assert not tagging()
+
+def test_statement_joins_plain():
+  assert statement_joins(text("SELECT 1")) == []
+
+def test_slow_query_log_failed_explain(tmp_path, monkeypatch):
+  monkeypatch.setattr(explain_module, "SAVEPOINT_DIALECTS", {"sqlite"})
+  engine = create_engine(f"sqlite:///{tmp_path / 'explain.db'}")
+  db.metadata.create_all(engine)
+
+  with engine.connect() as connection:
+    connection.execute(User.__table__.insert().values(username="kept"))
+    plan = SlowQueryLog()._plan(connection, "SELECT * FROM missing_table", ())
+
+    assert "error" in plan
+    # The transaction of the connection goes on
+    assert connection.execute(text("SELECT username FROM users")).scalar() == "kept"
+    connection.commit()
+
+  engine.dispose()
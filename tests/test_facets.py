@@ -0,0 +1,108 @@
+import pytest
+from sqlalchemy import select
+from sqlalchemy.dialects import postgresql
+from flask_sqlalchemy_qs import CtxBuilder, QueryBudget, QueryCostError, QueryStringError, estimate_cost, parse_query
+from flask_sqlalchemy_qs.query.facets import bucket, facet_counts
+from tests import db, User
+
+def counts(facet):
+  return [(item["value"], item["count"]) for item in facet]
+
+def test_parse_facets():
+  ctx = parse_query([("facets[username]", ""), ("facets[person][age]", "10"), ("facets[person][name]", "")])
+  assert ctx["facets"] == {"username": None, "person.age": 10, "person.name": None}
+
+  assert parse_query([("facets[person][age]", "2.5")])["facets"] == {"person.age": 2.5}
+  assert "facets" not in parse_query([("limit", "1")])
+
+@pytest.mark.parametrize("key, value", [
+  ("facets", ""),
+  ("facets[]", ""),
+  ("facets[0]", ""),
+  ("facets[age]", "x"),
+  ("facets[age]", "0"),
+  ("facets[age]", "-5"),
+  ("facets[age]", "inf"),
+])
+def test_parse_facets_invalid(key, value):
+  with pytest.raises(QueryStringError):
+    parse_query([(key, value)])
+
+def test_facets_by_ctx(setup_entities):
+  facets = User.query.facets_by_ctx({"person.age": None, "person.name": None})
+
+  assert counts(facets["person.age"]) == [(20, 2), (22, 1), (25, 1)]
+  assert len(facets["person.name"]) == 4
+
+def test_facets_under_filters(setup_entities):
+  query = User.query.filter_by_ctx({"person": {"age": {"gte": "21"}}})
+  facets = query.facets_by_ctx({"person.age": None, "username": None}, limit=1)
+
+  assert counts(facets["person.age"]) == [(22, 1)]
+  assert len(facets["username"]) == 1
+
+def test_facet_buckets(setup_entities):
+  facets = User.query.facets_by_ctx({"person.age": 5})
+  assert counts(facets["person.age"]) == [(20, 3), (25, 1)]
+
+  with pytest.raises(QueryStringError):
+    User.query.facets_by_ctx({"username": 5})
+
+def test_facets_to_many(setup_entities):
+  # The users are counted once, even if the emails repeat them
+  facets = User.query.facets_by_ctx({"person.age": None, "emails.address": None})
+
+  assert counts(facets["person.age"]) == [(20, 2), (22, 1), (25, 1)]
+  assert sum(item["count"] for item in facets["emails.address"]) == 6
+
+def test_facets_invalid_path(setup_entities):
+  with pytest.raises(QueryStringError):
+    User.query.facets_by_ctx({"person.unknown": None})
+
+  with pytest.raises(QueryStringError):
+    User.query.facets_by_ctx({"unknown.age": None})
+
+def test_facets_select(setup_entities):
+  statement = CtxBuilder().facets(select(User), {"person.age": None, "username": None}, "sqlite")
+  sql = str(statement)
+
+  assert "UNION ALL" in sql
+  assert "LEFT OUTER JOIN persons" in sql
+  assert counts(facet_counts(db.session.execute(statement).all(), ["person.age", "username"])["person.age"])[0] == (20, 2)
+
+def test_facets_grouping_sets():
+  statement = CtxBuilder().facets(select(User), {"person.age": 10, "username": None}, "postgresql")
+  sql = str(statement.compile(dialect=postgresql.dialect()))
+
+  assert "GROUP BY GROUPING SETS" in sql
+  assert "UNION" not in sql
+  assert "grouping(users.username)" in sql
+
+def test_facet_grouping_rows():
+  rows = [
+    {"f0": 20, "f1": None, "g0": 0, "g1": 1, "count": 2},
+    {"f0": None, "f1": "alex", "g0": 1, "g1": 0, "count": 1},
+    {"f0": None, "f1": None, "g0": 0, "g1": 1, "count": 3},
+  ]
+
+  class Row:
+    def __init__(self, mapping):
+      self._mapping = mapping
+
+  facets = facet_counts([Row(row) for row in rows], ["age", "name"])
+
+  assert counts(facets["age"]) == [(None, 3), (20, 2)]
+  assert counts(facets["name"]) == [("alex", 1)]
+
+def test_bucket_floor(setup_entities):
+  values = [db.session.execute(select(bucket(value, 10))).scalar() for value in (25, -25, 30, -30, 2.5)]
+  assert values == [20, -30, 30, -30, 0]
+
+def test_facets_budget():
+  ctx = {"facets": {"person.age": None, "username": None}}
+
+  assert estimate_cost(ctx).facets == 2
+  assert estimate_cost(ctx).joins == 1
+
+  with pytest.raises(QueryCostError):
+    QueryBudget(max_facets=1).enforce(ctx)
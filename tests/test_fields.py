@@ -0,0 +1,50 @@
+import pytest
+from flask_sqlalchemy_qs import QueryStringError
+from tests import db, User
+
+def test_fields(setup_entities):
+  query = User.query.fields_by_ctx(fields={"users": ["username"]})
+  sql = str(query)
+
+  assert "users.username" in sql
+  assert "json_data" not in sql
+
+  db.session.expire_all()
+  users = query.all()
+  assert "json_data" not in users[0].__dict__
+
+def test_fields_of_other_models(setup_entities):
+  query = User.query.fields_by_ctx(fields={"persons": ["name"]})
+
+  assert "json_data" in str(query)
+
+def test_fields_of_included_relationships(setup_entities):
+  query = User.query.include_by_ctx(include=["person"], fields={"users": ["username"], "persons": ["name"]}) \
+                    .fields_by_ctx(fields={"users": ["username"], "persons": ["name"]})
+  sql = str(query)
+
+  assert "persons_1.name" in sql
+  assert "persons_1.age" not in sql
+  assert "json_data" not in sql
+
+def test_columns(setup_entities):
+  rows = User.query.filter_by_ctx(filters={"person": {"age": {"eq": "20"}}}) \
+                   .columns_by_ctx(fields={"users": ["id", "username"]}) \
+                   .order_by(User.id) \
+                   .all()
+
+  assert [tuple(row) for row in rows] == [
+    (1, "alex_username@example.com"),
+    (3, "ivan_username@example.com")
+  ]
+  assert rows[0]._mapping["username"] == "alex_username@example.com"
+
+def test_columns_without_fieldset(setup_entities):
+  row = User.query.columns_by_ctx(fields={}).order_by(User.id).first()
+
+  assert row._mapping["username"] == "alex_username@example.com"
+  assert row._mapping["json_data"]["foo"] == "bar"
+
+def test_unknown_field(setup_entities):
+  with pytest.raises(QueryStringError):
+    User.query.fields_by_ctx(fields={"users": ["password"]})
@@ -0,0 +1,76 @@
+from sqlalchemy import event
+from sqlalchemy.dialects import postgresql, sqlite
+from flask_sqlalchemy_qs import CtxBuilder, explain, parse_query
+from flask_sqlalchemy_qs.query.in_list import LARGE_IN_LIST, LargeList
+from flask_sqlalchemy_qs.query.plan import normalize_filters
+from tests import db, User
+
+def test_parse_compact_in_list():
+  ctx = parse_query([
+    ("filters[id][in]", "1,2,,3"),
+    ("filters[id][in][]", "4"),
+    ("filters[username][nin][]", "null"),
+    ("filters[person][name][in][0]", "a,b"),
+  ])
+
+  assert ctx["filters"] == {
+    "id": {"in": ["1", "2", "3", "4"]},
+    "username": {"nin": [None]},
+    "person": {"name": {"in": ["a,b"]}},
+  }
+
+def test_large_list_shape():
+  small, _ = normalize_filters({"id": {"in": list(range(LARGE_IN_LIST))}})
+  large, _ = normalize_filters({"id": {"in": list(range(LARGE_IN_LIST + 1))}})
+
+  assert small[0][1][0][1].type is list
+  assert large[0][1][0][1].type is LargeList
+  assert small != large
+
+def test_small_list(setup_entities):
+  users = User.query.filter_by_ctx({"id": {"in": ["1", "3"]}}).all()
+  assert [user.id for user in users] == [1, 3]
+
+  users = User.query.filter_by_ctx({"id": {"nin": ["1", "3"]}}).all()
+  assert [user.id for user in users] == [2, 4]
+
+def test_large_list_single_parameter(setup_entities):
+  parameters = []
+
+  def before_cursor_execute(conn, cursor, statement, params, context, executemany):
+    parameters.append(params)
+
+  ids = [str(i) for i in range(3, 5000)]
+  event.listen(db.engine, "before_cursor_execute", before_cursor_execute)
+
+  try:
+    users = User.query.filter_by_ctx({"id": {"in": ids}}).all()
+    others = User.query.filter_by_ctx({"id": {"nin": ids}}).all()
+  finally:
+    event.remove(db.engine, "before_cursor_execute", before_cursor_execute)
+
+  assert [user.id for user in users] == [3, 4]
+  assert [user.id for user in others] == [1, 2]
+  assert all(len(params) == 1 for params in parameters[:2])
+
+def test_large_list_sqlite_compile():
+  statement = CtxBuilder().select(User, {"filters": {"id": {"in": list(range(1000))}}})
+  sql = str(statement.compile(dialect=sqlite.dialect()))
+
+  assert "users.id IN (SELECT anon_1.value \nFROM json_each(?) AS anon_1)" in sql
+
+def test_postgresql_any():
+  for size in (3, 1000):
+    statement = CtxBuilder().select(User, {"filters": {"id": {"in": list(range(size))}, "username": {"nin": ["a", "b"]}}})
+    sql = str(statement.compile(dialect=postgresql.dialect()))
+
+    assert "users.id = ANY (%(qs" in sql
+    assert "users.username != ALL (%(qs" in sql
+    assert "POSTCOMPILE" not in sql
+
+def test_in_list_uses_index(setup_entities):
+  statement = CtxBuilder().select(User, {"filters": {"username": {"in": ["alex_username@example.com", "x"]}}})
+  plan = " ".join(step["detail"] for step in explain(db.session.connection(), statement)["plan"])
+
+  assert "= 1" not in str(statement.compile(dialect=sqlite.dialect()))
+  assert "USING INDEX" in plan and "SCAN users" not in plan
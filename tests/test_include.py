@@ -0,0 +1,63 @@
+import pytest
+from sqlalchemy import event
+from flask_sqlalchemy_qs import QueryStringError
+from tests import db, User
+
+@pytest.fixture
+def statements(setup_entities):
+  statements = []
+
+  def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    statements.append(statement)
+
+  db.session.expire_all()
+  event.listen(db.engine, "before_cursor_execute", before_cursor_execute)
+  yield statements
+  event.remove(db.engine, "before_cursor_execute", before_cursor_execute)
+
+def test_without_include(statements):
+  users = User.query.all()
+
+  for user in users:
+    user.person.name
+    len(user.emails)
+
+  assert len(statements) == 1 + 2 * len(users)
+
+def test_include(statements):
+  users = User.query.include_by_ctx(include=["person", "emails"]).all()
+
+  for user in users:
+    user.person.name
+    len(user.emails)
+
+  # joinedload for person, selectinload for emails
+  assert len(statements) == 2
+  assert "JOIN persons" in statements[0]
+
+def test_include_nested_path(statements):
+  users = User.query.include_by_ctx(include=["emails.user.person"]).all()
+
+  for user in users:
+    for email in user.emails:
+      email.user.person.name
+
+  assert len(statements) == 2
+
+def test_include_with_filters(statements):
+  users = User.query.filter_by_ctx(filters={"person": {"age": {"eq": "20"}}}) \
+                    .include_by_ctx(include=["person"]) \
+                    .all()
+
+  assert sorted(user.person.name for user in users) == ["Alex", "Ivan"]
+  assert len(statements) == 1
+
+def test_include_not_allowed(setup_entities):
+  with pytest.raises(QueryStringError):
+    User.query.include_by_ctx(include=["emails"], allowed=["person"])
+
+  with pytest.raises(QueryStringError):
+    User.query.include_by_ctx(include=["username"])
+
+  with pytest.raises(QueryStringError):
+    User.query.include_by_ctx(include=["emails.user.emails.user"])
@@ -0,0 +1,101 @@
+import pytest
+from sqlalchemy import Column, ForeignKey, Integer, String, create_engine, select
+from sqlalchemy.orm import Session, declarative_base, relationship
+from flask_sqlalchemy_qs import CtxBuilder
+from tests import User
+
+Base = declarative_base()
+
+class Employee(Base):
+  __tablename__ = "employees"
+
+  id         = Column(Integer, primary_key=True)
+  name       = Column(String(50))
+  manager_id = Column(Integer, ForeignKey("employees.id"))
+  manager    = relationship("Employee", remote_side=[id])
+
+class Message(Base):
+  __tablename__ = "messages"
+
+  id           = Column(Integer, primary_key=True)
+  sender_id    = Column(Integer, ForeignKey("employees.id"))
+  recipient_id = Column(Integer, ForeignKey("employees.id"))
+  sender       = relationship("Employee", foreign_keys=[sender_id])
+  recipient    = relationship("Employee", foreign_keys=[recipient_id])
+
+@pytest.fixture
+def session():
+  engine = create_engine("sqlite://")
+  Base.metadata.create_all(engine)
+
+  with Session(engine) as session:
+    boss = Employee(id=1, name="boss")
+    alice = Employee(id=2, name="alice", manager=boss)
+    bob = Employee(id=3, name="bob", manager=alice)
+    session.add_all([boss, alice, bob, Message(id=1, sender=alice, recipient=bob), Message(id=2, sender=bob, recipient=boss)])
+    session.commit()
+
+    yield session
+
+def ids(session, statement):
+  return [row.id for row in session.execute(statement).scalars()]
+
+def test_self_referential_alias(session):
+  builder = CtxBuilder()
+  ctx = {"filters": {"manager": {"name": {"ne": "nobody"}}}, "sorts": [{"manager": {"name": "asc"}}]}
+  statement = builder.select(Employee, ctx)
+  sql = str(statement)
+
+  assert sql.count("JOIN employees AS employees_manager") == 1
+  assert "LEFT OUTER" not in sql
+  assert ids(session, statement) == [3, 2]
+
+def test_same_target_twice(session):
+  ctx = {"filters": {"sender": {"name": {"eq": "alice"}}, "recipient": {"name": {"eq": "bob"}}}}
+  statement = CtxBuilder().select(Message, ctx)
+  sql = str(statement)
+
+  assert sql.count("JOIN employees") == 2
+  assert "employees AS employees_recipient" in sql
+  assert ids(session, statement) == [1]
+
+def test_filter_and_sort_paths_once(session):
+  # The plans of the filters and the sorts are compiled apart, the paths are joined once
+  builder = CtxBuilder()
+  statement = builder.filter(select(Message), {"recipient": {"name": {"ne": "x"}}, "sender": {"manager": {"name": {"eq": "boss"}}}})
+  statement = builder.sort(statement, [{"recipient": {"name": "asc"}}, {"sender": {"manager": {"name": "asc"}}}])
+  sql = str(statement)
+
+  assert sql.count("JOIN") == 3
+  assert "LEFT OUTER" not in sql
+  assert ids(session, statement) == [1]
+
+def test_or_branch_outer_join(session):
+  ctx = {"filters": {"or": [{"manager": {"name": {"eq": "alice"}}}, {"name": {"eq": "boss"}}]}, "sorts": [{"id": "asc"}]}
+  statement = CtxBuilder().select(Employee, ctx)
+
+  assert "LEFT OUTER JOIN" in str(statement)
+  # The boss has no manager, an inner join would drop it
+  assert ids(session, statement) == [1, 3]
+
+def test_required_join_wins(session):
+  ctx = {"filters": {
+    "manager": {"name": {"ne": "x"}},
+    "or": [{"manager": {"name": {"eq": "alice"}}}, {"name": {"eq": "alice"}}]
+  }}
+  sql = str(CtxBuilder().select(Employee, ctx))
+
+  assert sql.count("JOIN") == 1
+  assert "LEFT OUTER" not in sql
+
+def test_sort_outer_join(session):
+  statement = CtxBuilder().select(Employee, {"sorts": [{"manager": {"name": "desc"}}, {"id": "asc"}]})
+
+  assert "LEFT OUTER JOIN" in str(statement)
+  assert ids(session, statement) == [2, 3, 1]
+
+def test_path_back_to_entity(setup_entities):
+  sql = str(CtxBuilder(relationship_filter="join").select(User, {"filters": {"person": {"user": {"username": {"eq": "x"}}}}}))
+
+  assert "JOIN persons" in sql
+  assert "JOIN users AS users_person_user" in sql
@@ -0,0 +1,88 @@
+from sqlalchemy import Column, Integer, select
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import declarative_base
+from flask_sqlalchemy_qs import CtxBuilder
+from tests import User
+
+Base = declarative_base()
+
+class Document(Base):
+  __tablename__ = "documents"
+
+  id   = Column(Integer, primary_key=True)
+  data = Column(postgresql.JSONB, info={"qs_json_types": {"size": int, "a.b": str}})
+
+def compile(statement, dialect):
+  return str(statement.compile(dialect=dialect))
+
+def usernames(users):
+  return sorted(user.username.split("_")[0] for user in users)
+
+def test_json_query_string_int(setup_entities):
+  # Query string values are cast to the declared type of the path
+  users = User.query.filter_by_ctx({"json_data.num": {"gt": "8"}}).all()
+  assert usernames(users) == ["alex"]
+
+  users = User.query.filter_by_ctx({"json_data.a.b": {"eq": "10"}}).all()
+  assert usernames(users) == ["alex", "ivan"]
+
+def test_json_string_conditions(setup_entities):
+  users = User.query.filter_by_ctx({"json_data.foo": {"startswith": "bar"}}).all()
+  assert usernames(users) == ["alex", "ivan"]
+
+  users = User.query.filter_by_ctx({"json_data.foo": {"ncontains": "2"}}).all()
+  assert usernames(users) == ["alex"]
+
+def test_json_sqlite_compile():
+  statement = CtxBuilder().select(User, {"filters": {"json_data.a.b": {"gte": "1"}}})
+  sql = compile(statement, sqlite.dialect())
+
+  assert "JSON_EXTRACT(users.json_data, ?)" in sql
+  assert "->>" not in sql
+
+def test_json_sort(setup_entities):
+  users = User.query.filter_by_ctx({"json_data.num": {"gte": 0}}).sort_by_ctx([{"json_data.num": "asc"}]).all()
+  assert usernames(users) == ["alex", "ivan"]
+  assert users[0].username.startswith("ivan")
+
+def test_jsonb_containment():
+  statement = CtxBuilder().select(Document, {"filters": {"data.a.b": {"eq": "x"}, "data.size": {"gt": "2"}}})
+  sql = compile(statement, postgresql.dialect())
+
+  assert "documents.data @> %(qs" in sql
+  assert "documents.data ->> %(data_1)s" in sql
+  assert "AS INTEGER) > %(qs" in sql
+
+  params = statement.compile().params
+  assert {"a": {"b": "x"}} in params.values()
+  assert 2 in params.values()
+
+def test_jsonb_sort():
+  statement = CtxBuilder().sort(select(Document), [{"data.size": "desc"}])
+  sql = compile(statement, postgresql.dialect())
+
+  assert "ORDER BY CAST(documents.data ->> %(data_1)s" in sql
+  assert sql.endswith("AS INTEGER) DESC")
+
+def test_json_and_relationship_filters(setup_entities, capsys):
+  users = User.query.filter_by_ctx({"json_data.foo": {"eq": "bar"}, "person": {"age": {"gte": "20"}}}).all()
+  assert usernames(users) == ["alex"]
+
+  users = User.query.filter_by_ctx({"person": {"age": {"gt": "20"}}, "json_data.num": {"lt": "5"}}).all()
+  assert usernames(users) == []
+  assert "Exception occurred" not in capsys.readouterr().out
+
+def test_jsonb_array_index_no_containment():
+  statement = CtxBuilder().select(Document, {"filters": {"data.items.0": {"eq": "x"}}})
+  sql = compile(statement, postgresql.dialect())
+
+  assert "@>" not in sql
+  assert "documents.data #>> %(data_1)s" in sql
+
+def test_jsonb_untyped_path_no_containment():
+  # "5" is not contained in {"num": 5}, the untyped paths are compared as text
+  statement = CtxBuilder().select(Document, {"filters": {"data.num": {"eq": "5"}}})
+  sql = compile(statement, postgresql.dialect())
+
+  assert "@>" not in sql
+  assert "(documents.data ->> %(data_1)s::TEXT) AS VARCHAR) = %(qs" in sql
@@ -0,0 +1,72 @@
+import pytest
+from flask_sqlalchemy_qs import CtxBuilder, MetricsCollector, get_url_query_ctx, QueryStringError, stage_timed, ctx_error, instrument, uninstrument
+from flask_sqlalchemy_qs.signals import timing
+from tests import app, db, User
+
+@pytest.fixture
+def stages(setup_entities):
+  stages = []
+
+  def receiver(stage, **kwargs):
+    stages.append((stage, kwargs))
+
+  instrument(db.engine)
+  stage_timed.connect(receiver)
+  yield stages
+  stage_timed.disconnect(receiver)
+  uninstrument(db.engine)
+
+def test_stage_timed(stages):
+  with app.test_request_context("/users?filters[username][eq]=alex"):
+    get_url_query_ctx()
+
+  users = User.query.filter_by_ctx({"username": {"eq": "alex_username@example.com"}}).sort_by_ctx([{"id": "desc"}]).all()
+
+  assert len(users) == 1
+  assert [stage for stage, _ in stages] == ["parse", "compile", "compile", "execute", "materialize"]
+  assert all(kwargs["elapsed"] >= 0 for _, kwargs in stages)
+  assert stages[0][1]["mapper"] is None
+  assert stages[0][1]["shape"][0] == (("username", (("eq", (0, str)),)),)
+
+  _, execute = stages[3]
+  assert execute["mapper"] is User.__mapper__
+  assert execute["shape"] == stages[4][1]["shape"]
+  assert execute["shape"][1] == ((("id", "desc"),),)
+
+def test_stage_timed_select(stages):
+  statement = CtxBuilder().select(User, {"filters": {"id": {"eq": 1}}})
+  db.session.execute(statement).all()
+
+  assert [stage for stage, _ in stages] == ["compile", "execute"]
+
+def test_stage_timed_disabled(setup_entities):
+  assert not timing()
+
+  query = User.query.filter_by_ctx({"username": {"eq": "alex"}})
+  assert "qs_usage" not in query.get_execution_options()
+
+def test_metrics_collector(stages):
+  collector = MetricsCollector(buckets=(0.5, 1.0))
+  collector.connect()
+
+  try:
+    collector.observe("execute", 0.7, User.__mapper__)
+    User.query.filter_by_ctx({"username": {"eq": "alex"}}).all()
+
+    with pytest.raises(QueryStringError):
+      User.query.filter_by_ctx({"unknown": {"eq": "alex"}})
+  finally:
+    collector.disconnect()
+
+  text = collector.prometheus()
+
+  assert "# TYPE qs_stage_duration_seconds histogram" in text
+  assert 'qs_stage_duration_seconds_bucket{stage="execute",model="users",le="0.5"} 1' in text
+  assert 'qs_stage_duration_seconds_bucket{stage="execute",model="users",le="1.0"} 2' in text
+  assert 'qs_stage_duration_seconds_count{stage="execute",model="users"} 2' in text
+  assert 'qs_stage_duration_seconds_count{stage="materialize",model="users"} 1' in text
+  assert 'qs_errors_total{stage="filter",model="users",error="QueryStringError"} 1' in text
+
+  response = collector.response()
+  assert response.mimetype == "text/plain"
+  assert not ctx_error.receivers
@@ -0,0 +1,145 @@
+import pickle
+
+import pytest
+from flask_sqlalchemy_qs import Boolean, Comparison, JsonPath, Relationship, QueryStringError, estimate_cost, to_ast
+from flask_sqlalchemy_qs.qs_parser.main import parse_query, parse_query_string
+from flask_sqlalchemy_qs.query.plan import normalize_filters
+from tests import User
+
+FILTERS = {
+  "username": {"startswith": "alex", "ne": "ivan"},
+  "json_data.a.b": {"eq": "10"},
+  "person": {"age": {"gte": 20}},
+  "or": [{"id": {"in": [1, 2]}}, {"not": [{"username": {"eq": "joe"}}]}]
+}
+
+def usernames(users):
+  return sorted(user.username.split("_")[0] for user in users)
+
+def test_to_ast_nodes():
+  ast = to_ast(FILTERS)
+
+  assert ast == Boolean("and", (
+    Comparison("username", "startswith", "alex"),
+    Comparison("username", "ne", "ivan"),
+    JsonPath("json_data", ("a", "b"), "eq", "10"),
+    Relationship("person", Boolean("and", (Comparison("age", "gte", 20),))),
+    Boolean("or", (
+      Boolean("and", (Comparison("id", "in", (1, 2)),)),
+      Boolean("and", (Boolean("not", (Boolean("and", (Comparison("username", "eq", "joe"),)),)),))
+    ))
+  ))
+  assert to_ast(ast) is ast
+  assert ast.to_dict() == FILTERS
+
+def test_ast_hash_and_equality():
+  assert hash(to_ast(FILTERS)) == hash(to_ast(FILTERS))
+  assert len({to_ast(FILTERS), to_ast(FILTERS)}) == 1
+
+  # 1 == True, but they are not the same filter
+  assert Comparison("id", "eq", 1) != Comparison("id", "eq", True)
+  assert Comparison("id", "eq", 1) != Comparison("id", "ne", 1)
+
+def test_ast_immutable():
+  node = Comparison("id", "eq", 1)
+
+  with pytest.raises(AttributeError):
+    node.value = 2
+
+  assert pickle.loads(pickle.dumps(to_ast(FILTERS))) == to_ast(FILTERS)
+
+def test_ast_validation():
+  with pytest.raises(QueryStringError):
+    to_ast({"username": "alex"})
+
+  with pytest.raises(QueryStringError):
+    to_ast({"or": {"username": {"eq": "alex"}}})
+
+  with pytest.raises(QueryStringError):
+    to_ast({"json_data.a": {"in": [1, 2]}})
+
+  with pytest.raises(QueryStringError) as e:
+    Comparison("username", "foo", "alex")
+
+  assert e.value.code == 400
+
+def test_ast_same_shape_as_dict():
+  shape, values = normalize_filters(FILTERS)
+  ast_shape, ast_values = normalize_filters(to_ast(FILTERS))
+
+  assert ast_shape == shape
+  assert list(ast_values) == values
+  assert normalize_filters(to_ast(FILTERS)) is normalize_filters(to_ast(FILTERS))
+
+def test_ast_cost():
+  assert estimate_cost({"filters": to_ast(FILTERS)}).as_dict() == estimate_cost({"filters": FILTERS}).as_dict()
+
+def test_filter_by_ast(setup_entities):
+  users = User.query.filter_by_ctx(to_ast({"username": {"startswith": "alex"}})).all()
+  assert usernames(users) == ["alex"]
+
+  filters = {"or": [{"username": {"startswith": "alex"}}, {"person": {"age": {"gt": 1000}}}]}
+  assert usernames(User.query.filter_by_ctx(to_ast(filters)).all()) == \
+         usernames(User.query.filter_by_ctx(filters).all())
+
+  assert len(User.query.filter_by_ctx(to_ast({})).all()) == len(User.query.all())
+
+def test_parse_query_ast():
+  items = [("filters[username][eq]", "alex"), ("filters[or][0][id][in]", "1,2")]
+  ctx = parse_query(items, ast=True)
+
+  assert isinstance(ctx["filters"], Boolean)
+  assert ctx["filters"].to_dict() == parse_query(items)["filters"]
+
+  frozen = parse_query_string("filters[username][eq]=alex", ast=True)
+  assert frozen["filters"] == Boolean("and", (Comparison("username", "eq", "alex"),))
+
+  with pytest.raises(QueryStringError):
+    parse_query([("filters[username]", "alex")], ast=True)
+
+def test_hand_built_nodes():
+  node = Boolean("or", (Comparison("username", "eq", "alex"), Comparison("username", "eq", "ivan")))
+
+  assert node.to_dict() == {"or": [{"username": {"eq": "alex"}}, {"username": {"eq": "ivan"}}]}
+  assert Comparison("id", "in", (1, 2)).to_dict() == {"id": {"in": [1, 2]}}
+  assert Relationship("person", Comparison("age", "gt", 1)) == \
+         Relationship("person", Boolean("and", (Comparison("age", "gt", 1),)))
+
+  with pytest.raises(QueryStringError):
+    Boolean("and", ({"username": {"eq": "alex"}},))
+
+def test_merged_nodes():
+  node = Boolean("and", (
+    Relationship("person", Boolean("and", (Comparison("age", "gt", 1),))),
+    Relationship("person", Boolean("and", (Comparison("age", "lt", 5),))),
+    Comparison("id", "gt", 1),
+    Comparison("id", "gt", 2),
+    Boolean("or", (Comparison("id", "eq", 1),)),
+    Boolean("or", (Comparison("id", "eq", 2),)),
+  ))
+
+  # Nothing is dropped, the clauses that do not fit in the dict are and-ed
+  assert node.to_dict() == {
+    "person": {"age": {"gt": 1, "lt": 5}},
+    "id": {"gt": 1},
+    "and": [{"id": {"gt": 2}}, {"or": [{"id": {"eq": 2}}]}],
+    "or": [{"id": {"eq": 1}}]
+  }
+
+  shape, values = normalize_filters(node.to_dict())
+  ast_shape, ast_values = normalize_filters(node)
+
+  assert ast_shape == shape
+  assert list(ast_values) == values
+
+def test_filter_by_hand_built_nodes(setup_entities):
+  node = Boolean("and", (
+    Relationship("person", Comparison("age", "gt", 20)),
+    Relationship("person", Comparison("age", "lt", 25)),
+  ))
+
+  assert usernames(User.query.filter_by_ctx(node).all()) == \
+         usernames(User.query.filter_by_ctx({"person": {"age": {"gt": 20, "lt": 25}}}).all())
+
+  node = Boolean("or", (Comparison("username", "startswith", "alex"), Comparison("username", "startswith", "ivan")))
+  assert usernames(User.query.filter_by_ctx(node).all()) == ["alex", "ivan"]
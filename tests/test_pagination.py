@@ -0,0 +1,189 @@
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
+from flask_sqlalchemy_qs import BaseQuery, QueryStringError
+from flask_sqlalchemy_qs.query.explain import Explain
+from flask_sqlalchemy_qs.query.pagination import Page, count_statements, encode_cursor, decode_cursor
+from tests import db, User, Person, Email
+
+def get_all_pages(sorts, limit, filters={}):
+  items = []
+  cursor = None
+
+  while True:
+    page = User.query.filter_by_ctx(filters=filters).paginate_by_ctx(sorts=sorts, limit=limit, cursor=cursor)
+    assert len(page) <= limit
+    items.extend(page.items)
+
+    if not page.has_next:
+      return items
+
+    cursor = page.next_cursor
+
+def test_paginate_relationship_sort(setup_entities):
+  sorts = [{"person": {"age": "DESC"}}]
+  page = User.query.paginate_by_ctx(sorts=sorts, limit=2)
+
+  assert [user.person.age for user in page] == [25, 22]
+  assert page.has_next
+
+  page = User.query.paginate_by_ctx(sorts=sorts, limit=2, cursor=page.next_cursor)
+
+  # Primary key is the tie-breaker of equal ages
+  assert [user.person.age for user in page] == [20, 20]
+  assert page.items[0].id < page.items[1].id
+  assert not page.has_next
+
+def test_paginate_mixed_directions(setup_entities):
+  sorts = [{"person": {"age": "ASC"}}, {"username": "DESC"}]
+  expected = User.query.sort_by_ctx(sorts=sorts).all()
+
+  assert get_all_pages(sorts, 1) == expected
+  assert get_all_pages(sorts, 3) == expected
+
+def test_paginate_with_filters(setup_entities):
+  filters = {"person": {"age": {"gte": "22"}}}
+  users = get_all_pages([{"username": "ASC"}], 1, filters)
+
+  assert [user.username for user in users] == [
+    "david_username@example.com",
+    "marco_username@example.com"
+  ]
+
+def test_paginate_without_sorts(setup_entities):
+  users = get_all_pages([], 3)
+
+  assert [user.id for user in users] == [1, 2, 3, 4]
+
+def test_cursor_round_trip():
+  cursor = encode_cursor([20, "alex"])
+
+  assert decode_cursor(cursor, [(User.__table__.c.id, False), (User.__table__.c.username, True)]) == [20, "alex"]
+
+def test_invalid_cursor(setup_entities):
+  with pytest.raises(QueryStringError):
+    User.query.paginate_by_ctx(sorts=[], limit=1, cursor="not a cursor")
+
+  with pytest.raises(QueryStringError):
+    User.query.paginate_by_ctx(sorts=[], limit=1, cursor=encode_cursor([1, 2]))
+
+def test_paginate_window_total(setup_entities):
+  query = User.query.filter_by_ctx(filters={"person": {"age": {"gte": "22"}}})
+  page = query.paginate_by_ctx(sorts=[{"id": "ASC"}], limit=1, total="window")
+
+  assert len(page) == 1
+  assert (page.total, page.total_kind) == (2, "exact")
+
+  # The next pages do not count again
+  page = query.paginate_by_ctx(sorts=[{"id": "ASC"}], limit=1, cursor=page.next_cursor, total="window")
+  assert len(page) == 1 and page.total is None
+
+  page = User.query.filter_by_ctx(filters={"id": {"gt": "100"}}).paginate_by_ctx(sorts=[], limit=1, total="window")
+  assert page.total == 0
+
+@pytest.fixture
+def session(tmp_path):
+  # The concurrent counts use connections of their own, from a pool of a file database
+  engine = create_engine(f"sqlite:///{tmp_path / 'pages.db'}")
+  db.metadata.create_all(engine)
+
+  with Session(engine, query_cls=BaseQuery) as session:
+    session.add_all([User(username=f"user_{i}", person=Person(age=i % 3)) for i in range(25)])
+    session.commit()
+
+    yield session
+
+  engine.dispose()
+
+def test_paginate_concurrent_total(session):
+  query = session.query(User).filter_by_ctx(filters={"person": {"age": {"eq": "1"}}})
+  page = query.paginate_by_ctx(sorts=[{"person": {"age": "DESC"}}], limit=5, total="concurrent")
+
+  assert len(page) == 5
+  assert (page.total, page.total_kind, page.total_label) == (8, "exact", "8")
+
+  page = query.paginate_by_ctx(sorts=[], limit=5, total="concurrent", count_cap=5)
+  assert (page.total, page.total_kind, page.total_label) == (5, "capped", "5+")
+
+def test_paginate_estimate_total(session):
+  # Without a planner estimate (SQLite) it is a capped count
+  page = session.query(User).paginate_by_ctx(sorts=[], limit=5, total="estimate")
+  assert (page.total, page.total_kind) == (25, "exact")
+
+  page = session.query(User).paginate_by_ctx(sorts=[], limit=5, total="estimate", count_cap=20)
+  assert page.total_label == "20+"
+
+def test_total_label():
+  assert Page([], 10, None).total_label is None
+  assert Page([], 10, None, 12345, "estimate").total_label == "~12,345"
+  assert Page([], 10, None, 10000, "capped").total_label == "10,000+"
+
+def test_invalid_total(setup_entities):
+  with pytest.raises(ValueError):
+    User.query.paginate_by_ctx(sorts=[], limit=1, total="all")
+
+@pytest.mark.parametrize("sorts", [
+  [{"person": {"age": "ASC"}}],
+  [{"person": {"age": "DESC"}}],
+  [{"person": {"age": "ASC"}}, {"username": "DESC"}],
+  [{"person": {"name": "DESC"}}, {"id": "DESC"}],
+])
+def test_paginate_null_keys(session, sorts):
+  # Users without a person (outer joined) and persons without an age
+  session.add_all([User(username="nobody_1"), User(username="nobody_2", person=Person(name="Nemo"))])
+  session.commit()
+
+  expected = session.query(User).sort_by_ctx(sorts).all()
+  items, cursor = [], None
+
+  while True:
+    page = session.query(User).paginate_by_ctx(sorts=sorts, limit=2, cursor=cursor)
+    items.extend(page.items)
+    cursor = page.next_cursor
+
+    if cursor is None:
+      break
+
+  assert len(items) == 27
+  assert [user.person.age if user.person else None for user in items] == \
+    [user.person.age if user.person else None for user in expected]
+
+def test_count_to_many_join(session):
+  for user in session.query(User).order_by(User.id).limit(3):
+    user.emails = [Email(address=f"{user.username}_{i}@example.com") for i in range(3)]
+  session.commit()
+
+  query = session.query(User).join(User.emails)
+
+  page = query.paginate_by_ctx(sorts=[], limit=2, total="concurrent")
+  assert (page.total, page.total_kind) == (3, "exact")
+
+  page = query.paginate_by_ctx(sorts=[], limit=2, total="concurrent", count_cap=10)
+  assert (page.total, page.total_kind) == (3, "exact")
+
+def test_explain_expanding_params(session):
+  # The statements of planner_estimate can have in lists
+  rows, _ = count_statements(session.query(User).filter(User.id.in_([1, 2])), User.__mapper__)
+  assert session.connection().execute(Explain(rows)).all()
+
+def test_paginate_json_path_sort(setup_entities):
+  sorts = [{"json_data.num": "asc"}]
+  expected = User.query.sort_by_ctx(sorts).all()
+
+  assert get_all_pages(sorts, 2) == expected
+
+def test_paginate_to_many_sort(setup_entities):
+  with pytest.raises(QueryStringError, match="'emails' is a to-many relationship"):
+    User.query.paginate_by_ctx(sorts=[{"emails": {"address": "asc"}}], limit=2)
+
+def test_window_total_to_many_join(session):
+  for user in session.query(User).order_by(User.id).limit(3):
+    user.emails = [Email(address=f"{user.username}_{i}@example.com") for i in range(3)]
+  session.commit()
+
+  page = session.query(User).join(User.emails).paginate_by_ctx(sorts=[], limit=2, total="window")
+  assert (page.total, page.total_kind) == (3, "exact")
+
+  # To-one joins keep the window
+  page = session.query(User).join(User.person).paginate_by_ctx(sorts=[], limit=2, total="window")
+  assert page.total == session.query(User).join(User.person).count()
@@ -0,0 +1,86 @@
+from flask_sqlalchemy_qs import BaseQuery, PlanCache
+from flask_sqlalchemy_qs.query.plan import normalize_filters, normalize_sorts, Param
+from tests import User
+
+def test_normalize_filters_shape():
+  shape_1, values_1 = normalize_filters({
+    "username": {"eq": "foo"},
+    "person": {"age": {"gte": "20"}}
+  })
+  shape_2, values_2 = normalize_filters({
+    "person": {"age": {"gte": "30"}},
+    "username": {"eq": "bar"}
+  })
+
+  assert shape_1 == shape_2
+  assert values_1 == ["20", "foo"]
+  assert values_2 == ["30", "bar"]
+
+def test_normalize_filters_literals():
+  shape, values = normalize_filters({
+    "username": {"is": None, "in": ["a", "b"]},
+    "or": [{"id": {"eq": 1}}, {"id": {"eq": None}}]
+  })
+
+  assert shape == (
+    ("or", (
+      (("id", (("eq", Param(0, int)),)),),
+      (("id", (("eq", None),)),),
+    )),
+    ("username", (("in", Param(1, list)), ("is", None))),
+  )
+  assert values == [1, ["a", "b"]]
+
+def test_normalize_sorts_keeps_priority():
+  assert normalize_sorts([{"username": "DESC"}, {"person": {"age": "ASC"}}]) == (
+    (("username", "desc"),),
+    (("person", (("age", "asc"),)),),
+  )
+
+def test_plan_cache_lru():
+  cache = PlanCache(maxsize=2)
+  cache.set("a", 1)
+  cache.set("b", 2)
+
+  assert cache.get("a") == 1
+  cache.set("c", 3)
+
+  assert cache.get("b") is None
+  assert cache.get("c") == 3
+  assert cache.cache_info() == (2, 1, 2, 2)
+
+  cache.clear()
+  assert cache.cache_info() == (0, 0, 2, 0)
+
+def test_plan_cache_hits_on_same_shape(setup_entities):
+  BaseQuery.plan_cache.clear()
+
+  users_1 = User.query.filter_by_ctx(filters={"person": {"age": {"eq": "20"}}}).all()
+  users_2 = User.query.filter_by_ctx(filters={"person": {"age": {"eq": "25"}}}).all()
+
+  assert len(users_1) == 2
+  assert len(users_2) == 1
+  assert users_2[0].person.age == 25
+  assert BaseQuery.plan_cache.cache_info().hits == 1
+  assert BaseQuery.plan_cache.cache_info().misses == 1
+
+def test_plan_cache_in_values(setup_entities):
+  users_1 = User.query.filter_by_ctx(filters={"person": {"age": {"in": [20]}}}).all()
+  users_2 = User.query.filter_by_ctx(filters={"person": {"age": {"in": [22, 25]}}}).all()
+
+  assert len(users_1) == 2
+  assert sorted(user.person.age for user in users_2) == [22, 25]
+
+def test_plan_cache_filter_and_sort(setup_entities):
+  users = User.query.filter_by_ctx(filters={"person": {"age": {"gte": "22"}}}) \
+                    .sort_by_ctx(sorts=[{"person": {"age": "DESC"}}, {"username": "ASC"}]) \
+                    .all()
+
+  assert [user.person.age for user in users] == [25, 22]
+
+def test_same_shape_applied_twice(setup_entities):
+  users = User.query.filter_by_ctx({"id": {"gte": "3"}}).filter_by_ctx({"id": {"gte": "2"}}).all()
+  assert sorted(user.id for user in users) == [3, 4]
+
+  users = User.query.filter_by_ctx({"id": {"in": ["1", "2", "3"]}}).filter_by_ctx({"id": {"in": ["3", "4"]}}).all()
+  assert [user.id for user in users] == [3]
@@ -1,3 +1,11 @@
+import pickle
+import pytest
+from flask_sqlalchemy_qs import QueryBudget
+from flask_sqlalchemy_qs.qs_parser.main import (
+  tokenize, parse_query, parse_query_string, freeze, get_url_query_ctx, FrozenDict, QueryStringError
+)
+from tests import app, User
+
 def test_qs_parser_filters_1(client):
   response = client.get('/endpoint?filters[username][eq]=username@example.com')
   assert response.status_code == 200
@@ -246,4 +254,148 @@ def test_qs_all_combined(client):
       {"foo":{"bar":"DESC"}}, 
       {"foo":{"abc":{"def":"ASC"}}}
     ]
-  }
\ No newline at end of file
+  }
+#Out of order boolean indexes do not share the same dict
+def test_qs_parser_out_of_order_boolean_indexes(client):
+  response = client.get("/endpoint?" +
+    "filters[or][1][foo][eq]=value_foo&" +
+    "filters[or][0][baz][eq]=value_baz")
+  assert response.status_code == 200
+
+  data = response.json
+  assert data["ctx"]["filters"] == {
+    "or": [
+      {"baz": {"eq":"value_baz"}},
+      {"foo": {"eq":"value_foo"}}
+    ]
+  }
+
+#Out of order sorts do not share the same dict
+def test_qs_parser_out_of_order_sorts(client):
+  response = client.get("/endpoint?sorts[1][foo]=DESC&sorts[0][baz]=ASC")
+  assert response.status_code == 200
+
+  data = response.json
+  assert data["ctx"]["sorts"] == [{"baz":"ASC"}, {"foo":"DESC"}]
+
+#Invalid limit and offset fall back to the defaults
+def test_qs_parser_invalid_offset_limit(client):
+  response = client.get("/endpoint?limit=abc&offset=-&limit=5")
+  assert response.status_code == 200
+
+  data = response.json
+  assert data["ctx"]["limit"] == 5
+  assert data["ctx"]["offset"] == 0
+
+#Parser limits
+def test_qs_parser_max_index(client):
+  response = client.get("/endpoint?filters[baz][in][999999]=1")
+  assert response.status_code == 400
+
+def test_qs_parser_invalid_index(client):
+  response = client.get("/endpoint?filters[or][foo][baz][eq]=1")
+  assert response.status_code == 400
+
+def test_qs_parser_max_depth(client):
+  response = client.get("/endpoint?filters" + "[foo]" * 20 + "[eq]=1")
+  assert response.status_code == 400
+
+def test_qs_parser_max_key_length(client):
+  response = client.get("/endpoint?filters[" + "a" * 600 + "][eq]=1")
+  assert response.status_code == 400
+
+def test_tokenize():
+  assert tokenize("filters[or][0][id][eq]") == ("filters", ("or", 0, "id", "eq"))
+  assert tokenize("limit") == ("limit", ())
+
+  with pytest.raises(QueryStringError):
+    tokenize("filters[id[eq]")
+
+def test_parse_query_single_pass():
+  items = iter([
+    ("filters[id][in][1]", "2"),
+    ("sorts[0][id]", "DESC"),
+    ("filters[id][in][0]", "1"),
+    ("limit", "3"),
+    ("other", "ignored")
+  ])
+
+  assert parse_query(items) == {
+    "filters": {"id": {"in": ["1", "2"]}},
+    "sorts": [{"id": "DESC"}],
+    "offset": 0,
+    "limit": 3
+  }
+
+#cursor is only in the ctx when given
+def test_qs_parser_cursor(client):
+  response = client.get("/endpoint?cursor=abc&limit=5")
+  assert response.status_code == 200
+
+  data = response.json
+  assert data["ctx"] == {
+    "filters": {},
+    "offset": 0,
+    "limit": 5,
+    "sorts": [],
+    "cursor": "abc"
+  }
+
+#include in both forms
+def test_qs_parser_include(client):
+  response = client.get("/endpoint?include[]=person&include[]=emails.user&include=person,emails")
+  assert response.status_code == 200
+
+  data = response.json
+  assert data["ctx"]["include"] == ["person", "emails.user", "emails"]
+
+def test_qs_parser_invalid_include(client):
+  response = client.get("/endpoint?include[0]=person")
+  assert response.status_code == 400
+
+#fields by model
+def test_qs_parser_fields(client):
+  response = client.get("/endpoint?fields[users]=id,username&fields[persons]=name&fields[users]=id")
+  assert response.status_code == 200
+
+  data = response.json
+  assert data["ctx"]["fields"] == {"users": ["id", "username"], "persons": ["name"]}
+
+def test_qs_parser_invalid_fields(client):
+  response = client.get("/endpoint?fields=id")
+  assert response.status_code == 400
+
+def test_parse_query_string_memo():
+  ctx = parse_query_string(b"filters[id][in]=1,2&sorts[0][username]=asc&limit=5")
+  info = parse_query_string.cache_info()
+
+  assert parse_query_string(b"filters[id][in]=1,2&sorts[0][username]=asc&limit=5") is ctx
+  assert parse_query_string.cache_info().hits == info.hits + 1
+  assert ctx == {"filters": {"id": {"in": ("1", "2")}}, "sorts": ({"username": "asc"},), "offset": 0, "limit": 5}
+
+def test_frozen_ctx():
+  ctx = freeze(parse_query([("filters[or][0][id][eq]", "1"), ("include", "person")]))
+
+  assert hash(ctx) == hash(freeze(parse_query([("include", "person"), ("filters[or][0][id][eq]", "1")])))
+  assert {ctx: True}[freeze(ctx.copy())]
+  assert pickle.loads(pickle.dumps(ctx)) == ctx
+
+  with pytest.raises(TypeError):
+    ctx["limit"] = 100
+  with pytest.raises(TypeError):
+    ctx["filters"]["or"][0].update({"id": {"eq": "2"}})
+
+  mutable = ctx.copy()
+  mutable["limit"] = 100
+  assert ctx["limit"] == 10
+
+def test_get_url_query_ctx_frozen(setup_entities):
+  with app.test_request_context("/users?filters[or][0][id][in]=1,3&filters[or][1][person][age][eq]=25&limit=50"):
+    ctx = get_url_query_ctx(frozen=True)
+    clamped = get_url_query_ctx(budget=QueryBudget(max_limit=20), frozen=True)
+
+  assert isinstance(ctx, FrozenDict)
+  assert isinstance(clamped, FrozenDict) and clamped["limit"] == 20
+
+  users = User.query.filter_by_ctx(ctx["filters"]).sort_by_ctx(ctx["sorts"]).all()
+  assert sorted(user.id for user in users) == [1, 2, 3]
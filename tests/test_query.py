@@ -1,3 +1,5 @@
+import pytest
+from flask_sqlalchemy_qs import QueryStringError, ctx_error
 from tests import User
 
 def test_eq(setup_entities):
@@ -352,4 +354,38 @@ def test_json_nested(setup_entities):
     print(user.as_dict())
 
   assert len(users) == 1
-  assert users[0].username == "alex_username@example.com"
\ No newline at end of file
+  assert users[0].username == "alex_username@example.com"
+
+@pytest.mark.parametrize("stage, method, ctx", [
+  ("filter", "filter_by_ctx", {"unknown": {"eq": "alex"}}),
+  ("filter", "filter_by_ctx", {"person": {"age": {"unknown": "20"}}}),
+  ("sort", "sort_by_ctx", [{"unknown": "asc"}]),
+  ("sort", "sort_by_ctx", [{"person": {"unknown": "asc"}}]),
+])
+def test_invalid_ctx_raises(setup_entities, stage, method, ctx):
+  errors = []
+
+  def receiver(sender, **kwargs):
+    errors.append((sender, kwargs))
+
+  ctx_error.connect(receiver)
+
+  try:
+    with pytest.raises(QueryStringError):
+      getattr(User.query, method)(ctx)
+  finally:
+    ctx_error.disconnect(receiver)
+
+  assert len(errors) == 1
+  assert errors[0][0] == stage
+  assert errors[0][1]["mapper"] is User.__mapper__
+
+@pytest.mark.parametrize("filters, message", [
+  ({"id": {"eq": "x"}}, "'x' is not a valid value"),
+  ({"username": "abc"}, "'username' has no condition"),
+  ({"person": {"age": "20"}}, "'age' has no condition"),
+  ({"not": [{"id": {"eq": "1"}}, {"id": {"eq": "2"}}]}, "'not' takes a single condition"),
+])
+def test_invalid_filter_values(setup_entities, filters, message):
+  with pytest.raises(QueryStringError, match=message):
+    User.query.filter_by_ctx(filters).all()
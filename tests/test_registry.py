@@ -0,0 +1,30 @@
+import pytest
+from flask_sqlalchemy_qs import BaseQuery, MapperRegistry, QueryStringError
+from flask_sqlalchemy_qs.query.registry import OPERATORS
+from tests import db, User, Person
+
+def test_mapper_info(sqlalchemy):
+  registry = MapperRegistry()
+  info = registry.get(User.__mapper__)
+
+  assert registry.get(User.__mapper__) is info
+  assert info.entity is User
+  assert list(info.columns) == ["id", "username", "json_data"]
+  assert set(info.relationships) == {"person", "emails"}
+  assert info.python_types["id"] is int
+  assert info.python_types["username"] is str
+  assert info.json_columns == {"json_data"}
+  assert info.operators["username"] == OPERATORS
+
+def test_mapper_registry_warm(sqlalchemy):
+  registry = MapperRegistry()
+  registry.warm(db.Model.registry.mappers)
+
+  assert User.__mapper__ in registry
+  assert Person.__mapper__ in registry
+
+def test_json_path_on_not_json_column(setup_entities):
+  BaseQuery.plan_cache.clear()
+
+  with pytest.raises(QueryStringError, match="'username' is not a JSON column."):
+    User.query.filter_by_ctx(filters={"username.foo": {"eq": "bar"}})
@@ -0,0 +1,161 @@
+import pytest
+from sqlalchemy import event, update
+from flask_sqlalchemy_qs import BaseQuery, ResultCache, MemoryBackend, FileBackend
+from flask_sqlalchemy_qs.query.result_cache import MISSING, ctx_tables
+from tests import db, User, Person
+
+ctx = {
+  "filters": {"person": {"age": {"gte": "22"}}},
+  "sorts": [{"username": "ASC"}],
+  "offset": 0,
+  "limit": 10
+}
+
+class CachedQuery(BaseQuery):
+  result_cache = ResultCache(MemoryBackend(maxsize=10), ttl=60)
+
+@pytest.fixture
+def cache(setup_entities):
+  CachedQuery.result_cache.clear()
+  CachedQuery.result_cache.listen(db.session)
+  yield CachedQuery.result_cache
+  CachedQuery.result_cache.remove(db.session)
+
+@pytest.fixture
+def statements():
+  statements = []
+
+  def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    statements.append(statement)
+
+  event.listen(db.engine, "before_cursor_execute", before_cursor_execute)
+  yield statements
+  event.remove(db.engine, "before_cursor_execute", before_cursor_execute)
+
+def users_query():
+  return CachedQuery(User, session=db.session())
+
+def test_cached_by_ctx(cache, statements):
+  results = users_query().cached_by_ctx(ctx)
+
+  assert [user["username"] for user in results] == [
+    "david_username@example.com",
+    "marco_username@example.com"
+  ]
+  assert len(statements) == 1
+
+  assert users_query().cached_by_ctx(ctx) == results
+  assert len(statements) == 1
+  assert (cache.hits, cache.misses) == (1, 1)
+
+def test_invalidation_on_relationship_table_commit(cache):
+  users_query().cached_by_ctx(ctx)
+
+  person = db.session.get(Person, 2)
+  person.age = 26
+  db.session.commit()
+
+  results = users_query().cached_by_ctx(ctx)
+  assert cache.misses == 2
+
+  person.age = 25
+  db.session.commit()
+
+  assert users_query().cached_by_ctx(ctx) == results
+  assert cache.misses == 3
+
+def test_invalidation_on_orm_update(cache):
+  users_query().cached_by_ctx(ctx)
+
+  db.session.execute(update(User).where(User.id == 1).values(username="alex_username@example.com"))
+  db.session.commit()
+
+  users_query().cached_by_ctx(ctx)
+  assert cache.misses == 2
+
+def test_unrelated_commit_keeps_entries(cache):
+  users_query().cached_by_ctx({"filters": {"username": {"eq": "alex_username@example.com"}}})
+
+  person = db.session.get(Person, 2)
+  person.name = "Marco"
+  db.session.commit()
+
+  users_query().cached_by_ctx({"filters": {"username": {"eq": "alex_username@example.com"}}})
+  assert (cache.hits, cache.misses) == (1, 1)
+
+def test_ttl_and_lru():
+  cache = ResultCache(MemoryBackend(maxsize=1), ttl=60)
+  cache.set("a", ["users"], 1)
+  cache.set("b", ["users"], 2)
+
+  assert cache.get("a", ["users"]) is MISSING
+  assert cache.get("b", ["users"]) == 2
+
+  expired = ResultCache(ttl=-1)
+  expired.set("a", ["users"], 1)
+  assert expired.get("a", ["users"]) is MISSING
+
+def test_file_backend_shared(tmp_path):
+  worker_1 = ResultCache(FileBackend(str(tmp_path), maxsize=2))
+  worker_2 = ResultCache(FileBackend(str(tmp_path), maxsize=2))
+
+  worker_1.set("a", ["users", "persons"], [{"id": 1}])
+  assert worker_2.get("a", ["persons", "users"]) == [{"id": 1}]
+
+  worker_2.invalidate(["persons"])
+  assert worker_1.get("a", ["users", "persons"]) is MISSING
+
+  for key in ("b", "c", "d"):
+    worker_1.set(key, ["users"], key)
+
+  assert len(worker_1.backend) == 2
+
+def test_ctx_tables(sqlalchemy):
+  tables = ctx_tables(User.__mapper__, {
+    "filters": {"or": [{"emails": {"address": {"eq": "a"}}}, {"json_data.foo": {"eq": "b"}}]},
+    "sorts": [{"person": {"age": "ASC"}}]
+  }, BaseQuery.mapper_registry)
+
+  assert tables == {"users", "emails", "persons"}
+  assert ctx_tables(User.__mapper__, {"include": ["emails.user"]}, BaseQuery.mapper_registry) == {"users", "emails"}
+
+def test_commit_during_query(cache, statements):
+  def serializer(user):
+    # A commit of another session lands after the query ran
+    cache.invalidate(["persons"])
+    return user.id
+
+  users_query().cached_by_ctx(ctx, serializer)
+  users_query().cached_by_ctx(ctx, serializer)
+
+  assert cache.hits == 0
+  assert len(statements) == 2
+
+def test_file_backend_private_directory(tmp_path):
+  FileBackend(str(tmp_path / "cache"))
+  assert (tmp_path / "cache").stat().st_mode & 0o777 == 0o700
+
+  shared = tmp_path / "shared"
+  shared.mkdir()
+  shared.chmod(0o777)
+
+  with pytest.raises(PermissionError):
+    FileBackend(str(shared))
+
+def test_prefiltered_queries(cache, statements):
+  alex = users_query().cached_by_ctx({"sorts": [{"username": "ASC"}]})
+  filtered = users_query().filter(User.username == "other").cached_by_ctx({"sorts": [{"username": "ASC"}]})
+  tenant = users_query().join(User.person).filter(Person.age >= 30).cached_by_ctx({"sorts": [{"username": "ASC"}]})
+
+  # The criteria of the query tell the entries apart
+  assert len(statements) == 3
+  assert len(alex) == 4
+  assert filtered == []
+  assert [user["username"] for user in tenant] != [user["username"] for user in alex]
+
+  # A commit to a table only the query joins invalidates its entry
+  db.session.execute(update(Person).values(age=Person.age))
+  db.session.commit()
+  users_query().join(User.person).filter(Person.age >= 30).cached_by_ctx({"sorts": [{"username": "ASC"}]})
+
+  assert len(statements) == 5
@@ -0,0 +1,137 @@
+import time
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
+from flask_sqlalchemy_qs import BaseQuery, ReplicaRouter, for_purposes, min_cost
+from flask_sqlalchemy_qs.query.routing import ROUTE_CTX_OPTION, merge_ctx
+from tests import db, User, Person
+
+@pytest.fixture
+def engines(tmp_path):
+  # The username tells the database that served a query
+  engines = {}
+
+  for name in ("primary", "replica1", "replica2"):
+    engine = engines[name] = create_engine(f"sqlite:///{tmp_path / name}.db")
+    db.metadata.create_all(engine)
+
+    with Session(engine) as session:
+      session.add(User(username=name, person=Person(name=name, age=30)))
+      session.commit()
+
+  yield engines
+
+  for engine in engines.values():
+    engine.dispose()
+
+@pytest.fixture
+def routed(engines):
+  def routed(**kwargs):
+    router = ReplicaRouter([engines["replica1"], engines["replica2"]], **kwargs)
+    query_class = type("RoutedQuery", (BaseQuery,), {"router": router})
+    session = Session(engines["primary"], query_cls=query_class)
+    router.listen(session)
+    return router, session
+
+  return routed
+
+def served(session, filters={"id": {"eq": "1"}}):
+  return session.query(User).filter_by_ctx(filters).one().username
+
+def test_round_robin(routed):
+  router, session = routed()
+
+  assert served(session) == "replica1"
+  # The replica is kept until the end of the transaction
+  assert served(session) == "replica1"
+  session.rollback()
+  assert served(session) == "replica2"
+  session.close()
+  assert served(session) == "replica1"
+
+def test_plain_queries_on_primary(routed):
+  router, session = routed()
+
+  assert session.query(User).one().username == "primary"
+  assert session.query(User).sort_by_ctx([{"id": "asc"}]).one().username == "replica1"
+
+def test_least_loaded(routed, engines):
+  router, session = routed(strategy="least_loaded")
+
+  with engines["replica1"].connect():
+    assert router.loads[engines["replica1"]] == 1
+    assert served(session) == "replica2"
+    session.rollback()
+    assert served(session) == "replica2"
+
+  assert router.loads[engines["replica1"]] == 0
+
+def test_rules(routed):
+  router, session = routed(default="primary", rules=[for_purposes("facets", "export"), min_cost(10)])
+
+  assert served(session) == "primary"
+  assert served(session, {"person": {"age": {"gte": "20"}}, "username": {"like": "%a%"}}) == "replica1"
+  session.rollback()
+  assert [user.username for user in session.query(User).stream_by_ctx()] == ["replica2"]
+  session.rollback()
+  facets = session.query(User).facets_by_ctx({"username": None})
+  assert facets["username"][0]["value"] == "replica1"
+
+def test_read_your_writes(routed, engines):
+  router, session = routed(pin_seconds=0.2)
+
+  session.add(User(username="new"))
+  session.flush()
+  assert served(session) == "primary"
+
+  session.commit()
+  assert router.pinned(session)
+  assert served(session) == "primary"
+
+  time.sleep(0.25)
+  session.rollback()
+  assert served(session) == "replica1"
+
+  # Other sessions are not pinned by the writes of this one
+  other = Session(engines["primary"], query_cls=session._query_cls)
+  router.listen(other)
+  assert served(other) == "replica2"
+
+def test_route_on_whole_ctx(routed):
+  router, session = routed(default="primary", rules=[for_purposes("export"), min_cost(7)])
+  filters, sorts = {"username": {"eq": "replica1"}}, [{"person": {"age": "asc"}}]
+
+  # Neither the filters (1) nor the sorts (6) reach the cost, together they do
+  assert session.query(User).filter_by_ctx(filters).all() == []
+  assert session.query(User).sort_by_ctx(sorts).one().username == "primary"
+  assert session.query(User).filter_by_ctx(filters).sort_by_ctx(sorts).one().username == "replica1"
+
+  query = session.query(User).filter_by_ctx(filters).sort_by_ctx(sorts)
+  assert query.get_execution_options()[ROUTE_CTX_OPTION] == ({"filters": filters, "sorts": sorts}, "read")
+
+  # The purpose of the stream is kept by its filters and sorts
+  session.rollback()
+  assert [user.username for user in session.query(User).stream_by_ctx({"username": {"eq": "replica2"}})] == ["replica2"]
+
+def test_merge_ctx():
+  ctx = merge_ctx({"filters": {"id": {"eq": 1}}, "sorts": [{"id": "asc"}]}, {"filters": {"username": {"eq": "a"}}})
+  assert ctx == {"filters": {"id": {"eq": 1}, "username": {"eq": "a"}}, "sorts": [{"id": "asc"}]}
+
+  ctx = merge_ctx(ctx, {"filters": {"id": {"gt": 0}}, "sorts": [{"username": "desc"}]})
+  assert ctx["filters"] == {"and": [{"id": {"eq": 1}, "username": {"eq": "a"}}, {"id": {"gt": 0}}]}
+  assert ctx["sorts"] == [{"id": "asc"}, {"username": "desc"}]
+
+def test_invalid_strategy():
+  with pytest.raises(ValueError):
+    ReplicaRouter([], strategy="random")
+
+def test_concurrent_total_on_replica(routed):
+  router, session = routed()
+
+  page = session.query(User).filter_by_ctx({"username": {"eq": "replica1"}}) \
+                .paginate_by_ctx(sorts=[], limit=10, total="concurrent")
+
+  # The page and its count are both served by the replica
+  assert [user.username for user in page] == ["replica1"]
+  assert page.total == 1
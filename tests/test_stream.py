@@ -0,0 +1,38 @@
+import json
+from flask_sqlalchemy_qs.response import iter_ndjson, to_dict
+from tests import User
+
+def test_stream_by_ctx(setup_entities):
+  users = User.query.stream_by_ctx(
+    filters={"person": {"age": {"lte": "22"}}},
+    sorts=[{"username": "ASC"}],
+    batch_size=1
+  )
+
+  assert [user.username for user in users] == [
+    "alex_username@example.com",
+    "david_username@example.com",
+    "ivan_username@example.com"
+  ]
+
+def test_stream_rows(setup_entities):
+  rows = User.query.columns_by_ctx(fields={"users": ["username"]}).stream_by_ctx(sorts=[{"id": "DESC"}])
+
+  assert to_dict(next(rows)) == {"username": "david_username@example.com"}
+
+def test_iter_ndjson_chunks():
+  chunks = list(iter_ndjson(range(5), serializer=lambda i: {"i": i}, chunk_size=2))
+
+  assert chunks == ['{"i": 0}\n{"i": 1}\n', '{"i": 2}\n{"i": 3}\n', '{"i": 4}\n']
+
+def test_ndjson_response(client, setup_entities):
+  response = client.get("/users/export?filters[person][age][eq]=20&sorts[0][id]=ASC")
+
+  assert response.status_code == 200
+  assert response.mimetype == "application/x-ndjson"
+
+  lines = [json.loads(line) for line in response.data.decode().splitlines()]
+  assert [line["username"] for line in lines] == [
+    "alex_username@example.com",
+    "ivan_username@example.com"
+  ]
@@ -0,0 +1,80 @@
+import pytest
+from sqlalchemy import text
+from flask_sqlalchemy_qs import BaseQuery, CtxBuilder, QueryTimeout, StatementTimeout, apply_timeouts, remove_timeouts
+from flask_sqlalchemy_qs.query.pagination import count_total
+from flask_sqlalchemy_qs.query.timeouts import COST_OPTION, TIMEOUT_OPTION
+from tests import db, User
+
+# Counts up to a hundred million, for seconds
+SLOW = text("(WITH RECURSIVE c(x) AS (SELECT 1 UNION ALL SELECT x + 1 FROM c WHERE x < 100000000) SELECT count(*) FROM c) > 0")
+
+class TimedQuery(BaseQuery):
+  statement_timeout = StatementTimeout(default=0.05, per_cost=0.01, max_seconds=0.2)
+
+@pytest.fixture
+def timeouts(setup_entities):
+  apply_timeouts(db.engine)
+  yield
+  remove_timeouts(db.engine)
+
+def test_statement_timeout_seconds():
+  timeout = StatementTimeout(default=1, per_cost=0.5, max_seconds=10)
+
+  assert timeout.seconds(0) == 1
+  assert timeout.seconds(4) == 3
+  assert timeout.seconds(100) == 10
+  assert timeout.for_ctx({"filters": {"username": {"icontains": "a"}}}) == 1 + 11 * 0.5
+  assert StatementTimeout(max_seconds=None).seconds(1000) == 52
+
+def test_timeout_by_ctx_adds_up(setup_entities):
+  query = TimedQuery(User, session=db.session()).filter_by_ctx({"username": {"eq": "a"}})
+  assert query.get_execution_options()[COST_OPTION] == 1
+
+  query = query.sort_by_ctx([{"person": {"age": "asc"}}])
+  options = query.get_execution_options()
+
+  assert options[COST_OPTION] == 7
+  assert options[TIMEOUT_OPTION] == pytest.approx(0.12)
+
+  # Without statement_timeout, the queries have no timeout
+  assert TIMEOUT_OPTION not in User.query.filter_by_ctx({"id": {"eq": "1"}}).get_execution_options()
+
+def test_query_timeout(timeouts):
+  query = TimedQuery(User, session=db.session()).filter_by_ctx({"username": {"icontains": "alex"}})
+
+  with pytest.raises(QueryTimeout) as error:
+    query.filter(SLOW).all()
+
+  assert error.value.code == 503
+  assert error.value.seconds == pytest.approx(0.16)
+  db.session.rollback()
+
+  # The next statements of the connection have no timeout
+  assert db.session.execute(text("SELECT count(*) FROM users")).scalar() == 4
+  assert len(query.all()) == 1
+
+def test_fast_query_within_timeout(timeouts):
+  users = TimedQuery(User, session=db.session()).filter_by_ctx({"username": {"icontains": "alex"}}).all()
+  assert len(users) == 1
+
+def test_select_timeout(timeouts):
+  statement = CtxBuilder().select(User, {"filters": {"id": {"gt": 0}}}).where(SLOW).execution_options(qs_timeout=0.05)
+
+  with pytest.raises(QueryTimeout):
+    db.session.execute(statement).all()
+
+  db.session.rollback()
+
+def test_query_timeout_response():
+  response = QueryTimeout(0.5).get_response()
+
+  assert response.status_code == 503
+  assert "0.5s" in response.get_data(as_text=True)
+
+def test_count_total_timeout(timeouts):
+  query = TimedQuery(User, session=db.session()).filter_by_ctx({"username": {"icontains": "alex"}}).filter(SLOW)
+
+  # The count of the query, capped or not, has its timeout
+  for mode, cap in (("concurrent", None), ("concurrent", 10), ("estimate", None)):
+    with pytest.raises(QueryTimeout):
+      count_total(query, User.__mapper__, mode, cap).result()
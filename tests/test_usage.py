@@ -0,0 +1,121 @@
+import json
+import threading
+import pytest
+from sqlalchemy import MetaData, Table, Column, ForeignKey, Integer, String, Index, func
+from flask_sqlalchemy_qs import BaseQuery, CtxBuilder, UsageRecorder, advise, create_index_sql, index_advisor_command
+from tests import app, db, User, Email
+
+class RecordedQuery(BaseQuery):
+  usage_recorder = UsageRecorder()
+
+@pytest.fixture
+def recorder(setup_entities):
+  RecordedQuery.usage_recorder.clear()
+  RecordedQuery.usage_recorder.listen(db.engine)
+  yield RecordedQuery.usage_recorder
+  RecordedQuery.usage_recorder.remove(db.engine)
+
+def users_query():
+  return RecordedQuery(User, session=db.session())
+
+def test_usage_recorder(recorder):
+  for _ in range(3):
+    users_query().filter_by_ctx({"username": {"eq": "alex"}}).sort_by_ctx([{"id": "desc"}]).all()
+  users_query().filter_by_ctx({"person": {"age": {"gt": "20"}}}).all()
+  # Untagged queries are not recorded
+  User.query.filter_by_ctx({"username": {"eq": "alex"}}).all()
+
+  report = recorder.report()
+  columns = report["columns"]
+
+  assert columns["users.username"]["filters"] == {"eq": 3}
+  assert columns["users.username"]["count"] == 3
+  assert columns["users.id"]["sorts"] == {"desc": 3}
+  assert columns["persons.age"]["filters"] == {"gt": 1}
+  assert sum(pattern["count"] for pattern in report["patterns"]) == 4
+  assert all(pattern["latency"] > 0 for pattern in report["patterns"])
+  json.dumps(report)
+
+def test_usage_recorder_threads(recorder):
+  usage = (User.__mapper__, (), ())
+
+  def work():
+    for _ in range(1000):
+      recorder.record(usage, 0.001)
+
+  threads = [threading.Thread(target=work) for _ in range(4)]
+  for thread in threads:
+    thread.start()
+  for thread in threads:
+    thread.join()
+
+  count, total, slowest = recorder.snapshot()[usage]
+  assert count == 4000
+  assert total == pytest.approx(4)
+  assert slowest == 0.001
+
+def test_usage_recorder_select(recorder):
+  builder = CtxBuilder(usage_recorder=recorder)
+  statement = builder.select(Email, {"filters": {"user": {"username": {"istartswith": "a"}}}, "sorts": [{"address": "asc"}]})
+  db.session.execute(statement).all()
+
+  pattern, = recorder.report()["patterns"]
+  assert pattern["table"] == "emails"
+  assert pattern["filters"] == [("users", "username", "istartswith")]
+  assert pattern["sorts"] == [("emails", "address", "asc")]
+  assert pattern["joins"] == [("users", ("id",))]
+
+def test_advise():
+  metadata = MetaData()
+  Table("users", metadata, Column("id", Integer, primary_key=True), Column("username", String), Column("group_id", Integer))
+  Table("emails", metadata, Column("id", Integer, primary_key=True), Column("user_id", Integer), Column("address", String), Index("ix_address", func.lower(Column("address"))))
+  report = {"patterns": [
+    {"table": "users", "filters": [("users", "group_id", "eq"), ("users", "username", "icontains")], "sorts": [("users", "id", "desc")], "joins": [], "count": 10, "latency": 1.0},
+    {"table": "users", "filters": [("users", "group_id", "in")], "sorts": [], "joins": [], "count": 5, "latency": 0.2},
+    {"table": "users", "filters": [("users", "id", "eq")], "sorts": [], "joins": [("emails", ("user_id",))], "count": 2, "latency": 0.1},
+    {"table": "emails", "filters": [("emails", "address", "istartswith"), ("emails", "user_id", "istartswith")], "sorts": [], "joins": [], "count": 1, "latency": 0.01},
+  ]}
+
+  suggestions = advise(report, metadata)
+
+  assert [(s.table, s.columns, s.count) for s in suggestions] == [
+    ("users", ("group_id", "id"), 15),
+    ("emails", ("user_id",), 2),
+    ("emails", ("lower(user_id)",), 1),
+  ]
+  assert suggestions[0].reason == "filter and sort"
+  assert create_index_sql(suggestions[0]) == "CREATE INDEX ix_users_group_id_id ON users (group_id, id)"
+  assert create_index_sql(suggestions[2]) == "CREATE INDEX ix_emails_lower_user_id ON emails (lower(user_id))"
+  assert advise(report, metadata, min_count=20) == []
+
+def test_index_advisor_command(recorder, tmp_path):
+  users_query().filter_by_ctx({"username": {"istartswith": "a"}}).all()
+  path = tmp_path / "usage.json"
+  recorder.dump(str(path))
+
+  result = app.test_cli_runner().invoke(index_advisor_command, [str(path)])
+
+  assert result.exit_code == 0
+  assert "CREATE INDEX ix_users_lower_username ON users (lower(username));" in result.output
+
+def test_advise_foreign_key_join():
+  metadata = MetaData()
+  Table("users", metadata, Column("id", Integer, primary_key=True))
+  Table("emails", metadata, Column("id", Integer, primary_key=True), Column("user_id", Integer, ForeignKey("users.id")))
+  report = {"patterns": [
+    {"table": "users", "filters": [], "sorts": [], "joins": [("emails", ("user_id",))], "count": 3, "latency": 0.1},
+  ]}
+
+  # A foreign key creates no index
+  assert [(s.table, s.columns) for s in advise(report, metadata)] == [("emails", ("user_id",))]
+
+def test_usage_recorder_ended_threads(recorder):
+  usage = (User.__mapper__, (), ())
+  threads = [threading.Thread(target=recorder.record, args=(usage, 0.5)) for _ in range(20)]
+
+  for thread in threads:
+    thread.start()
+    thread.join()
+
+  assert len(recorder._threads) <= 1
+  assert recorder.snapshot()[usage][:2] == (20, 10)